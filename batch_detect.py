@@ -0,0 +1,171 @@
+"""
+离线批量识别：用进程池对目录/通配符下的图片批量运行 detect_objects，
+输出每张图片的识别结果（JSON/CSV）与可选的标注图，并统计吞吐量（张/秒）
+适用于修改 HSV 阈值或相机标定后重新处理历史图片
+
+    python batch_detect.py assets/debug_for_angel "results/original/*.jpg" --json out.json --csv out.csv
+"""
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+
+from detect import detect_objects, parse_workpiece_info
+from persistence import encode_and_write
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# 不指定输入时处理的默认目录
+DEFAULT_INPUTS = [
+    "assets/captured_for_hsv",
+    "assets/debug_for_angel",
+    "assets/img_angel_0",
+    "results/original",
+]
+
+CSV_FIELDS = ["image", "slot", "shape", "x", "y", "angle", "info"]
+
+
+def collect_images(inputs):
+    """展开目录、通配符与文件路径，按路径排序并去重"""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in os.listdir(item)]
+        else:
+            candidates = glob.glob(item)
+        for path in candidates:
+            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                paths.add(os.path.normpath(path))
+    return sorted(paths)
+
+
+# ==== 子进程 ====
+_worker_options = {}
+
+
+def _init_worker(options):
+    # 每个进程只用一个 OpenCV 线程，并行度由进程池提供
+    cv2.setNumThreads(1)
+    _worker_options.update(options)
+
+
+def _silent(_message):
+    pass
+
+
+def process_image(path):
+    """识别单张图片，返回可序列化的结果（不回传图像，避免进程间拷贝大数组）"""
+    options = _worker_options
+    record = {"image": path, "workpieces": [], "detect_time": None, "error": None}
+    image = cv2.imread(path)
+    if image is None:
+        record["error"] = "无法读取图片"
+        return record
+
+    started_at = time.perf_counter()
+    try:
+        detection, workpiece_info_list = detect_objects(
+            image, log_callback=print if options.get("verbose") else _silent,
+            pyramid_level=options.get("pyramid_level", 0))
+    except Exception as e:
+        record["error"] = str(e)
+        return record
+    record["detect_time"] = time.perf_counter() - started_at
+    record["workpieces"] = [dict(parse_workpiece_info(info), info=info) for info in workpiece_info_list]
+
+    annotate_dir = options.get("annotate_dir")
+    if annotate_dir is not None:
+        name = os.path.splitext(os.path.basename(path))[0]
+        # 只在需要保存时按输出分辨率渲染标注图
+        annotated = detection.render(image, scale=options.get("annotate_scale", 1.0))
+        encode_and_write(os.path.join(annotate_dir, f"{name}.jpg"), annotated)
+    return record
+
+
+# ==== 输出 ====
+def write_json(path, records, summary):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "images": records}, f, ensure_ascii=False, indent=2)
+
+
+def write_csv(path, records):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for record in records:
+            for workpiece in record["workpieces"]:
+                writer.writerow({"image": record["image"], **{key: workpiece[key] for key in CSV_FIELDS[1:]}})
+
+
+def run_batch(paths, workers=None, pyramid_level=0, annotate_dir=None, annotate_scale=1.0, verbose=False,
+              progress=print):
+    """批量识别，返回 (按输入顺序的结果列表, 汇总统计)"""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(paths) or 1))
+    if annotate_dir is not None:
+        os.makedirs(annotate_dir, exist_ok=True)
+    options = {"pyramid_level": pyramid_level, "annotate_dir": annotate_dir,
+               "annotate_scale": annotate_scale, "verbose": verbose}
+
+    records = []
+    started_at = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(options,)) as pool:
+        # imap 保持输入顺序，chunksize 减少进程间调度开销
+        chunksize = max(1, len(paths) // (workers * 4))
+        for i, record in enumerate(pool.imap(process_image, paths, chunksize=chunksize), 1):
+            records.append(record)
+            if record["error"] is not None:
+                progress(f"[{i}/{len(paths)}] {record['image']} 失败: {record['error']}")
+            else:
+                progress(f"[{i}/{len(paths)}] {record['image']} 工件 {len(record['workpieces'])} 个，"
+                         f"耗时 {record['detect_time'] * 1000:.0f} ms")
+    elapsed = time.perf_counter() - started_at
+
+    summary = {
+        "images": len(paths),
+        "failed": sum(record["error"] is not None for record in records),
+        "workpieces": sum(len(record["workpieces"]) for record in records),
+        "workers": workers,
+        "elapsed": elapsed,
+        "images_per_second": len(paths) / elapsed if elapsed > 0 else 0.0,
+    }
+    return records, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量识别（多进程）")
+    parser.add_argument("inputs", nargs="*", help="图片目录、通配符或文件，默认处理 assets 与 results/original 下的图片")
+    parser.add_argument("--json", help="JSON 结果输出路径")
+    parser.add_argument("--csv", help="CSV 结果输出路径（每行一个工件）")
+    parser.add_argument("--annotate-dir", help="标注图输出目录，不指定则不保存")
+    parser.add_argument("--annotate-scale", type=float, default=1.0, help="标注图缩放比例")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认等于 CPU 核数")
+    parser.add_argument("--pyramid-level", type=int, default=0, help="金字塔粗检测层数，0 表示全分辨率")
+    parser.add_argument("--verbose", action="store_true", help="输出每个工件的识别日志")
+    args = parser.parse_args()
+
+    paths = collect_images(args.inputs or DEFAULT_INPUTS)
+    if not paths:
+        print("[系统] 没有找到图片")
+        return
+
+    records, summary = run_batch(paths, workers=args.workers, pyramid_level=args.pyramid_level,
+                                 annotate_dir=args.annotate_dir, annotate_scale=args.annotate_scale,
+                                 verbose=args.verbose)
+    if args.json:
+        write_json(args.json, records, summary)
+    if args.csv:
+        write_csv(args.csv, records)
+    print(f"[系统] 共 {summary['images']} 张（失败 {summary['failed']}），工件 {summary['workpieces']} 个，"
+          f"{summary['workers']} 进程，用时 {summary['elapsed']:.1f} s，{summary['images_per_second']:.2f} 张/秒")
+
+
+if __name__ == "__main__":
+    main()
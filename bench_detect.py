@@ -0,0 +1,236 @@
+"""
+识别流水线分阶段基准测试
+用 assets 下的样例图片逐阶段重放 detect_objects 的处理流程，统计各阶段耗时的
+中位数与 p95（按图像尺寸分组），结果以 JSON 输出，便于跨提交对比、发现性能回退
+
+    python bench_detect.py --repeat 5 --output bench.json
+    python bench_detect.py --compare bench.json --threshold 0.15
+    python bench_detect.py --pyramid-level 1      # 额外统计金字塔模式的端到端耗时（total_pyramid）
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+from batch_detect import collect_images
+from detect import (COLOR_SHAPE_MAP, MORPH_KERNEL_SIZE, analyze_polygons, approximate_contour, classify_contour,
+                    color_classifier, detect_objects, polygon_centroid, select_reference_angle)
+from utils.overlay import DetectionRecord
+from utils.pixel2world import get_calibration_model, get_world_lut
+
+DEFAULT_INPUTS = [
+    "assets/captured_for_hsv",
+    "assets/debug_for_angel",
+    "assets/img_angel_0",
+]
+
+# 阶段顺序（与 iter_detected_objects / detect_objects 的处理顺序一致）
+STAGES = [
+    "cvt_color",              # BGR → HSV
+    "color_mask",             # 颜色分割（查表分类 + 各颜色取掩码）
+    "morph_open",
+    "morph_close",
+    "find_contours",
+    "approx_polygons",        # 逐个轮廓 approxPolyDP
+    "analyze_polygons",       # 每种颜色一次批量计算形状、质心与参考角
+    "legacy_classify",        # 旧的逐个轮廓版本：classify_contour（不计入识别流程，仅供对比）
+    "legacy_reference_angle", # 旧的逐个轮廓版本：质心 + select_reference_angle
+    "pixel_to_world",         # 像素 → 世界坐标：整幅图查找表插值（识别流程使用的路径）
+    "pixel_to_world_model",   # 像素 → 世界坐标：标定模型精确计算（去畸变 + 单应，仅供对比）
+    "render_preview",         # 按界面预览分辨率渲染标注图
+    "render_full",            # 按原图分辨率渲染标注图（归档，在保存线程中执行）
+    "total",                  # detect_objects 端到端
+]
+PYRAMID_STAGE = "total_pyramid"  # detect_objects(pyramid_level=N) 端到端，仅在指定 --pyramid-level 时统计
+
+PREVIEW_SIZE = (640, 512)
+
+
+class StageTimer:
+    """累计一次运行中各阶段的耗时（秒），没有执行到的阶段记为 0"""
+
+    def __init__(self, stages=STAGES):
+        self.elapsed = dict.fromkeys(stages, 0.0)
+
+    def measure(self, stage, func, *args, **kwargs):
+        started_at = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.elapsed[stage] += time.perf_counter() - started_at
+        return result
+
+
+def _silent(_message):
+    pass
+
+
+def _approximate_all(contours):
+    return [approx for approx in map(approximate_contour, contours) if approx is not None]
+
+
+def stage_names(pyramid_level=0):
+    return STAGES + [PYRAMID_STAGE] if pyramid_level else STAGES
+
+
+def run_stages(image, world_lut, calibration, pyramid_level=0):
+    """
+    按阶段重放一次识别流程，返回 {阶段: 耗时}
+    world_lut 为该分辨率的查找表（与识别进程一致），calibration 为标定模型
+    """
+    timer = StageTimer(stage_names(pyramid_level))
+    record = DetectionRecord(image.shape)
+    hsv = timer.measure("cvt_color", cv2.cvtColor, image, cv2.COLOR_BGR2HSV)
+    label_map = timer.measure("color_mask", color_classifier.classify, hsv)
+    kernel = np.ones((MORPH_KERNEL_SIZE, MORPH_KERNEL_SIZE), np.uint8)
+
+    for color_name in color_classifier.color_names:
+        mask = timer.measure("color_mask", color_classifier.mask, label_map, color_name)
+        mask = timer.measure("morph_open", cv2.morphologyEx, mask, cv2.MORPH_OPEN, kernel)
+        mask = timer.measure("morph_close", cv2.morphologyEx, mask, cv2.MORPH_CLOSE, kernel)
+        contours, _ = timer.measure("find_contours", cv2.findContours, mask, cv2.RETR_EXTERNAL,
+                                    cv2.CHAIN_APPROX_SIMPLE)
+        expected_shape = COLOR_SHAPE_MAP[color_name]
+        polygons = timer.measure("approx_polygons", _approximate_all, contours)
+        if polygons:
+            shapes, centers, angles, base_lines, _ = timer.measure("analyze_polygons", analyze_polygons, polygons)
+            for i, approx_corners in enumerate(polygons):
+                if shapes[i] == expected_shape and not np.isnan(centers[i, 0]):
+                    record.add(color_name, shapes[i], approx_corners, (int(centers[i, 0]), int(centers[i, 1])),
+                               angles[i], base_lines[i])
+
+        for contour in contours:
+            shape, approx_corners = timer.measure("legacy_classify", classify_contour, contour)
+            if shape != expected_shape:
+                continue
+            started_at = time.perf_counter()
+            polygon_centroid(approx_corners)
+            select_reference_angle(shape, approx_corners.reshape(-1, 2))
+            timer.elapsed["legacy_reference_angle"] += time.perf_counter() - started_at
+
+    centers = np.array([obj.center for obj in record], dtype=np.float32).reshape(-1, 2)
+    timer.measure("pixel_to_world", world_lut.to_world, centers)
+    timer.measure("pixel_to_world_model", calibration.to_world, centers)
+
+    timer.measure("render_preview", record.render, image, PREVIEW_SIZE)
+    timer.measure("render_full", record.render, image)
+
+    timer.measure("total", detect_objects, image, log_callback=_silent, calibration=world_lut)
+    if pyramid_level:
+        timer.measure(PYRAMID_STAGE, detect_objects, image, log_callback=_silent, calibration=world_lut,
+                      pyramid_level=pyramid_level)
+    return timer.elapsed
+
+
+def summarize(samples):
+    """样本（秒）→ 统计量（毫秒）"""
+    values = np.asarray(samples) * 1000
+    return {
+        "n": int(values.size),
+        "median_ms": float(np.median(values)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "mean_ms": float(values.mean()),
+        "min_ms": float(values.min()),
+    }
+
+
+def run_benchmark(paths, repeat=5, warmup=1, progress=print, pyramid_level=0):
+    """返回 {图像尺寸: {阶段: 统计量}}，尺寸形如 '2592x1944'"""
+    calibration = get_calibration_model()
+    samples = defaultdict(lambda: defaultdict(list))
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            progress(f"[跳过] 无法读取 {path}")
+            continue
+        size = f"{image.shape[1]}x{image.shape[0]}"
+        world_lut = get_world_lut(image.shape[1], image.shape[0])  # 首次使用时生成或映射，不计入统计
+        for _ in range(warmup):
+            run_stages(image, world_lut, calibration, pyramid_level)
+        for _ in range(repeat):
+            for stage, elapsed in run_stages(image, world_lut, calibration, pyramid_level).items():
+                samples[size][stage].append(elapsed)
+        progress(f"[完成] {path} ({size})")
+
+    return {size: {stage: summarize(stage_samples[stage]) for stage in stage_names(pyramid_level)
+                   if stage in stage_samples}
+            for size, stage_samples in samples.items()}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_threads": cv2.getNumThreads(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(baseline, current, threshold):
+    """对比两次结果的中位数，返回超过 threshold（比例）的回退列表"""
+    regressions = []
+    for size, stages in current.items():
+        for stage, stats in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if base is None or base["median_ms"] <= 0:
+                continue
+            change = stats["median_ms"] / base["median_ms"] - 1
+            if change > threshold:
+                regressions.append((size, stage, base["median_ms"], stats["median_ms"], change))
+    return regressions
+
+
+def print_table(results):
+    for size, stages in results.items():
+        print(f"\n== {size}")
+        print(f"{'stage':<24}{'median(ms)':>12}{'p95(ms)':>12}{'n':>6}")
+        for stage, stats in stages.items():
+            print(f"{stage:<24}{stats['median_ms']:>12.2f}{stats['p95_ms']:>12.2f}{stats['n']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="识别流水线分阶段基准测试")
+    parser.add_argument("inputs", nargs="*", help="图片目录、通配符或文件，默认使用 assets 下的样例图片")
+    parser.add_argument("--repeat", type=int, default=5, help="每张图片重复次数")
+    parser.add_argument("--warmup", type=int, default=1, help="每张图片预热次数（不计入统计）")
+    parser.add_argument("--output", help="JSON 结果输出路径")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    parser.add_argument("--threshold", type=float, default=0.10, help="中位数变慢超过该比例视为回退")
+    parser.add_argument("--pyramid-level", type=int, default=0, help="同时统计该金字塔层数下的端到端耗时，0 为不统计")
+    args = parser.parse_args()
+
+    paths = collect_images(args.inputs or DEFAULT_INPUTS)
+    results = run_benchmark(paths, repeat=args.repeat, warmup=args.warmup, pyramid_level=args.pyramid_level)
+    print_table(results)
+
+    report = {"environment": environment(), "repeat": args.repeat, "pyramid_level": args.pyramid_level,
+              "images": len(paths), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline["results"], results, args.threshold)
+        for size, stage, before, after, change in regressions:
+            print(f"[回退] {size} {stage}: {before:.2f} ms → {after:.2f} ms (+{change * 100:.0f}%)")
+        if regressions:
+            sys.exit(1)
+        print(f"\n[系统] 与 {baseline['environment'].get('commit')} 相比无超过 {args.threshold * 100:.0f}% 的回退")
+
+
+if __name__ == "__main__":
+    main()
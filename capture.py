@@ -0,0 +1,194 @@
+import multiprocessing
+import queue
+import threading
+import time
+
+from frame_sources import CameraSource
+from metrics import (CAPTURE_READ_FAILURES, CAPTURE_READ_SECONDS, FRAMES_CAPTURED, FRAMES_DROPPED,
+                     LAST_FRAME_TIMESTAMP, SOURCE_FPS, SOURCE_FRAMES_DROPPED)
+from utils.frame_buffer import FrameRingBuffer, SharedFrameRingBuffer
+
+
+class FrameGrabber:
+    """
+    采集核心（不依赖 Qt）：把帧源的帧直接读入预分配的环形缓冲区
+    帧源默认为 cam_id 对应的相机，也可以传入目录回放或视频文件等其他帧源（见 frame_sources）
+    run() 为阻塞循环，由 QThread（界面）或 threading.Thread（无界面服务）驱动
+    """
+
+    def __init__(self, cam_id=1, num_slots=4, width=2592, height=1944, fps=10, frame_buffer=None, source=None,
+                 log_callback=print):
+        self.cam_id = cam_id
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.log_callback = log_callback
+        self.running = True
+        self.source = source if source is not None else CameraSource(cam_id, width, height, fps)
+        self.source.log_callback = log_callback
+        # 预分配的帧环形缓冲区，读者持有引用而不是拷贝；可传入 SharedFrameRingBuffer 供其他进程读取
+        self.frame_buffer = frame_buffer if frame_buffer is not None else FrameRingBuffer(num_slots)
+        self.dropped_frames = 0
+
+    def open(self):
+        """打开帧源，失败返回 None"""
+        if not self.source.open():
+            return None
+        return self.source
+
+    def run(self, on_frame=None):
+        """采集循环，每发布一帧调用一次 on_frame(frame)"""
+        source = self.open()
+        if source is None:
+            return
+
+        width, height = source.frame_size
+        self.frame_buffer.allocate((height, width, 3))
+        source_dropped = 0
+
+        try:
+            while self.running:
+                slot_index = self.frame_buffer.acquire_write_slot()
+                if slot_index is None:
+                    # 所有槽位都被读者占用，丢弃这一帧
+                    source.grab()
+                    self.dropped_frames += 1
+                    FRAMES_DROPPED.inc()
+                    continue
+                started_at = time.perf_counter()
+                ret, frame = source.read(image=self.frame_buffer.slots[slot_index])
+                CAPTURE_READ_SECONDS.observe(time.perf_counter() - started_at)
+                if source.dropped > source_dropped:
+                    SOURCE_FRAMES_DROPPED.inc(source.dropped - source_dropped)
+                    source_dropped = source.dropped
+                if not ret:
+                    if source.exhausted:
+                        self.log_callback("[系统] 回放结束")
+                        break
+                    CAPTURE_READ_FAILURES.inc()
+                    continue
+                self.frame_buffer.publish(slot_index, frame)
+                FRAMES_CAPTURED.inc()
+                LAST_FRAME_TIMESTAMP.set(time.time())
+                SOURCE_FPS.set(source.achieved_fps)
+                if on_frame is not None:
+                    on_frame(frame)
+        finally:
+            source.release()
+
+    def acquire_current_frame(self):
+        """获取当前帧的只读引用（不拷贝），用完需 release()"""
+        return self.frame_buffer.acquire_latest()
+
+    def get_current_frame(self):
+        frame_ref = self.acquire_current_frame()
+        if frame_ref is None:
+            return None
+        with frame_ref:
+            return frame_ref.frame.copy()
+
+    def stop(self):
+        self.running = False
+
+
+def capture_process_main(source, frame_buffer, stop_event, logs):
+    """采集子进程入口：帧源（尚未打开）的帧写入共享帧缓冲区，日志写入 logs 队列，stop_event 置位后退出"""
+    grabber = FrameGrabber(frame_buffer=frame_buffer, source=source, log_callback=logs.put)
+
+    def watch_stop():
+        # 轮询而不是 stop_event.wait()：等待者所在进程退出后，另一端 set() 时会一直等它确认
+        while not stop_event.is_set():
+            time.sleep(0.1)
+        grabber.stop()
+
+    def on_frame(frame):
+        frame_buffer.dropped_frames = grabber.dropped_frames
+
+    threading.Thread(target=watch_stop, daemon=True).start()
+    try:
+        grabber.run(on_frame=on_frame)
+    except Exception as e:
+        logs.put(f"[采集错误] {e}")
+
+
+class ProcessCapture:
+    """
+    在独立进程中运行 FrameGrabber，帧经共享内存环形缓冲区（SharedFrameRingBuffer）传给本进程，
+    接口与 FrameGrabber 相同；采集不再与界面、识别争用本进程的 GIL
+    run() 在本进程中等待新帧并调用 on_frame(frame)（生成预览），同时按共享缓冲区中的帧序号与丢帧数累计采集指标
+    """
+
+    def __init__(self, cam_id=1, num_slots=4, width=2592, height=1944, fps=10, source=None, log_callback=print):
+        self.cam_id = cam_id
+        self.width = width
+        self.height = height
+        self.fps = fps
+        # 帧源在子进程中打开；共享槽位按 width x height 分配，帧源的帧尺寸不能超过它
+        self.source = source if source is not None else CameraSource(cam_id, width, height, fps)
+        self.log_callback = log_callback
+        self.running = True
+        self._context = multiprocessing.get_context("spawn")
+        self.frame_buffer = SharedFrameRingBuffer(num_slots, (height, width, 3), context=self._context)
+        self._stop_event = self._context.Event()
+        self._logs = self._context.Queue()
+        self._process = None
+
+    @property
+    def dropped_frames(self):
+        return self.frame_buffer.dropped_frames
+
+    def _drain_logs(self):
+        while True:
+            try:
+                self.log_callback(self._logs.get_nowait())
+            except queue.Empty:
+                return
+
+    def run(self, on_frame=None):
+        """启动采集进程并转发新帧，直到 stop() 或采集进程退出"""
+        self._process = self._context.Process(
+            target=capture_process_main, name="capture", daemon=True,
+            args=(self.source, self.frame_buffer, self._stop_event, self._logs))
+        self._process.start()
+        seq = dropped = 0
+        try:
+            while self.running:
+                self._drain_logs()
+                frame_ref = self.frame_buffer.wait_latest(seq, timeout=0.5)
+                if frame_ref is None:
+                    if not self._process.is_alive():
+                        self.log_callback("[系统] 采集进程已退出")
+                        break
+                    continue
+                with frame_ref:
+                    FRAMES_CAPTURED.inc(frame_ref.seq - seq)
+                    LAST_FRAME_TIMESTAMP.set(time.time())
+                    seq = frame_ref.seq
+                    if self.frame_buffer.dropped_frames > dropped:
+                        FRAMES_DROPPED.inc(self.frame_buffer.dropped_frames - dropped)
+                        dropped = self.frame_buffer.dropped_frames
+                    if on_frame is not None:
+                        on_frame(frame_ref.frame)
+        finally:
+            self._stop_event.set()
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._drain_logs()
+
+    def acquire_current_frame(self):
+        """获取当前帧的只读引用（不拷贝），用完需 release()"""
+        return self.frame_buffer.acquire_latest()
+
+    def get_current_frame(self):
+        frame_ref = self.acquire_current_frame()
+        if frame_ref is None:
+            return None
+        with frame_ref:
+            return frame_ref.frame.copy()
+
+    def stop(self):
+        self.running = False
+        self._stop_event.set()
+        # 只删除名称，各进程已有的映射不受影响（识别进程可能仍在读取）
+        self.frame_buffer.unlink()
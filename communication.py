@@ -1,102 +1,348 @@
-from PyQt5.QtCore import QThread, pyqtSignal
-import socket
-import threading
-from PyQt5.QtCore import QThread, pyqtSignal
-import socket
-import threading
-import time 
-
-class TCPServerThread(QThread):
-    message_signal = pyqtSignal(str)
-
-    def __init__(self, workpiece_info_list, host='192.168.1.100', port=2000, buffer_size=1024):
-        super().__init__()
+import asyncio
+import time
+
+try:
+    from PyQt5.QtCore import QThread, pyqtSignal
+except ImportError:  # 无界面服务模式下不需要 Qt
+    QThread = None
+
+from metrics import (PLC_CONNECTIONS, PLC_REQUESTS, PLC_ROUND_TRIP_SECONDS, PLC_SEND_ERRORS,
+                     PLC_SEND_SECONDS)
+from result_channel import ResultChannel
+
+
+# 发送模式
+#   legacy: 兼容旧协议，逐条发送工件信息，每条之间固定延时 send_interval 秒
+#   batch:  整盘工件信息拼成一条消息一次发出
+#   ack:    逐条发送，每条等待 PLC 回复 ACK* 后再发下一条
+SEND_MODES = ("legacy", "batch", "ack")
+RECORD_TERMINATOR = b"*"
+
+
+class TCPServer:
+    """
+    基于 asyncio 的 PLC 通讯服务（不依赖 Qt）：一个事件循环同时服务多个 PLC/仿真连接，
+    日志通过 log_callback 输出；run() 阻塞运行事件循环，stop() 可在任意线程调用
+    batch/ack 模式下 PLC 发来的数据按 '*' 结尾的记录流式解析（如 OK*、ACK*），
+    能正确处理被拆分或合并的 TCP 报文
+    """
+    def __init__(self, result_channel=None, host='192.168.1.100', port=2000, buffer_size=1024,
+                 read_timeout=None, write_timeout=5.0, max_connections=16,
+                 capture_callback=None, plc_trigger=False, trigger_timeout=10.0,
+                 send_mode="legacy", send_interval=1.0, ack_token="ACK", ack_timeout=5.0, log_callback=print):
+        if send_mode not in SEND_MODES:
+            raise ValueError(f"Unsupported send mode: {send_mode}")
         self.host = host
         self.port = port
         self.buffer_size = buffer_size
+        self.read_timeout = read_timeout      # 连接空闲超时（秒），None 表示不超时
+        self.write_timeout = write_timeout    # 发送缓冲区排空超时（秒）
+        self.max_connections = max_connections
+        self.send_mode = send_mode
+        self.send_interval = send_interval    # legacy 模式下每条之间的延时（秒）
+        self.ack_token = ack_token            # ack 模式下 PLC 的确认记录
+        self.ack_timeout = ack_timeout        # ack 模式下等待确认的超时（秒）
+        self.log_callback = log_callback
         self.running = True
 
-        # 工件信息列表
-        self.workpiece_info_list = workpiece_info_list
-        self.workpiece_index = 0
+        # 识别结果通道（版本化快照）
+        self.result_channel = result_channel if result_channel is not None else ResultChannel()
+
+        # PLC 触发拍照：收到 OK 时调用 capture_callback(timings) 取最新帧并提交识别，
+        # 返回 False 表示触发失败；timings 记录各环节时间戳，识别结果随快照带回
+        self.capture_callback = capture_callback
+        self.plc_trigger = plc_trigger
+        self.trigger_timeout = trigger_timeout
+        self.last_cycle_timings = None
+        self._next_trigger_id = 0
+
+        self._loop = None
+        self._stop_event = None
+        self._client_tasks = set()
 
     def run(self):
         try:
-            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            server.bind((self.host, self.port))
-            server.listen(1)
-            self.message_signal.emit(f"[监听] 等待来自 PLC 的连接 {self.host}:{self.port}...")
-
-            while self.running:
-                conn, addr = server.accept()
-                self.message_signal.emit(f"[连接成功] 来自 {addr}")
-                client_thread = threading.Thread(target=self.handle_client, args=(conn, addr))
-                client_thread.daemon = True
-                client_thread.start()
+            asyncio.run(self.serve())
         except Exception as e:
-            self.message_signal.emit(f"[服务器错误] {e}")
+            self.log_callback(f"[服务器错误] {e}")
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        if not self.running:
+            return
+
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.log_callback(f"[监听] 等待来自 PLC 的连接 {self.host}:{self.port}...")
+        async with server:
+            await self._stop_event.wait()
+
+        # 取消所有连接任务，立即退出
+        for task in list(self._client_tasks):
+            task.cancel()
+        await asyncio.gather(*self._client_tasks, return_exceptions=True)
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        task = asyncio.current_task()
+        if len(self._client_tasks) >= self.max_connections:
+            self.log_callback(f"[拒绝连接] 来自 {addr}，连接数已达上限 {self.max_connections}")
+            writer.close()
+            return
+        self._client_tasks.add(task)
+        PLC_CONNECTIONS.inc()
+        self.log_callback(f"[连接成功] 来自 {addr}")
 
-    def handle_client(self, conn, addr):
         try:
             while self.running:
-                data = conn.recv(self.buffer_size)
-                if not data:
-                    self.message_signal.emit(f"[断开连接] 来自 {addr}")
-                    break
+                if self.send_mode == "legacy":
+                    try:
+                        data = await asyncio.wait_for(reader.read(self.buffer_size), self.read_timeout)
+                    except asyncio.TimeoutError:
+                        self.log_callback(f"[超时] {addr} {self.read_timeout}s 内无数据，断开连接")
+                        break
+                    if not data:
+                        self.log_callback(f"[断开连接] 来自 {addr}")
+                        break
+                    ## 接受PLC发送的数据
+                    msg = data.decode("ascii", errors="ignore")
+                else:
+                    try:
+                        msg = await self.read_record(reader, self.read_timeout)
+                    except asyncio.TimeoutError:
+                        self.log_callback(f"[超时] {addr} {self.read_timeout}s 内无数据，断开连接")
+                        break
+                    if msg is None:
+                        self.log_callback(f"[断开连接] 来自 {addr}")
+                        break
 
-                ## 接受PLC发送的数据
-                # msg = data.decode('utf-8').strip()
-                msg = data.decode("ascii", errors="ignore")
-                self.message_signal.emit(f"[接收] {msg} 从 {addr}")
+                self.log_callback(f"[接收] {msg} 从 {addr}")
 
                 if "OK" in msg:
-                    # 等待 workpiece_info_list 有内容或超时
-                    self.message_signal.emit(f"[提示] 接收到OK,开始拍照识别！")
-                    self.workpiece_index = 0 # 索引清零
-                    
-                    timeout = 4
-                    waited = 0
-                    while self.running and not self.workpiece_info_list and waited < timeout:
-                        time.sleep(0.1)
-                        waited += 0.1
-
-                    self.message_signal.emit(f"[提示] 工件总数: {len(self.workpiece_info_list)}")
-                    while self.workpiece_index < len(self.workpiece_info_list):
-                        info = self.workpiece_info_list[self.workpiece_index]
-                        try:
-                            conn.sendall(info.encode('utf-8'))
-                            self.message_signal.emit(f"[发送] {info}")
-                        except Exception as e:
-                            self.message_signal.emit(f"[发送错误] {e}")
-                            break  # 出错就停止发送
-                        self.workpiece_index += 1
-                        time.sleep(1)  # 延迟一秒再发送下一个工件
-
-                # if "OK" in msg:
-                #     # 等待 workpiece_info_list 有内容或超时
-                #     timeout = 4  # 最多等待 4 秒
-                #     waited = 0
-                #     while self.running and not self.workpiece_info_list and waited < timeout:
-                #         time.sleep(0.1)
-                #         waited += 0.1
-                        
-                #     self.message_signal.emit(f"[提示] 工件总数: {len(self.workpiece_info_list)}")
-
-                #     if self.workpiece_index < len(self.workpiece_info_list):
-                #         info = self.workpiece_info_list[self.workpiece_index]
-                #         conn.sendall(info.encode('utf-8'))
-                #         self.message_signal.emit(f"[发送] {info}")
-                #         time.sleep(1)  # 1s发送一次
-                #         self.workpiece_index += 1
+                    trigger_received = time.perf_counter()
+                    PLC_REQUESTS.inc(mode=self.send_mode)
+                    self.log_callback(f"[提示] 接收到OK,开始拍照识别！")
 
+                    if self.plc_trigger and self.capture_callback is not None:
+                        # PLC 直接触发拍照识别，等待本次触发对应的结果
+                        snapshot = await self.trigger_and_wait(trigger_received)
+                        if snapshot is None:
+                            continue
+                    else:
+                        # 没有可用结果时等待下一次发布（最多 4 秒），发布后立即唤醒
+                        snapshot = await self.wait_for_results(timeout=4)
+
+                    if snapshot.complete:
+                        self.log_callback(f"[提示] 工件总数: {len(snapshot.workpiece_info_list)}")
+                    else:
+                        self.log_callback(f"[提示] 流式识别中，边识别边发送")
+                    first_sent = await self.send_tray(reader, writer, snapshot, addr)
+                    if first_sent is not None:
+                        PLC_ROUND_TRIP_SECONDS.observe(first_sent - trigger_received)
+
+        except asyncio.CancelledError:
+            self.log_callback(f"[断开连接] 服务停止，关闭 {addr}")
         except Exception as e:
-            self.message_signal.emit(f"[客户端异常] {e}")
+            self.log_callback(f"[客户端异常] {e}")
         finally:
-            conn.close()
+            self._client_tasks.discard(task)
+            PLC_CONNECTIONS.dec()
+            writer.close()
+
+    async def read_record(self, reader, timeout):
+        """读取一条以 '*' 结尾的记录（去掉结束符），连接关闭时返回 None"""
+        try:
+            data = await asyncio.wait_for(reader.readuntil(RECORD_TERMINATOR), timeout)
+        except asyncio.IncompleteReadError:
+            return None
+        return data[:-len(RECORD_TERMINATOR)].decode("ascii", errors="ignore").strip()
+
+    async def send_tray(self, reader, writer, snapshot, addr):
+        """按 send_mode 把一盘工件信息发给 PLC，返回首条记录发出的时刻（perf_counter），没有发出时返回 None"""
+        if self.send_mode == "batch":
+            # 整盘一次发出，流式识别时先等到完整结果
+            snapshot = await self.wait_until_complete(snapshot)
+            if snapshot is None or not snapshot.workpiece_info_list:
+                return None
+            try:
+                await self.send(writer, "".join(snapshot.workpiece_info_list))
+            except Exception as e:
+                self.log_callback(f"[发送错误] {e}")
+                return None
+            first_sent = time.perf_counter()
+            if snapshot.timings is not None:
+                self.report_cycle(snapshot.timings, first_sent)
+            self.log_callback(f"[发送] 整盘 {len(snapshot.workpiece_info_list)} 个工件")
+            return first_sent
 
+        first_sent = None
+        async for current, info in self.iter_records(snapshot):
+            try:
+                await self.send(writer, info)
+                self.log_callback(f"[发送] {info}")
+            except Exception as e:
+                self.log_callback(f"[发送错误] {e}")
+                break  # 出错就停止发送
+            if first_sent is None:
+                first_sent = time.perf_counter()
+                if current.timings is not None:
+                    self.report_cycle(current.timings, first_sent)
+
+            if self.send_mode == "ack":
+                # 等待 PLC 确认后再发下一个工件
+                if not await self.wait_for_ack(reader, addr):
+                    break
+            else:
+                await asyncio.sleep(self.send_interval)  # 延迟一段时间再发送下一个工件
+        return first_sent
+
+    async def iter_records(self, snapshot):
+        """
+        逐条产出 (快照, 工件信息)；流式识别的快照未完成时，等待同一次识别的后续发布继续产出
+        """
+        sent = 0
+        while True:
+            records = snapshot.workpiece_info_list
+            while sent < len(records):
+                yield snapshot, records[sent]
+                sent += 1
+            if snapshot.complete:
+                return
+            snapshot = await self.wait_for_job_update(snapshot)
+            if snapshot is None:
+                return
+
+    async def wait_until_complete(self, snapshot):
+        """等待同一次识别的完整结果"""
+        while snapshot is not None and not snapshot.complete:
+            snapshot = await self.wait_for_job_update(snapshot)
+        return snapshot
+
+    async def wait_for_job_update(self, snapshot):
+        """等待同一次识别的下一次发布，超时或被新的识别取代时返回 None"""
+        newer = await self.result_channel.wait_async(snapshot.version, self.trigger_timeout)
+        if newer is None or newer.job_id != snapshot.job_id:
+            self.log_callback("[提示] 流式识别结果中断，停止发送")
+            return None
+        return newer
+
+    async def wait_for_ack(self, reader, addr):
+        """等待 PLC 的确认记录，超时或断开返回 False"""
+        deadline = time.monotonic() + self.ack_timeout
+        while self.running:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                record = await self.read_record(reader, remaining)
+            except asyncio.TimeoutError:
+                self.log_callback(f"[超时] {addr} {self.ack_timeout}s 内未收到 {self.ack_token}，停止发送")
+                return False
+            if record is None:
+                self.log_callback(f"[断开连接] 来自 {addr}")
+                return False
+            if record == self.ack_token:
+                return True
+            self.log_callback(f"[接收] 发送过程中忽略 {record} 从 {addr}")
+        return False
+
+    async def trigger_and_wait(self, trigger_received):
+        """触发一次拍照识别并等待对应结果，失败或超时返回 None"""
+        self._next_trigger_id += 1
+        trigger_id = self._next_trigger_id
+        timings = {"trigger_id": trigger_id, "trigger_received": trigger_received}
+        version = self.result_channel.latest().version
+        if not self.capture_callback(timings):
+            self.log_callback("[提示] 触发拍照失败")
+            return None
+
+        deadline = time.monotonic() + self.trigger_timeout
+        while self.running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            snapshot = await self.result_channel.wait_async(version, remaining)
+            if snapshot is None:
+                break
+            if snapshot.timings is not None and snapshot.timings.get("trigger_id") == trigger_id:
+                return snapshot
+            version = snapshot.version
+        self.log_callback(f"[超时] {self.trigger_timeout}s 内未得到识别结果")
+        return None
+
+    def report_cycle(self, timings, first_byte_sent):
+        """记录并输出一次节拍各环节耗时"""
+        timings = dict(timings, first_byte_sent=first_byte_sent)
+        self.last_cycle_timings = timings
+        if "trigger_received" not in timings:
+            return
+        start = timings["trigger_received"]
+        parts = []
+        for key, label in (("frame_acquired", "取帧"), ("first_workpiece", "首个工件"),
+                           ("detection_done", "识别完成"), ("first_byte_sent", "首字节发送")):
+            if key in timings:
+                parts.append(f"{label} {(timings[key] - start) * 1000:.0f} ms")
+        self.log_callback(f"[计时] 触发后 " + "，".join(parts))
+
+    async def wait_for_results(self, timeout):
+        """返回最新的非空结果快照；当前为空时等待新的发布，超时返回最后一次快照"""
+        deadline = time.monotonic() + timeout
+        snapshot = self.result_channel.latest()
+        while self.running and not snapshot.workpiece_info_list:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            newer = await self.result_channel.wait_async(snapshot.version, remaining)
+            if newer is None:
+                break
+            snapshot = newer
+        return snapshot
+
+    async def send(self, writer, info):
+        """发送并等待发送缓冲区排空（背压），超过 write_timeout 视为发送失败"""
+        started_at = time.perf_counter()
+        try:
+            writer.write(info.encode('utf-8'))
+            await asyncio.wait_for(writer.drain(), self.write_timeout)
+        except Exception:
+            PLC_SEND_ERRORS.inc()
+            raise
+        PLC_SEND_SECONDS.observe(time.perf_counter() - started_at)
 
     def stop(self):
         self.running = False
-        self.quit()
-        self.wait()
+        if self._loop is not None and self._stop_event is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                pass  # 事件循环已经结束
+
+
+if QThread is not None:
+    class TCPServerThread(QThread):
+        """TCPServer 的 Qt 包装：在独立线程中运行事件循环，通过 message_signal 把日志转发到 Qt 界面"""
+        message_signal = pyqtSignal(str)
+
+        def __init__(self, *args, **kwargs):
+            super().__init__()
+            self.server = TCPServer(*args, log_callback=self.message_signal.emit, **kwargs)
+
+        @property
+        def plc_trigger(self):
+            return self.server.plc_trigger
+
+        @plc_trigger.setter
+        def plc_trigger(self, enabled):
+            self.server.plc_trigger = enabled
+
+        @property
+        def last_cycle_timings(self):
+            return self.server.last_cycle_timings
+
+        def run(self):
+            self.server.run()
 
+        def stop(self):
+            self.server.stop()
+            self.quit()
+            self.wait()
@@ -1,278 +1,551 @@
+import time
+
 import cv2
 import numpy as np
-from utils.pixel2world import pixel_to_world_coords
-
-
-
-def calculate_distance(p1, p2):
-    return np.sqrt(((p1[0] - p2[0]) ** 2) + ((p1[1] - p2[1]) ** 2))
-
-
-def calculate_angle(pt1, pt2):
-    # 确保 pt1 在左，pt2 在右
-    if pt1[0] > pt2[0]:  # 强制从左向右
-        pt1, pt2 = pt2, pt1
-    
-    dx = pt2[0] - pt1[0]
-    dy = pt2[1] - pt1[1]
-    
-    angle = np.degrees(np.arctan2(dy, dx)) % 360
-    return angle
-
-
-def are_parallel(p1, p2, p3, p4):
-    v1 = np.array([p2[0] - p1[0], p2[1] - p1[1]], dtype=np.float64)
-    v2 = np.array([p4[0] - p3[0], p4[1] - p3[1]], dtype=np.float64)
-    norm_v1 = np.linalg.norm(v1)
-    norm_v2 = np.linalg.norm(v2)
-    if norm_v1 < 1e-6 or norm_v2 < 1e-6:
-        return False
-    cross_product = v1[0] * v2[1] - v1[1] * v2[0]
-    sin_theta = cross_product / (norm_v1 * norm_v2)
-    angle_tolerance_degrees = 3.0
-    sin_tolerance = np.sin(np.deg2rad(angle_tolerance_degrees))
-    return abs(sin_theta) < sin_tolerance
-
-def analyze_quadrilateral(corners):
-    side_lengths = [calculate_distance(corners[i], corners[(i+1)%4]) for i in range(4)]
-    avg_length = sum(side_lengths) / 4
-    length_tolerance_ratio = 0.15
-    if all(abs(length - avg_length) < avg_length * length_tolerance_ratio for length in side_lengths):
-        return "Rhombus"
-    is_parallel_1 = are_parallel(corners[0], corners[1], corners[2], corners[3])
-    is_parallel_2 = are_parallel(corners[1], corners[2], corners[3], corners[0])
-    if is_parallel_1 or is_parallel_2:
-        return "Trapezoid"
-    return "Irregular Quadrilateral"
-
-def select_reference_angle(shape, corners):
+from metrics import DETECTION_CONTOURS, DETECTION_STAGE_SECONDS, WORKPIECES_DETECTED, WORKPIECES_UNSLOTTED
+# 逐个多边形的几何函数已移到 utils.geometry，这里再导出，沿用 from detect import ... 的代码不受影响
+from utils.geometry import (analyze_polygons, analyze_quadrilateral, are_parallel, calculate_angle, calculate_distance,
+                            select_reference_angle)
+from utils.overlay import DetectionRecord, draw_object
+from utils.pixel2world import get_calibration_model
+from utils.slot_layout import get_slot_layout
+from utils.spatial_index import GridIndex
+
+
+
+def format_workpiece_info(x_mm, y_mm, angle, slot):
+    """生成发给 PLC 的工件信息字符串，slot 为从 1 开始的编号，世界坐标按协议取整到毫米"""
+    return f'OKOKx_{round(x_mm)}y_{round(y_mm)}r_{angle:.2f}b_{slot}*'
+
+
+def parse_workpiece_info(info, slot_layout=None):
+    """format_workpiece_info 的逆操作，返回 dict(shape, x, y, angle, slot)"""
+    if slot_layout is None:
+        slot_layout = get_slot_layout()
+    body = info.rstrip('*')[len('OKOK'):]
+    x_part, rest = body[len('x_'):].split('y_', 1)
+    y_part, rest = rest.split('r_', 1)
+    angle_part, slot_part = rest.split('b_', 1)
+    slot = int(slot_part)
+    shape = slot_layout.shape_of(slot)
+    return {"shape": shape, "x": int(x_part), "y": int(y_part), "angle": float(angle_part), "slot": slot}
+
+
+def generate_fixed_order_info(workpiece_info_dict, slot_layout=None):
     """
-    计算旋转角度
+    将检测到的工件信息整理为带编号、顺序固定的列表。
+    同一形状内按布局配置的抓取路径排序后分配编号，超出编号范围的工件不发送并计入指标
     """
-    def sort_by_y(c):
-        return sorted(c, key=lambda p: (p[1], p[0]))
-    
-    # 三角形
-    if shape == "Triangle":
-        # 1. 找到最上面的顶点 (y坐标最小)
-        pts = sort_by_y(corners)
-        top_vertex = pts[0]
-
-        # 2. 获取另外两个顶点，形成与顶点的两条边
-        other_vertices = [p for p in pts if not np.array_equal(p, top_vertex)]
-
-        # 3. 计算每个边在x方向上的绝对变化量
-        x_deltas = [abs(p[0] - top_vertex[0]) for p in other_vertices]
-        
-        # 4. 选择x方向变化量更大的那条边作为参考边
-        #    np.argmax会找到最大值对应的索引
-        reference_vertex_index = np.argmax(x_deltas)
-        reference_vertex = other_vertices[reference_vertex_index]
-        
-        # 5. 计算参考边的角度
-        ref_angle = calculate_angle(top_vertex, reference_vertex)
-        base_line = [tuple(top_vertex), tuple(reference_vertex)]
-        angle = (ref_angle - 60) % 120 
-        return angle, base_line
-
-    # 六边形
-    elif shape == "Hexagon":
-        # 1. 找到最上方的顶点（y 最小）
-        pts = sort_by_y(corners)
-        top = pts[0]
-        # 2. 找到 top 顶点在 corners 中的索引
-        top_idx = None
-        for i, pt in enumerate(corners):
-            if np.array_equal(pt, top):
-                top_idx = i
-                break
-        if top_idx is None:
-            return None, None
-        # 3. 获取与该顶点相邻的两条边
-        left_neighbor = corners[(top_idx - 1) % 6]
-        right_neighbor = corners[(top_idx + 1) % 6]
-
-        edge1 = [top, left_neighbor]
-        edge2 = [top, right_neighbor]
-
-        # 4. 计算两个边的 x 方向分量
-        dx1 = left_neighbor[0] - top[0]
-        dx2 = right_neighbor[0] - top[0]
-
-        # 5. 选择更靠右的边（x 分量更大的）作为参考边
-        # 选择更靠右的边作为 baseline
-        base_edge_hex = edge1 if dx1 > dx2 else edge2
-
-        ref_angle = calculate_angle(base_edge_hex[0], base_edge_hex[1])
-        base_line = [tuple(base_edge_hex[0]), tuple(base_edge_hex[1])]
-        angle = ref_angle % 60
-        return angle, base_line
-
-
-    # 菱形
-    elif shape == "Rhombus":
-        max_dist = 0
-        pair = (corners[0], corners[2])
-        for i in range(4):
-            for j in range(i+1, 4):
-                d = calculate_distance(corners[i], corners[j])
-                if d > max_dist:
-                    max_dist = d
-                    pair = (corners[i], corners[j])
-        ref_angle = calculate_angle(pair[0], pair[1])
-        base_line = [tuple(pair[0]), tuple(pair[1])]
-        return -((180 - 30 -  ref_angle) % 180), base_line
-    
-
-    # 梯形
-    elif shape == "Trapezoid":
-        # 找最长边（长边）
-        max_len = 0
-        long_edge = (corners[0], corners[1])
-        long_edge_idx = 0
-
-        for i in range(4):
-            j = (i + 1) % 4
-            d = calculate_distance(corners[i], corners[j])
-            if d > max_len:
-                max_len = d
-                long_edge = (corners[i], corners[j])
-                long_edge_idx = i
-
-        # 找与长边对边的短边
-        short_edge = (corners[(long_edge_idx + 2) % 4], corners[(long_edge_idx + 3) % 4])
-
-        # 判断 y 坐标，确定朝向
-        long_edge_y_avg = (long_edge[0][1] + long_edge[1][1]) / 2
-        short_edge_y_avg = (short_edge[0][1] + short_edge[1][1]) / 2
-
-        ref_angle = calculate_angle(long_edge[0], long_edge[1])
-        # 如果长边在短边下方（y大） angle = ref_angle % 360
-        # 如果长边在短边上方（y小） angle = (ref_angle + 180) % 
-        if long_edge_y_avg > short_edge_y_avg:
-            angle = ref_angle % 360
-        else:
-            angle = (ref_angle + 180) % 360
+    return slotted_workpiece_info(assign_fixed_order(workpiece_info_dict, slot_layout))
+
+
+def assign_fixed_order(workpiece_info_dict, slot_layout=None):
+    """generate_fixed_order_info 分配编号的部分，返回 [(编号, 形状, x_mm, y_mm, angle)]，世界坐标不取整"""
+    if slot_layout is None:
+        slot_layout = get_slot_layout()
+    slotted, overflow = slot_layout.assign(workpiece_info_dict)
+    for shape, count in overflow.items():
+        WORKPIECES_UNSLOTTED.inc(count, shape=shape)
+    return slotted
 
-        base_line = [tuple(long_edge[0]), tuple(long_edge[1])]
-        return angle, base_line
 
+def slotted_workpiece_info(slotted):
+    """[(编号, 形状, x_mm, y_mm, angle)] → 发给 PLC 的工件信息列表"""
+    return [format_workpiece_info(x_mm, y_mm, angle, slot) for slot, _, x_mm, y_mm, angle in slotted]
 
-    return None, None
 
+# 定义颜色区间（每种颜色仅对应一种形状）
+COLOR_DEFINITIONS = {
+    "Brown": ([0, 43, 30],[179, 255, 255]),     # 棕色-三角形
+    "Orange": ([0, 169, 0],[179, 255, 255]),    # 橙色-六边形
+    "Pink": ([14, 57, 22],[179, 255, 255]),   # 粉色-菱形
+    "Green": ([23, 37, 0],[156, 255, 223])  # 绿色-梯形
+}
 
-def generate_fixed_order_info(workpiece_info_dict):
+# 显式绑定颜色与形状
+COLOR_SHAPE_MAP = {
+    "Brown": "Triangle",
+    "Orange": "Hexagon",
+    "Pink": "Rhombus",
+    "Green": "Trapezoid"
+}
+
+
+class ColorClassifier:
     """
-    将检测到的工件信息整理为带编号、顺序固定的列表。
+    预编译的颜色分类器
+    由颜色区间生成 H/S/V 三通道的位掩码查找表，一次查表即得到所有颜色的标签图，
+    标签图中第 i 位为 1 表示该像素落在第 i 种颜色区间内（颜色区间可以重叠）
     """
-    workpiece_info_list = []
-    shape_slots = {
-        "Triangle": (0, 5),   # 编号1-5（索引0-4）
-        "Rhombus": (5, 9),    # 编号6-9
-        "Hexagon": (9, 10),   # 编号10
-        "Trapezoid": (10, 11) # 编号11
-    }
-
-    for shape, (start_idx, end_idx) in shape_slots.items():
-        detected_list = workpiece_info_dict.get(shape, [])
-        for j, (x_mm, y_mm, angle) in enumerate(detected_list):
-            global_idx = start_idx + j  # 编号索引
-            if global_idx < end_idx:    # 避免多发
-                info_str = f'OKOKx_{x_mm}y_{y_mm}r_{angle:.2f}b_{global_idx+1}*'
-                workpiece_info_list.append(info_str)
-
-    return workpiece_info_list
-
-
-def detect_multiple_objects(image, log_callback=print):
-    workpiece_info_dict = {
-        "Triangle": [],
-        "Rhombus": [],
-        "Hexagon": [],
-        "Trapezoid": []
-    }
-
-    output_image = image.copy()
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-
-    # 定义颜色区间（每种颜色仅对应一种形状）
-    color_definitions = {
-        "Brown": ([0, 43, 30],[179, 255, 255]),     # 棕色-三角形
-        "Orange": ([0, 169, 0],[179, 255, 255]),    # 橙色-六边形
-        "Pink": ([14, 57, 22],[179, 255, 255]),   # 粉色-菱形
-        "Green": ([23, 37, 0],[156, 255, 223])  # 绿色-梯形
-    }
-
-    # 显式绑定颜色与形状
-    color_shape_map = {
-        "Brown": "Triangle",
-        "Orange": "Hexagon",
-        "Pink": "Rhombus",
-        "Green": "Trapezoid"
-    }
-
-    detected_set = set()  # 记录已识别的中心坐标和形状，避免重复
-
-    for color_name, (lower, upper) in color_definitions.items():
-        mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
-        kernel = np.ones((5, 5), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        expected_shape = color_shape_map[color_name]
+    def __init__(self, color_definitions):
+        self.color_names = list(color_definitions)
+        if len(self.color_names) <= 8:
+            dtype = np.uint8
+        elif len(self.color_names) <= 16:
+            dtype = np.uint16
+        else:
+            raise ValueError("ColorClassifier supports at most 16 colours")
+
+        values = np.arange(256)
+        # 每个通道一张 256 项查找表，值为该通道落在区间内的颜色位集合
+        self.channel_luts = [np.zeros(256, dtype=dtype) for _ in range(3)]
+        self.bits = {}
+        self.ranges = {}
+        for i, (color_name, (lower, upper)) in enumerate(color_definitions.items()):
+            self.ranges[color_name] = (np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8))
+            bit = 1 << i
+            for ch in range(3):
+                inside = (values >= lower[ch]) & (values <= upper[ch])
+                self.channel_luts[ch][inside] |= bit
+            self.bits[color_name] = bit
+
+    def classify(self, hsv):
+        """单次遍历 HSV 图像，返回所有颜色的标签图"""
+        channels = cv2.split(hsv)
+        label_map = cv2.LUT(channels[0], self.channel_luts[0])
+        for channel, lut in zip(channels[1:], self.channel_luts[1:]):
+            cv2.bitwise_and(label_map, cv2.LUT(channel, lut), dst=label_map)
+        return label_map
+
+    def mask(self, label_map, color_name):
+        """
+        从标签图中取出某种颜色的掩码（0/bit），非零位置与 cv2.inRange 结果一致，
+        可直接用于形态学运算与轮廓提取
+        """
+        return cv2.bitwise_and(label_map, self.bits[color_name])
+
+    def in_range(self, hsv, color_name):
+        """只需要一种颜色时直接按区间取掩码（0/255），省去对其他颜色的查表"""
+        lower, upper = self.ranges[color_name]
+        return cv2.inRange(hsv, lower, upper)
+
+
+color_classifier = ColorClassifier(COLOR_DEFINITIONS)
+
+# 全分辨率下的检测参数，金字塔模式按层级自动缩放
+MIN_CONTOUR_AREA = 900   # 最小轮廓面积
+MORPH_KERNEL_SIZE = 5    # 开闭运算核大小
+DEDUP_RADIUS = 10        # 去重半径（像素），半径内的检测视为同一工件（不区分颜色）
+
+# 各形状参考角的周期，用于比较两个角度的差值
+ANGLE_PERIODS = {
+    "Triangle": 120,
+    "Hexagon": 60,
+    "Rhombus": 180,
+    "Trapezoid": 360
+}
+
+
+def approximate_contour(contour, min_area=MIN_CONTOUR_AREA):
+    """轮廓 → 多边形角点，面积过小时返回 None"""
+    area = cv2.contourArea(contour)
+    if area < min_area:
+        return None
+    perimeter = cv2.arcLength(contour, True)
+    epsilon = 0.02 * perimeter
+    return cv2.approxPolyDP(contour, epsilon, True)
+
+
+def classify_contour(contour, min_area=MIN_CONTOUR_AREA):
+    """
+    轮廓 → (形状, 多边形角点)，面积过小时返回 (None, None)
+    """
+    approx_corners = approximate_contour(contour, min_area)
+    if approx_corners is None:
+        return None, None
+    num_corners = len(approx_corners)
+    shape = "unknow"
+
+    if num_corners == 3:
+        shape = "Triangle"
+    elif num_corners == 4:
+        shape = analyze_quadrilateral(approx_corners.reshape(-1, 2))
+    elif num_corners == 6:
+        shape = "Hexagon"
+    return shape, approx_corners
+
+
+def segment_mask(hsv, color_name, kernel_size=MORPH_KERNEL_SIZE, label_map=None):
+    """对某种颜色做分割与开闭运算，返回掩码；没有标签图时只对这一种颜色取掩码"""
+    if label_map is None:
+        mask = color_classifier.in_range(hsv, color_name)
+    else:
+        mask = color_classifier.mask(label_map, color_name)
+    kernel = np.ones((kernel_size, kernel_size), np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+
+def segment_contours(hsv, color_name, kernel_size=MORPH_KERNEL_SIZE, label_map=None):
+    """对某种颜色做分割、开闭运算并提取外轮廓"""
+    mask = segment_mask(hsv, color_name, kernel_size, label_map)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+def polygon_centroid(corners):
+    """多边形质心，退化多边形返回 None"""
+    M = cv2.moments(corners)
+    if M["m00"] == 0:
+        return None
+    return M["m10"] / M["m00"], M["m01"] / M["m00"]
+
+
+def upscale_corners(corners, scale):
+    """低分辨率像素坐标 → 原图像素坐标（按像素中心对齐）"""
+    return (corners.reshape(-1, 2).astype(np.float32) + 0.5) * scale - 0.5
+
+
+# 开、闭运算共四次腐蚀/膨胀，每次影响 MORPH_KERNEL_SIZE // 2 像素，ROI 边界附近的掩码可能与整幅图不同；
+# 离 ROI 内侧边界不到 ROI_MARGIN 的轮廓视为可能被截断
+ROI_MARGIN = 2 * MORPH_KERNEL_SIZE
+# 每个 ROI 单独分割的固定开销（转换、形态学与找轮廓各一次调用）折合的像素面积
+ROI_OVERHEAD_AREA = 40000
+
 
+class PyramidFallback(Exception):
+    """金字塔模式下低分辨率结果不可靠，需要回退全分辨率检测"""
+
+
+def _refine_roi(hsv, coarse_mask, group, bounds, scale, color_name, centroid_tolerance, area_tolerance):
+    """
+    在 bounds 外扩得到的原图 ROI 内按全分辨率重新分割，返回质心落在 group 中某个低分辨率轮廓内
+    （允许偏出 centroid_tolerance 像素）的全分辨率轮廓，坐标为原图坐标；
+    低分辨率下粘连成一块的多个工件在这里重新分开，各自返回
+    """
+    img_h, img_w = hsv.shape[:2]
+    pad = ROI_MARGIN + 2 * scale
+    # 对应的轮廓靠近 ROI 内侧边界时按轮廓范围扩大 ROI 并加倍外扩距离重做，最多重做三次
+    for _ in range(4):
+        x0, y0 = max(bounds[0] - pad, 0), max(bounds[1] - pad, 0)
+        x1, y1 = min(bounds[2] + pad, img_w), min(bounds[3] + pad, img_h)
+        roi_mask = segment_mask(hsv[y0:y1, x0:x1], color_name)
+        contours, _ = cv2.findContours(roi_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        matched = []
+        truncated = False
         for contour in contours:
-            area = cv2.contourArea(contour)
-            if area < 900:
+            M = cv2.moments(contour)
+            if M["m00"] == 0:
+                cx, cy = contour[0, 0]
+            else:
+                cx, cy = M["m10"] / M["m00"], M["m01"] / M["m00"]
+            center = (float(cx + x0), float(cy + y0))
+            if all(cv2.pointPolygonTest(corners, center, True) < -centroid_tolerance for corners in group):
+                continue
+            matched.append(contour + np.array([x0, y0], dtype=contour.dtype))
+            bx, by, bw, bh = cv2.boundingRect(contour)
+            if ((bx < ROI_MARGIN and x0 > 0) or (by < ROI_MARGIN and y0 > 0)
+                    or (bx + bw > x1 - x0 - ROI_MARGIN and x1 < img_w)
+                    or (by + bh > y1 - y0 - ROI_MARGIN and y1 < img_h)):
+                truncated = True
+                bounds = (min(bounds[0], x0 + bx), min(bounds[1], y0 + by),
+                          max(bounds[2], x0 + bx + bw), max(bounds[3], y0 + by + bh))
+        if not truncated:
+            break
+        pad *= 2
+    else:
+        raise PyramidFallback(f"[金字塔] {color_name} 工件超出精修区域，回退全分辨率检测")
+
+    # 低分辨率下消失（缩小后面积不足、被开运算去掉）的工件在全分辨率掩码中仍然存在，
+    # 表现为 ROI 内全分辨率掩码的面积明显大于低分辨率掩码，且多出的面积足以容纳一个工件
+    fine_area = cv2.countNonZero(roi_mask)
+    coarse_area = cv2.countNonZero(coarse_mask[y0 // scale:-(-y1 // scale), x0 // scale:-(-x1 // scale)]) * scale ** 2
+    extra = fine_area - coarse_area
+    if extra >= MIN_CONTOUR_AREA and extra > area_tolerance * coarse_area:
+        raise PyramidFallback(f"[金字塔] {color_name} 精修区域内有低分辨率下丢失的区域，回退全分辨率检测")
+    return matched
+
+
+def _padded_area(box, pad, shape):
+    x0, y0 = max(box[0] - pad, 0), max(box[1] - pad, 0)
+    x1, y1 = min(box[2] + pad, shape[1]), min(box[3] + pad, shape[0])
+    return (x1 - x0) * (y1 - y0)
+
+
+def group_rois(corners_list, pad, shape):
+    """
+    把各轮廓的外接框合并成若干 ROI，返回 [(轮廓角点列表, 外接框)]：
+    合并后（外扩 pad 后）的面积比两者之和多出不到 ROI_OVERHEAD_AREA 时合并，
+    重叠、相邻或很小的 ROI 只分割一次，工件铺满画面时退化为整幅图分割一次
+    """
+    groups = []
+    for corners in corners_list:
+        x, y, w, h = cv2.boundingRect(corners)
+        members, box = [corners], (x, y, x + w, y + h)
+        i = 0
+        while i < len(groups):
+            other_members, other = groups[i]
+            union = (min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3]))
+            if (_padded_area(union, pad, shape) <= _padded_area(box, pad, shape) + _padded_area(other, pad, shape)
+                    + ROI_OVERHEAD_AREA):
+                members, box = other_members + members, union
+                del groups[i]
+                i = 0
+            else:
+                i += 1
+        groups.append((members, box))
+    return groups
+
+
+def refine_contours(hsv, coarse_mask, coarse_contours, scale, color_name, centroid_tolerance=20.0,
+                    area_tolerance=0.5):
+    """
+    金字塔模式：低分辨率掩码与轮廓 → 原图局部 ROI 内的全分辨率轮廓（原图坐标），hsv 为原图的 HSV
+    形状、角点与质心之后都按全分辨率轮廓计算，结果与整幅图按全分辨率检测相同；
+    低分辨率下面积不足阈值一半的轮廓不参与精修（缩小后面积会偏小，阈值放宽一半）
+    相邻 ROI 重叠时同一轮廓只保留一次，并按整幅图 findContours 的顺序（起点 (y, x) 从大到小）排列，
+    保证去重与编号顺序也与全分辨率检测一致
+    精修结果不可靠（工件超出 ROI、ROI 内有低分辨率下丢失的区域）时抛出 PyramidFallback
+    """
+    min_area = MIN_CONTOUR_AREA / scale ** 2 / 2
+    corners_list = [upscale_corners(contour, scale) for contour in coarse_contours
+                    if cv2.contourArea(contour) >= min_area]
+    refined = {}
+    for group, bounds in group_rois(corners_list, ROI_MARGIN + 2 * scale, hsv.shape):
+        for contour in _refine_roi(hsv, coarse_mask, group, bounds, scale, color_name, centroid_tolerance,
+                                   area_tolerance):
+            # 外轮廓的起点是该连通域按行扫描的第一个像素，可以唯一标识轮廓
+            refined.setdefault((int(contour[0, 0, 1]), int(contour[0, 0, 0])), contour)
+    return [refined[start] for start in sorted(refined, reverse=True)]
+
+
+def iter_detected_objects(image, output_image=None, log_callback=print, pyramid_level=0,
+                          centroid_tolerance=20.0, area_tolerance=0.5, detected_index=None, record=None):
+    """
+    逐个产出通过形状校验与去重的工件 (颜色, 形状, cx, cy, 角度)，像素坐标；
+    record（DetectionRecord）不为 None 时同时记录多边形、质心与基准边，用于之后按需渲染标注；
+    output_image 不为 None 时直接在其上绘制标注
+    pyramid_level > 0 时在 1/2**pyramid_level 分辨率下分割与找轮廓，只用来定位：
+    再在原图局部 ROI 内按全分辨率重新分割（见 refine_contours），形状分类、质心与角度都来自全分辨率轮廓；
+    低分辨率下粘连的工件在 ROI 内重新分开；centroid_tolerance（像素）为全分辨率轮廓质心允许偏出低分辨率轮廓的距离，
+    area_tolerance 为 ROI 内全分辨率掩码面积允许比低分辨率掩码多出的比例，多出更多（且足以容纳一个工件）
+    说明有工件在低分辨率下丢失；工件丢失或超出精修区域时抛出 PyramidFallback
+    """
+    # 各阶段耗时（秒），生成器结束时写入指标
+    stage_times = dict.fromkeys(("preprocess", "classify", "segment", "refine", "polygons", "annotate"), 0.0)
+    try:
+        yield from _iter_detected_objects(image, output_image, pyramid_level, centroid_tolerance, area_tolerance,
+                                          detected_index, record, stage_times)
+    finally:
+        for stage, elapsed in stage_times.items():
+            DETECTION_STAGE_SECONDS.observe(elapsed, stage=stage)
+
+
+def _iter_detected_objects(image, output_image, pyramid_level, centroid_tolerance, area_tolerance,
+                           detected_index, record, stage_times):
+    started_at = time.perf_counter()
+    scale = 2 ** pyramid_level
+    if scale > 1:
+        # 逐级减半：INTER_AREA 在整数倍 2 的缩放上有快速实现，比一次缩小 2**n 倍快
+        small = image
+        for _ in range(pyramid_level):
+            small = cv2.resize(small, (small.shape[1] // 2, small.shape[0] // 2), interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    else:
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    kernel_size = max(1, MORPH_KERNEL_SIZE // scale) | 1
+    full_hsv = None  # 原图 HSV，金字塔模式下第一次精修时再转换
+
+    if detected_index is None:
+        detected_index = GridIndex(DEDUP_RADIUS)  # 已识别工件的质心，避免重复
+    if record is None and output_image is not None:
+        record = DetectionRecord(image.shape)
+
+    stage_times["preprocess"] += time.perf_counter() - started_at
+
+    # 单次查表得到全部颜色的标签图，再按颜色分别做形态学与轮廓提取
+    started_at = time.perf_counter()
+    label_map = color_classifier.classify(hsv)
+    stage_times["classify"] += time.perf_counter() - started_at
+
+    for color_name in color_classifier.color_names:
+        started_at = time.perf_counter()
+        mask = segment_mask(hsv, color_name, kernel_size, label_map)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        stage_times["segment"] += time.perf_counter() - started_at
+        DETECTION_CONTOURS.observe(len(contours), color=color_name)
+        expected_shape = COLOR_SHAPE_MAP[color_name]
+
+        if scale > 1:
+            # 低分辨率轮廓只负责定位，之后全部按原图 ROI 内的全分辨率轮廓处理
+            started_at = time.perf_counter()
+            if full_hsv is None and contours:
+                # 各 ROI 合计接近整幅图且互相重叠，整幅转换一次比逐个 ROI 转换快
+                full_hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+            contours = refine_contours(full_hsv, mask, contours, scale, color_name, centroid_tolerance, area_tolerance)
+            stage_times["refine"] += time.perf_counter() - started_at
+
+        # 逐个轮廓拟合多边形，形状分类、质心与参考角对本颜色的全部多边形批量计算
+        started_at = time.perf_counter()
+        polygons = [approx for approx in map(approximate_contour, contours) if approx is not None]
+        if not polygons:
+            stage_times["polygons"] += time.perf_counter() - started_at
+            continue
+        shapes, centers, angles, base_lines, _ = analyze_polygons(polygons)
+        stage_times["polygons"] += time.perf_counter() - started_at
+
+        for i, approx_corners in enumerate(polygons):
+            if shapes[i] != expected_shape or np.isnan(centers[i, 0]):
                 continue
-            perimeter = cv2.arcLength(contour, True)
-            epsilon = 0.02 * perimeter
-            approx_corners = cv2.approxPolyDP(contour, epsilon, True)
-            num_corners = len(approx_corners)
-            shape = "unknow"
-
-            if num_corners == 3:
-                shape = "Triangle"
-            elif num_corners == 4:
-                shape = analyze_quadrilateral(approx_corners.reshape(-1, 2))
-            elif num_corners == 6:
-                shape = "Hexagon"
-
-            if shape == expected_shape:
-                M = cv2.moments(approx_corners)
-                if M["m00"] != 0:
-                    cx, cy = int(M["m10"] / M["m00"]), int(M["m01"] / M["m00"])
-                else:
-                    continue
-
-                # 去重判定
-                key = (shape, cx // 10, cy // 10)  # 中心点四舍五入到10像素精度
-                if key in detected_set:
-                    continue
-                detected_set.add(key)
-
-                angle, base_line = select_reference_angle(shape, approx_corners.reshape(-1, 2))
-                cv2.drawContours(output_image, [approx_corners], -1, (0, 255, 0), 3)
-                cv2.putText(output_image, f"{shape},{angle:.1f}", (cx - 40, cy + 20),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.8, (0, 0, 255), 3)
-                if base_line is not None:
-                    p1, p2 = base_line
-                    cv2.line(output_image, (int(p1[0]), int(p1[1])), (int(p2[0]), int(p2[1])), (255, 0, 0), 2)
-                # log_callback(f"{color_name}: {shape}, center=({cx},{cy}) angle={angle:.2f}")
-
-                # x 与 y 转换到机械臂坐标系
-                x_mm, y_mm = pixel_to_world_coords(cx, cy, H_txt_path='config/waican.txt',
-                                                   K_txt_path='config/neican.txt',
-                                                   D_txt_path='config/jibian.txt'
-                                                   )
-                # ====补偿====
-                log_callback(f"{color_name}: {shape}, center=({x_mm},{y_mm}) angle={angle:.2f}")
-                 # 先存到对应形状列表
-                workpiece_info_dict[shape].append((round(x_mm), round(y_mm), angle))
-
-    workpiece_info_list = generate_fixed_order_info(workpiece_info_dict)
-    return output_image, workpiece_info_list
+            started_at = time.perf_counter()
+            shape = shapes[i]
+            cx, cy = int(centers[i, 0]), int(centers[i, 1])
+            angle, base_line = angles[i], base_lines[i]
+
+            # 去重判定：半径内已有工件（任意颜色）时视为重复
+            if not detected_index.add_if_far(cx, cy, shape):
+                stage_times["polygons"] += time.perf_counter() - started_at
+                continue
+
+            stage_times["polygons"] += time.perf_counter() - started_at
+            if record is not None:
+                started_at = time.perf_counter()
+                obj = record.add(color_name, shape, approx_corners, (cx, cy), angle, base_line)
+                if output_image is not None:
+                    draw_object(output_image, obj)
+                stage_times["annotate"] += time.perf_counter() - started_at
+            # log_callback(f"{color_name}: {shape}, center=({cx},{cy}) angle={angle:.2f}")
+
+            yield color_name, shape, cx, cy, angle
+
+
+def detect_multiple_objects(image, log_callback=print, calibration=None,
+                            pyramid_level=0, centroid_tolerance=20.0, area_tolerance=0.5, slot_layout=None):
+    """
+    多工件识别，返回 (原图分辨率的标注图, 工件信息列表)
+    只需要识别结果或只需要小尺寸预览时使用 detect_objects，避免复制并标注整幅原图
+    """
+    record, workpiece_info_list = detect_objects(image, log_callback, calibration, pyramid_level,
+                                                 centroid_tolerance, area_tolerance, slot_layout)
+    return record.render(image), workpiece_info_list
+
+
+def detect_objects(image, log_callback=print, calibration=None,
+                   pyramid_level=0, centroid_tolerance=20.0, area_tolerance=0.5, slot_layout=None):
+    """
+    多工件识别，返回 (识别记录 DetectionRecord, 工件信息列表)，标注图由 record.render() 按需渲染
+    金字塔模式参数见 iter_detected_objects，低分辨率结果不可靠时自动回退全分辨率检测
+    """
+    started_at = time.perf_counter()
+    record, workpieces = locate_workpieces(image, log_callback, calibration, pyramid_level,
+                                           centroid_tolerance, area_tolerance)
+    record.workpieces = assign_slots(workpieces, slot_layout, log_callback)
+    workpiece_info_list = slotted_workpiece_info(record.workpieces)
+    DETECTION_STAGE_SECONDS.observe(time.perf_counter() - started_at, stage="total")
+    return record, workpiece_info_list
+
+
+def locate_workpieces(image, log_callback=print, calibration=None,
+                      pyramid_level=0, centroid_tolerance=20.0, area_tolerance=0.5):
+    """
+    识别并把质心换算到机械臂坐标系，不分配编号（多相机时先合并各相机结果再统一编号）
+    返回 (识别记录, [dict(color, shape, cx, cy, x, y, angle)])，cx、cy 为像素坐标，x、y 为毫米坐标（保留两位小数）
+    """
+    if calibration is None:
+        calibration = get_calibration_model()
+
+    record = DetectionRecord(image.shape)
+    try:
+        # (颜色, 形状, cx, cy, 角度)，统一做坐标转换
+        detected_objects = list(iter_detected_objects(image, None, log_callback, pyramid_level,
+                                                      centroid_tolerance, area_tolerance, record=record))
+    except PyramidFallback as e:
+        log_callback(str(e))
+        record = DetectionRecord(image.shape)
+        detected_objects = list(iter_detected_objects(image, None, log_callback, record=record))
+
+    # x 与 y 批量转换到机械臂坐标系
+    converted_at = time.perf_counter()
+    centers = np.array([(cx, cy) for _, _, cx, cy, _ in detected_objects], dtype=np.float32).reshape(-1, 2)
+    world_coords = np.round(calibration.to_world(centers), 2)
+    DETECTION_STAGE_SECONDS.observe(time.perf_counter() - converted_at, stage="pixel_to_world")
+    workpieces = []
+    for (color_name, shape, cx, cy, angle), (x_mm, y_mm) in zip(detected_objects, world_coords):
+        # ====补偿====
+        log_callback(f"{color_name}: {shape}, center=({x_mm},{y_mm}) angle={angle:.2f}")
+        workpieces.append({"color": color_name, "shape": shape, "cx": cx, "cy": cy,
+                           "x": float(x_mm), "y": float(y_mm), "angle": angle})
+        WORKPIECES_DETECTED.inc(shape=shape)
+    return record, workpieces
+
+
+def assign_slots(workpieces, slot_layout=None, log_callback=print):
+    """
+    locate_workpieces 的结果 → 按编号布局分配编号的工件 [(编号, 形状, x_mm, y_mm, angle)]，
+    发给 PLC 的字符串由 slotted_workpiece_info 生成
+    """
+    workpiece_info_dict = {shape: [] for shape in COLOR_SHAPE_MAP.values()}
+    for workpiece in workpieces:
+        # 先存到对应形状列表
+        workpiece_info_dict.setdefault(workpiece["shape"], []).append(
+            (workpiece["x"], workpiece["y"], workpiece["angle"]))
+    slotted = assign_fixed_order(workpiece_info_dict, slot_layout)
+    if len(slotted) < len(workpieces):
+        log_callback(f"[系统] {len(workpieces) - len(slotted)} 个工件超出编号范围，未发送")
+    return slotted
+
+
+def iter_workpieces(image, log_callback=print, calibration=None, output_image=None,
+                    pyramid_level=0, centroid_tolerance=20.0, area_tolerance=0.5, slot_layout=None, record=None):
+    """
+    流式识别：每识别并换算出一个工件就立即产出，不必等所有颜色处理完
+    产出 dict(shape, x, y, angle, slot, info)，x、y 为毫米坐标（保留两位小数），slot 为从 1 开始的固定编号，
+    info 为发给 PLC 的字符串；
+    编号区间与 generate_fixed_order_info 一致，形状内按识别顺序分配（流式产出无法按抓取路径排序），
+    超出编号范围的工件不产出
+    金字塔模式回退时继续以全分辨率检测剩余工件，已产出的工件不会重复产出
+    record、output_image 的含义同 iter_detected_objects，record 不为 None 时产出的工件同时追加到 record.workpieces
+    """
+    if calibration is None:
+        calibration = get_calibration_model()
+
+    if slot_layout is None:
+        slot_layout = get_slot_layout()
+    slot_counts = {shape: 0 for shape in slot_layout.slots}
+    detected_index = GridIndex(DEDUP_RADIUS)
+
+    def convert(detected):
+        color_name, shape, cx, cy, angle = detected
+        # x 与 y 转换到机械臂坐标系
+        x_mm, y_mm = np.round(calibration.to_world([[cx, cy]])[0], 2)
+        log_callback(f"{color_name}: {shape}, center=({x_mm},{y_mm}) angle={angle:.2f}")
+        WORKPIECES_DETECTED.inc(shape=shape)
+
+        if shape not in slot_layout.slots:
+            WORKPIECES_UNSLOTTED.inc(shape=shape)
+            return None
+        start_idx, end_idx = slot_layout.slots[shape]
+        global_idx = start_idx + slot_counts[shape]  # 编号索引
+        slot_counts[shape] += 1
+        if global_idx >= end_idx:  # 避免多发
+            WORKPIECES_UNSLOTTED.inc(shape=shape)
+            return None
+        x_mm, y_mm = float(x_mm), float(y_mm)
+        if record is not None:
+            record.workpieces.append((global_idx + 1, shape, x_mm, y_mm, angle))
+        return {
+            "shape": shape,
+            "x": x_mm,
+            "y": y_mm,
+            "angle": angle,
+            "slot": global_idx + 1,
+            "info": format_workpiece_info(x_mm, y_mm, angle, global_idx + 1),
+        }
+
+    try:
+        for detected in iter_detected_objects(image, output_image, log_callback, pyramid_level,
+                                              centroid_tolerance, area_tolerance, detected_index, record):
+            workpiece = convert(detected)
+            if workpiece is not None:
+                yield workpiece
+    except PyramidFallback as e:
+        log_callback(str(e))
+        for detected in iter_detected_objects(image, output_image, log_callback, detected_index=detected_index,
+                                              record=record):
+            workpiece = convert(detected)
+            if workpiece is not None:
+                yield workpiece
 
 
 
@@ -280,9 +553,9 @@ def detect_multiple_objects(image, log_callback=print):
 
 if __name__ == "__main__":
     frame = cv2.imread(r"assets\debug_for_angel\capture_20250611_132644.jpg")
-    result, workpoece_info_list = detect_multiple_objects(frame)
+    record, workpoece_info_list = detect_objects(frame)
     print(workpoece_info_list)
-    result = cv2.resize(result, (640, 512))
+    result = record.render(frame, (640, 512))
     cv2.imshow("Result", result)
     cv2.waitKey(0)
     cv2.destroyAllWindows()
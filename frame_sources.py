@@ -0,0 +1,374 @@
+"""
+可替换的帧源（不依赖 Qt）：实时相机、图片目录回放、视频文件回放
+FrameGrabber 通过统一接口 open() / read(image) / grab() / release() 取帧，下游（识别、跟踪、PLC 通讯）不区分帧源，
+没有相机时也可以用回放帧源在开发机上以远高于 10 fps 的速率压测整条流水线
+
+    python service.py --source replay --replay-dir results/original --replay-fps 0   # 不限速回放
+    python main.py --source video --video test.mp4
+
+每个帧源统计实际帧率（achieved_fps）与丢帧数（dropped）：
+回放帧源限速时落后超过一帧则跳过相应帧数，计为丢帧；相机开启 hardware_timestamps 时按驱动时间戳的间隔估计丢帧
+"""
+import glob
+import os
+import time
+from collections import deque
+
+import cv2
+
+SOURCE_KINDS = ("camera", "replay", "video")
+# assets 根目录下是界面图标，只回放其子目录中的采集图像；目录支持通配符
+DEFAULT_REPLAY_DIRS = ("assets/*/", "results/original")
+# 默认回放与相机默认分辨率相同的图像，与标定及世界坐标查找表一致
+DEFAULT_REPLAY_SIZE = (2592, 1944)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+# 统计实际帧率的滑动窗口（帧数）
+FPS_WINDOW = 30
+
+
+class FrameSource:
+    """
+    帧源基类：子类实现 open()、frame_size、_read(image)、_skip(count)、release()
+    rate 为限速帧率，None 或 0 表示不限速（相机的帧率由驱动控制，不在这里限速）
+    """
+
+    def __init__(self, rate=None, log_callback=print):
+        self.rate = rate
+        self.log_callback = log_callback
+        self.frames = 0         # 已输出的帧数
+        self.dropped = 0        # 丢帧数
+        self.timestamp = None   # 最近一帧的时间戳（秒）
+        self._timestamps = deque(maxlen=FPS_WINDOW)
+        self._next_due = None
+
+    def open(self):
+        """打开帧源，成功返回 True"""
+        raise NotImplementedError
+
+    @property
+    def frame_size(self):
+        """(宽, 高)"""
+        raise NotImplementedError
+
+    @property
+    def exhausted(self):
+        """不循环的回放帧源播放完毕后为 True，采集循环据此退出"""
+        return False
+
+    def _read(self, image):
+        raise NotImplementedError
+
+    def _skip(self, count):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def _frame_timestamp(self):
+        return time.perf_counter()
+
+    def _pace(self):
+        """按 rate 等到下一帧的时刻，落后超过一帧时返回应跳过的帧数"""
+        if not self.rate:
+            return 0
+        interval = 1.0 / self.rate
+        now = time.perf_counter()
+        if self._next_due is None:
+            self._next_due = now
+        skipped = 0
+        if now >= self._next_due + interval:
+            skipped = int((now - self._next_due) // interval)
+            self._next_due += skipped * interval
+        elif now < self._next_due:
+            time.sleep(self._next_due - now)
+        self._next_due += interval
+        return skipped
+
+    def _count_frame(self, timestamp):
+        self.frames += 1
+        self.timestamp = timestamp
+        self._timestamps.append(timestamp)
+
+    def read(self, image=None):
+        """读取下一帧，尽量写入 image（尺寸相同时）以免重新分配，返回 (ret, frame)"""
+        skipped = self._pace()
+        if skipped:
+            self._skip(skipped)
+            self.dropped += skipped
+        ret, frame = self._read(image)
+        if ret:
+            self._count_frame(self._frame_timestamp())
+        return ret, frame
+
+    def grab(self):
+        """跳过一帧（采集端没有空闲槽位时调用）"""
+        skipped = self._pace()
+        self._skip(1 + skipped)
+        self.dropped += skipped
+        self._count_frame(self._frame_timestamp())
+        return True
+
+    @property
+    def achieved_fps(self):
+        """最近 FPS_WINDOW 帧的实际帧率"""
+        if len(self._timestamps) < 2 or self._timestamps[-1] <= self._timestamps[0]:
+            return 0.0
+        return (len(self._timestamps) - 1) / (self._timestamps[-1] - self._timestamps[0])
+
+    def stats(self):
+        return {"fps": self.achieved_fps, "frames": self.frames, "dropped": self.dropped}
+
+
+class CameraSource(FrameSource):
+    """
+    实时相机
+    fourcc 为像素格式（如 "MJPG"，高分辨率下 USB 相机通常只有 MJPG 才能跑满帧率），需在设置分辨率之前设置；
+    buffer_size 为驱动缓冲帧数（1 表示总是读到最新帧，部分后端不支持）；
+    hardware_timestamps 为 True 时用 CAP_PROP_POS_MSEC（V4L2 下为驱动缓冲区时间戳）作为帧时间戳，
+    实际帧率与丢帧数按相机出帧时刻统计，而不是按读取时刻
+    """
+
+    def __init__(self, cam_id=1, width=2592, height=1944, fps=10, fourcc=None, buffer_size=None,
+                 hardware_timestamps=False, api_preference=cv2.CAP_ANY, log_callback=print):
+        super().__init__(rate=None, log_callback=log_callback)
+        self.cam_id = cam_id
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fourcc = fourcc
+        self.buffer_size = buffer_size
+        self.hardware_timestamps = hardware_timestamps
+        self.api_preference = api_preference
+        self.cap = None
+
+    def open(self):
+        cap = cv2.VideoCapture(self.cam_id, self.api_preference)
+        if self.fourcc:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        cap.set(cv2.CAP_PROP_FPS, self.fps)
+        if self.buffer_size is not None:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size)
+
+        if not cap.isOpened():
+            self.log_callback("摄像头打开失败")
+            return False
+        if self.fourcc:
+            code = int(cap.get(cv2.CAP_PROP_FOURCC))
+            actual = "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+            if actual != self.fourcc:
+                self.log_callback(f"[系统] 相机不支持像素格式 {self.fourcc}，实际为 {actual!r}")
+        self.cap = cap
+        return True
+
+    @property
+    def frame_size(self):
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def _read(self, image):
+        return self.cap.read(image=image)
+
+    def grab(self):
+        ret = self.cap.grab()
+        if ret:
+            self._count_frame(self._frame_timestamp())
+        return ret
+
+    def _frame_timestamp(self):
+        if self.hardware_timestamps:
+            msec = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+            if msec > 0:
+                return msec / 1000.0
+        return time.perf_counter()
+
+    def _count_frame(self, timestamp):
+        # 驱动时间戳的间隔超过标称帧间隔的 1.5 倍时，中间缺少的帧计为丢帧
+        if self.hardware_timestamps and self.timestamp is not None and self.fps:
+            missing = round((timestamp - self.timestamp) * self.fps) - 1
+            if missing > 0:
+                self.dropped += missing
+        super()._count_frame(timestamp)
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+class ImageDirectorySource(FrameSource):
+    """
+    图片目录回放：按文件名顺序依次输出 dirs 下（含子目录，目录可以用通配符）的所有图片
+    rate 为回放帧率（None 或 0 不限速）；图片按原始分辨率输出，不做缩放（缩放会改变宽高比与面积阈值，
+    也与标定不符）：帧尺寸为 size=(宽, 高)，为 None 时取第一张可读取图片的尺寸，尺寸不同的图片跳过；
+    preload 为 True 时预先解码全部图片，不限速回放时不受 JPEG 解码速度限制（注意内存占用）
+    """
+
+    def __init__(self, dirs=DEFAULT_REPLAY_DIRS, rate=10.0, loop=True, preload=False, size=None, log_callback=print):
+        super().__init__(rate=rate, log_callback=log_callback)
+        self.dirs = [dirs] if isinstance(dirs, str) else list(dirs)
+        self.loop = loop
+        self.preload = preload
+        self.paths = []
+        self._size = tuple(size) if size is not None else None
+        self._skipped = set()  # 尺寸不符而跳过的图片
+        self._images = None
+        self._index = 0
+
+    def open(self):
+        self.paths = []
+        for pattern in self.dirs:
+            for directory in sorted(glob.glob(pattern)):
+                for root, _, files in sorted(os.walk(directory)):
+                    self.paths.extend(os.path.join(root, name) for name in sorted(files)
+                                      if name.lower().endswith(IMAGE_EXTENSIONS))
+        self._skipped = set()
+        first = next((image for image in map(self._load, self.paths) if image is not None), None)
+        if first is None:
+            size = f"尺寸为 {self._size[0]}x{self._size[1]} 的" if self._size is not None else "可读取的"
+            self.log_callback(f"[系统] 回放目录 {', '.join(self.dirs)} 中没有{size}图片")
+            return False
+        self._size = (first.shape[1], first.shape[0])
+        if self.preload:
+            self._images = [image for image in map(self._load, self.paths) if image is not None]
+        self._index = 0
+        self.log_callback(f"[系统] 回放 {len(self.paths)} 张图片中尺寸为 {self._size[0]}x{self._size[1]} 的图片，"
+                          f"{'不限速' if not self.rate else f'{self.rate:g} fps'}")
+        return True
+
+    @property
+    def frame_size(self):
+        return self._size
+
+    @property
+    def exhausted(self):
+        return not self.loop and self._index >= self._count()
+
+    def _count(self):
+        return len(self._images) if self._images is not None else len(self.paths)
+
+    def _load(self, path):
+        """读取一张图片，无法解码或尺寸与回放尺寸不符时返回 None（尺寸不符的只提示一次，之后不再读取）"""
+        if path in self._skipped:
+            return None
+        image = cv2.imread(path)
+        if image is not None and self._size is not None and (image.shape[1], image.shape[0]) != self._size:
+            self._skipped.add(path)
+            self.log_callback(f"[系统] 跳过尺寸不符的图片 {path}（{image.shape[1]}x{image.shape[0]}，"
+                              f"回放尺寸 {self._size[0]}x{self._size[1]}）")
+            return None
+        return image
+
+    def _read(self, image):
+        # 跳过无法解码的文件，最多尝试一轮
+        for _ in range(self._count()):
+            if self._index >= self._count():
+                if not self.loop:
+                    return False, None
+                self._index = 0
+            index = self._index
+            self._index += 1
+            frame = self._images[index] if self._images is not None else self._load(self.paths[index])
+            if frame is None:
+                continue
+            if image is not None and image.shape == frame.shape:
+                image[...] = frame
+                return True, image
+            return True, frame.copy() if self._images is not None else frame
+        return False, None
+
+    def _skip(self, count):
+        self._index += count
+        if self.loop and self._count():
+            self._index %= self._count()
+
+
+class VideoFileSource(FrameSource):
+    """视频文件回放：rate 为 None 时按文件自身的帧率播放，0 表示不限速"""
+
+    def __init__(self, path, rate=None, loop=True, log_callback=print):
+        super().__init__(rate=rate, log_callback=log_callback)
+        self.path = path
+        self.loop = loop
+        self.cap = None
+        self._ended = False
+
+    def open(self):
+        cap = cv2.VideoCapture(self.path)
+        if not cap.isOpened():
+            self.log_callback(f"[系统] 视频文件 {self.path} 打开失败")
+            return False
+        if self.rate is None:
+            self.rate = cap.get(cv2.CAP_PROP_FPS) or 0
+        self.cap = cap
+        self._ended = False
+        self.log_callback(f"[系统] 回放视频 {self.path}，{'不限速' if not self.rate else f'{self.rate:g} fps'}")
+        return True
+
+    @property
+    def frame_size(self):
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    @property
+    def exhausted(self):
+        return self._ended
+
+    def _read(self, image):
+        ret, frame = self.cap.read(image=image)
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read(image=image)
+        self._ended = not ret
+        return ret, frame
+
+    def _skip(self, count):
+        for _ in range(count):
+            if not self.cap.grab():
+                if not self.loop:
+                    self._ended = True
+                    return
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+def add_source_arguments(parser):
+    """命令行帧源参数（service.py、main.py 共用）"""
+    group = parser.add_argument_group("帧源")
+    group.add_argument("--source", choices=SOURCE_KINDS, default="camera",
+                       help="帧源：实时相机、图片目录回放或视频文件")
+    group.add_argument("--fourcc", default=None, help="相机像素格式，如 MJPG")
+    group.add_argument("--buffer-size", type=int, default=None, help="相机驱动缓冲帧数，1 表示总是读最新帧")
+    group.add_argument("--hardware-timestamps", action="store_true", help="按相机驱动的帧时间戳统计帧率与丢帧")
+    group.add_argument("--replay-dir", action="append", default=None, metavar="DIR",
+                       help=f"回放的图片目录，可多次指定，支持通配符（默认 {' 与 '.join(DEFAULT_REPLAY_DIRS)}）")
+    group.add_argument("--replay-size", type=lambda s: tuple(int(v) for v in s.lower().split("x")), default=None,
+                       metavar="WxH", help="回放图片的尺寸，其他尺寸的图片跳过（默认 "
+                                           f"{DEFAULT_REPLAY_SIZE[0]}x{DEFAULT_REPLAY_SIZE[1]}，指定了 --replay-dir 时"
+                                           "取第一张图片的尺寸）")
+    group.add_argument("--video", default=None, help="回放的视频文件")
+    group.add_argument("--replay-fps", type=float, default=None,
+                       help="回放帧率，0 表示不限速（默认图片 10 fps，视频按文件帧率）")
+    group.add_argument("--replay-preload", action="store_true", help="预先解码全部回放图片")
+    group.add_argument("--no-loop", action="store_true", help="回放一遍后停止")
+    return group
+
+
+def source_from_args(args, cam_id=1):
+    """由 add_source_arguments 解析出的参数创建帧源（日志回调由 FrameGrabber 设置）"""
+    if args.source == "replay":
+        size = args.replay_size
+        if size is None and args.replay_dir is None:
+            size = DEFAULT_REPLAY_SIZE
+        return ImageDirectorySource(args.replay_dir or DEFAULT_REPLAY_DIRS,
+                                    rate=10.0 if args.replay_fps is None else args.replay_fps,
+                                    loop=not args.no_loop, preload=args.replay_preload, size=size)
+    if args.source == "video":
+        if args.video is None:
+            raise ValueError("--source video requires --video PATH")
+        return VideoFileSource(args.video, rate=args.replay_fps, loop=not args.no_loop)
+    return CameraSource(cam_id, fourcc=args.fourcc, buffer_size=args.buffer_size,
+                        hardware_timestamps=args.hardware_timestamps)
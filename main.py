@@ -1,18 +1,27 @@
-import os
+import argparse
 import sys
-from datetime import datetime
+import threading
+import time
 
 import cv2
 import numpy as np
 from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QImage, QPixmap
-from PyQt5.QtWidgets import (QApplication, QDialog, QDialogButtonBox,
-                             QFormLayout, QFrame, QHBoxLayout, QLabel,
-                             QLineEdit, QPushButton, QTextEdit, QVBoxLayout,
-                             QWidget)
-
-from communication import TCPServerThread
-from detect import detect_multiple_objects
+from PyQt5.QtWidgets import (QApplication, QCheckBox, QComboBox, QDialog,
+                             QDialogButtonBox, QFormLayout, QFrame,
+                             QHBoxLayout, QLabel, QLineEdit, QPushButton,
+                             QTextEdit, QVBoxLayout, QWidget)
+
+from capture import FrameGrabber, ProcessCapture
+from communication import SEND_MODES, TCPServerThread
+from frame_sources import add_source_arguments, source_from_args
+from metrics import (DETECTION_STAGE_SECONDS, FRAMES_CAPTURED, FRAMES_DROPPED, PLC_ROUND_TRIP_SECONDS,
+                     PLC_SEND_ERRORS, SOURCE_FRAMES_DROPPED, WORKPIECES_DETECTED, MetricsServer)
+from persistence import ResultSaver
+from result_channel import ResultChannel
+from shared_results import DEFAULT_SHM_NAME, SharedResultBridge
+from tracking import TrackingLoop
+from worker import DetectionWorker
 
 # # TCP通讯设置
 # HOST = '192.168.1.100'
@@ -21,10 +30,10 @@ from detect import detect_multiple_objects
 
 
 class TcpConfigDialog(QDialog):
-    def __init__(self, parent=None, default_host='192.168.1.100', default_port=2000):
+    def __init__(self, parent=None, default_host='192.168.1.100', default_port=2000, default_send_mode='legacy'):
         super().__init__(parent)
         self.setWindowTitle("TCP 设置")
-        self.setFixedSize(300, 120)
+        self.setFixedSize(300, 150)
 
         layout = QFormLayout()
 
@@ -32,6 +41,10 @@ class TcpConfigDialog(QDialog):
         self.port_edit = QLineEdit(str(default_port))
         layout.addRow("IP 地址：", self.ip_edit)
         layout.addRow("端口号：", self.port_edit)
+        self.send_mode_combo = QComboBox()
+        self.send_mode_combo.addItems(SEND_MODES)
+        self.send_mode_combo.setCurrentText(default_send_mode)
+        layout.addRow("发送模式：", self.send_mode_combo)
 
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         layout.addWidget(button_box)
@@ -42,74 +55,116 @@ class TcpConfigDialog(QDialog):
         self.setLayout(layout)
 
     def get_config(self):
-        return self.ip_edit.text(), int(self.port_edit.text())
+        return self.ip_edit.text(), int(self.port_edit.text()), self.send_mode_combo.currentText()
 
 # 视频流进程
 class VideoThread(QThread):
-    frame_ready = pyqtSignal(np.ndarray)
+    """FrameGrabber 的 Qt 包装：在采集线程中生成预览图，GUI 线程只负责显示"""
+    preview_ready = pyqtSignal(np.ndarray)
     log_signal = pyqtSignal(str)
 
-    def __init__(self, cam_id=1):
+    def __init__(self, cam_id=1, num_slots=4, preview_size=(640, 512), separate_process=False, source=None,
+                 max_preview_fps=30):
         super().__init__()
-        self.cam_id = cam_id
-        self.running = True
-        self._latest_frame = None  
+        self.preview_size = preview_size
+        # 回放帧源不限速时帧率可达数百 fps，预览按 max_preview_fps 抽帧，避免信号堆积在 GUI 线程
+        self.preview_interval = 1.0 / max_preview_fps
+        self._last_preview = 0.0
+        # separate_process：采集在独立进程中运行，本线程只从共享内存读取新帧生成预览
+        grabber_class = ProcessCapture if separate_process else FrameGrabber
+        self.grabber = grabber_class(cam_id=cam_id, num_slots=num_slots, source=source,
+                                     log_callback=self.log_signal.emit)
+        self.frame_buffer = self.grabber.frame_buffer
+
+    @property
+    def dropped_frames(self):
+        return self.grabber.dropped_frames
 
     def run(self):
-        cap = cv2.VideoCapture(self.cam_id)
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 2592)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1944)
-        cap.set(cv2.CAP_PROP_FPS, 10)
+        self.grabber.run(on_frame=self.emit_preview)
 
-        if not cap.isOpened():
-            print("摄像头打开失败")
+    def emit_preview(self, frame):
+        now = time.perf_counter()
+        if now - self._last_preview < self.preview_interval:
             return
+        self._last_preview = now
+        preview = cv2.resize(frame, self.preview_size, interpolation=cv2.INTER_AREA)
+        self.preview_ready.emit(cv2.cvtColor(preview, cv2.COLOR_BGR2RGB))
 
-        while self.running:
-            ret, frame = cap.read()
-            if not ret:
-                continue
-            # frame_resized = cv2.resize(frame, (640, 512))
-            self._latest_frame = frame.copy()  # 缓存当前帧
-            self.frame_ready.emit(frame)
-
-        cap.release()
+    def acquire_current_frame(self):
+        """获取当前帧的只读引用（不拷贝），用完需 release()"""
+        return self.grabber.acquire_current_frame()
 
     def get_current_frame(self):
-        return self._latest_frame.copy() if self._latest_frame is not None else None
+        return self.grabber.get_current_frame()
 
     def stop(self):
-        self.running = False
+        self.grabber.stop()
         self.wait()
 
 
-
 class MyApp(QWidget):
-    def __init__(self):
+    # 供非 Qt 线程（如保存线程）安全地向界面输出日志
+    log_signal = pyqtSignal(str)
+
+    def __init__(self, metrics_port=None, shared_results=None, separate_processes=False, cam_id=1, source=None):
         super().__init__()
         self.setWindowTitle("数字孪生智能控制系统")
         self.setGeometry(100, 100, 1000, 600)
         self.tcp_thread = None
         self.init_ui()
         self.workpiece_info_list = []
+        self.result_channel = ResultChannel()
 
         # 启动摄像头线程
-        self.video_thread = VideoThread(cam_id=1)
-        self.video_thread.frame_ready.connect(self.display_frame)
+        # source 为帧源（默认 cam_id 对应的相机，也可以是图片目录或视频文件回放）
+        self.video_thread = VideoThread(cam_id=cam_id, separate_process=separate_processes, source=source)
+        self.video_thread.preview_ready.connect(self.display_preview)
         self.video_thread.log_signal.connect(self.workpiece_box.append)
         self.video_thread.start()
 
+        # 启动结果保存线程
+        self.log_signal.connect(self.workpiece_box.append)
+        self.result_saver = ResultSaver(log_callback=self.log_signal.emit)
+        self.result_saver.start()
+
+        # 启动识别线程
+        # 独立进程模式：识别进程直接读取采集进程写入共享内存的帧
+        shared_frames = self.video_thread.frame_buffer if separate_processes else None
+        self.detection_worker = DetectionWorker(saver=self.result_saver, result_channel=self.result_channel,
+                                                shared_frames=shared_frames)
+        self.detection_worker.result_ready.connect(self.on_detection_done)
+        self.detection_worker.log_signal.connect(self.workpiece_box.append)
+        self.detection_worker.start()
+
         # 目前模式
         self.current_display_mode = 'video' # 默认显示视频
         # tcp 配置
         self.tcp_host = '192.168.1.100'
         self.tcp_port = 2000
+        self.tcp_send_mode = 'legacy'
 
         # 初始化定时器，单次触发
         self.photo_display_timer = QTimer(self)
         self.photo_display_timer.setSingleShot(True)
         self.photo_display_timer.timeout.connect(self.switch_to_video_mode)
 
+        # 运行指标：可选的本地抓取接口 + 每秒刷新的统计面板
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(port=metrics_port).start()
+            self.info_box.append(f"[系统] 指标接口 http://{self.metrics_server.host}:{self.metrics_server.port}/metrics")
+        self._last_stats = (time.perf_counter(), FRAMES_CAPTURED.value())
+
+        # 可选：识别结果同步写入共享内存，供本机数字孪生进程读取
+        self.shared_results = None
+        if shared_results is not None:
+            self.shared_results = SharedResultBridge(self.result_channel, shared_results,
+                                                     log_callback=self.log_signal.emit).start()
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.update_stats)
+        self.stats_timer.start(1000)
+
     def init_ui(self):
         # 主布局：横向
         main_layout = QHBoxLayout()
@@ -163,6 +218,12 @@ class MyApp(QWidget):
         self.capture_btn.clicked.connect(self.capture_and_detect)
         self.tcp_config_btn = QPushButton("配置 TCP")
         self.tcp_config_btn.clicked.connect(self.open_tcp_config)
+        self.plc_trigger_box = QCheckBox("PLC 触发拍照")
+        self.plc_trigger_box.toggled.connect(self.toggle_plc_trigger)
+        self.tracking_box = QCheckBox("连续跟踪（传送带）")
+        self.tracking_box.toggled.connect(self.toggle_tracking)
+        self.tracking_loop = None
+        self.tracking_thread = None
 
         
         # 通讯信息窗口
@@ -175,6 +236,10 @@ class MyApp(QWidget):
         self.workpiece_box.setReadOnly(True)
         self.workpiece_box.setPlaceholderText("工件信息将在此显示...")
 
+        # 运行统计面板
+        self.stats_label = QLabel("运行统计将在此显示...")
+        self.stats_label.setStyleSheet("QLabel { font-family: monospace; font-size: 13px; color: #37474f; }")
+
         # 添加到左侧布局
         left_panel.addWidget(self.logo_label)
         left_panel.addSpacing(20)  # 增加空隙
@@ -187,8 +252,11 @@ class MyApp(QWidget):
 
 
         left_panel.addWidget(self.capture_btn)
+        left_panel.addWidget(self.plc_trigger_box)
+        left_panel.addWidget(self.tracking_box)
         left_panel.addWidget(self.info_box)
         left_panel.addWidget(self.workpiece_box)
+        left_panel.addWidget(self.stats_label)
 
 
         # 右侧：视频显示区域
@@ -209,17 +277,20 @@ class MyApp(QWidget):
         main_layout.addWidget(self.label, stretch=2)
 
     def open_tcp_config(self):
-        dialog = TcpConfigDialog(self, self.tcp_host, self.tcp_port)
+        dialog = TcpConfigDialog(self, self.tcp_host, self.tcp_port, self.tcp_send_mode)
         if dialog.exec_() == QDialog.Accepted:
-            self.tcp_host, self.tcp_port = dialog.get_config()
-            self.info_box.append(f"[系统] TCP 设置更新为 {self.tcp_host}:{self.tcp_port}")
+            self.tcp_host, self.tcp_port, self.tcp_send_mode = dialog.get_config()
+            self.info_box.append(f"[系统] TCP 设置更新为 {self.tcp_host}:{self.tcp_port}（{self.tcp_send_mode}）")
         else:
             self.info_box.append("[系统] 已取消 TCP 设置")
 
 
     def handle_connect(self):
             if self.tcp_thread is None:
-                self.tcp_thread = TCPServerThread(workpiece_info_list=self.workpiece_info_list, host=self.tcp_host, port=self.tcp_port)
+                self.tcp_thread = TCPServerThread(result_channel=self.result_channel, host=self.tcp_host, port=self.tcp_port,
+                                                  capture_callback=self.trigger_capture,
+                                                  plc_trigger=self.plc_trigger_box.isChecked(),
+                                                  send_mode=self.tcp_send_mode)
                 self.tcp_thread.message_signal.connect(self.info_box.append)
                 self.tcp_thread.start()
                 self.info_box.append("[系统] TCP 服务已启动")
@@ -228,37 +299,52 @@ class MyApp(QWidget):
 
 
     def capture_and_detect(self):
-        frame = self.video_thread.get_current_frame()
-        if frame is None:
+        frame_ref = self.video_thread.acquire_current_frame()
+        if frame_ref is None:
             self.workpiece_box.append("[系统] 无法获取当前帧")
             return
-
-        self.workpiece_box.append("[系统] 开始识别拍摄图像...")
-        result , self.workpiece_info_list = detect_multiple_objects(frame, log_callback=self.workpiece_box.append)
-        
-        # ====保存图像====
-        save_dir = "results"
-        original_dir = os.path.join(save_dir, "original")
-        detect_dir = os.path.join(save_dir, "detect")
-        os.makedirs(original_dir, exist_ok=True)
-        os.makedirs(detect_dir, exist_ok=True)
-
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        # 保存原图
-        original_path = os.path.join(original_dir, f"{timestamp}.jpg")
-        cv2.imwrite(original_path, frame)
-
-        # 保存识别结果图
-        result_path = os.path.join(detect_dir, f"{timestamp}.jpg")
-        cv2.imwrite(result_path, result)
-
-        self.display_image(result)
-        self.workpiece_box.append(f"[系统] 识别图像已保存")
-        self.workpiece_box.append("[系统] 识别完成")
-
+        # 识别在后台线程执行，帧引用由工作线程在完成后释放
+        self.detection_worker.submit(frame_ref)
+
+    def trigger_capture(self, timings):
+        """
+        PLC 触发拍照（在通讯线程中调用，不访问界面控件）：取最新帧并提交识别
+        """
+        frame_ref = self.video_thread.acquire_current_frame()
+        if frame_ref is None:
+            self.log_signal.emit("[系统] 无法获取当前帧")
+            return False
+        timings["frame_acquired"] = time.perf_counter()
+        return self.detection_worker.submit(frame_ref, timings) is not None
+
+    def toggle_plc_trigger(self, checked):
         if self.tcp_thread is not None:
-            self.tcp_thread.workpiece_info_list = self.workpiece_info_list
-            self.tcp_thread.workpiece_index = 0  # 重置索引
+            self.tcp_thread.plc_trigger = checked
+        self.info_box.append(f"[系统] PLC 触发拍照已{'开启' if checked else '关闭'}")
+
+    def toggle_tracking(self, checked):
+        """连续跟踪：后台线程跟踪视频流中的工件并持续发布结果，PLC 收到 OK 时发送最新跟踪结果"""
+        if checked and self.tracking_loop is None:
+            self.tracking_loop = TrackingLoop(self.video_thread.frame_buffer, self.result_channel,
+                                              log_callback=self.log_signal.emit)
+            self.tracking_thread = threading.Thread(target=self.tracking_loop.run, daemon=True)
+            self.tracking_thread.start()
+        elif not checked and self.tracking_loop is not None:
+            self.stop_tracking()
+        self.info_box.append(f"[系统] 连续跟踪已{'开启' if checked else '关闭'}")
+
+    def stop_tracking(self):
+        if self.tracking_loop is not None:
+            self.tracking_loop.stop()
+            self.tracking_thread.join()
+            self.tracking_loop = None
+            self.tracking_thread = None
+
+    def on_detection_done(self, result):
+        self.workpiece_info_list = result["workpiece_info_list"]
+        self.display_rgb(result["preview"])
+        self.workpiece_box.append(f"[系统] {'复用结果' if result['cached'] else '识别完成'}，耗时 {result['latency'] * 1000:.0f} ms"
+                                  f"（识别 {result['detect_time'] * 1000:.0f} ms，队列剩余 {result['queue_depth']}）")
 
         # 切换为“photo”模式，暂停视频显示
         self.current_display_mode = 'photo'
@@ -270,13 +356,30 @@ class MyApp(QWidget):
         self.current_display_mode = 'video'
 
 
-    def display_frame(self, frame):
+    def display_preview(self, rgb):
         if self.current_display_mode == "video":
-            self.display_image(frame)
-
-    def display_image(self, frame):
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        rgb = cv2.resize(rgb, (640, 512))
+            self.display_rgb(rgb)
+
+    def update_stats(self):
+        now, captured = time.perf_counter(), FRAMES_CAPTURED.value()
+        last_time, last_captured = self._last_stats
+        self._last_stats = (now, captured)
+        fps = (captured - last_captured) / (now - last_time) if now > last_time else 0.0
+
+        def ms(value):
+            return "-" if value is None else f"{value * 1000:.0f}"
+
+        shapes = "  ".join(f"{shape} {int(WORKPIECES_DETECTED.value(shape=shape))}"
+                           for shape, in WORKPIECES_DETECTED.label_values()) or "-"
+        self.stats_label.setText(
+            f"采集 {fps:.1f} fps  丢帧 {int(FRAMES_DROPPED.value())}（帧源 {int(SOURCE_FRAMES_DROPPED.value())}）\n"
+            f"识别 平均 {ms(DETECTION_STAGE_SECONDS.mean(stage='total'))} ms"
+            f"  p95 {ms(DETECTION_STAGE_SECONDS.quantile(0.95, stage='total'))} ms\n"
+            f"工件 {shapes}\n"
+            f"PLC 往返 平均 {ms(PLC_ROUND_TRIP_SECONDS.mean())} ms"
+            f"  p95 {ms(PLC_ROUND_TRIP_SECONDS.quantile(0.95))} ms  发送失败 {int(PLC_SEND_ERRORS.value())}")
+
+    def display_rgb(self, rgb):
         h, w, ch = rgb.shape
         bytes_per_line = ch * w
         qt_image = QImage(rgb.data, w, h, bytes_per_line, QImage.Format_RGB888)
@@ -286,14 +389,35 @@ class MyApp(QWidget):
     def closeEvent(self, event):
         if self.tcp_thread:
             self.tcp_thread.stop()
+        self.stop_tracking()
+        self.detection_worker.stop()
+        self.result_saver.stop()
         self.video_thread.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.shared_results is not None:
+            self.shared_results.stop()
         super().closeEvent(event)
 
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MyApp()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--metrics-port", type=int, default=None, help="在本机该端口提供 Prometheus 指标接口")
+    parser.add_argument("--shared-results", nargs="?", const=DEFAULT_SHM_NAME, default=None, metavar="NAME",
+                        help="识别结果同步写入该名称的共享内存（默认名称 %(const)s）")
+    parser.add_argument("--separate-processes", action="store_true", help="采集与识别各在独立进程中运行，帧经共享内存传递")
+    parser.add_argument("--cam-id", type=int, default=1, help="相机编号")
+    add_source_arguments(parser)
+    args, qt_args = parser.parse_known_args()
+    try:
+        source = source_from_args(args, args.cam_id)
+    except ValueError as e:
+        parser.error(str(e))
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = MyApp(metrics_port=args.metrics_port, shared_results=args.shared_results,
+                   separate_processes=args.separate_processes, cam_id=args.cam_id,
+                   source=source)
     window.show()
     sys.exit(app.exec_())
 
@@ -0,0 +1,261 @@
+"""
+运行指标：计数器、仪表与直方图（线程安全），可按 Prometheus 文本格式导出，
+并可选地在本地 HTTP 端口提供抓取接口（/metrics）
+采集、识别与 PLC 通讯各环节直接更新本模块中定义的全局指标
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 延迟类直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 数量类直方图的默认分桶
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.labelnames and self.kind != "histogram":
+            self._values[()] = 0  # 无标签的计数器/仪表从 0 开始导出
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def label_values(self):
+        with self._lock:
+            return list(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """分桶直方图，记录观测值分布、总数与总和"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各桶计数（非累计，最后一项为 +Inf）, 总数, 总和]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+
+    def snapshot(self, **labels):
+        """返回 (总数, 总和, 累计分桶计数)"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            if state is None:
+                return 0, 0.0, [0] * (len(self.buckets) + 1)
+            counts, count, total = list(state[0]), state[1], state[2]
+        cumulative = []
+        running = 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return count, total, cumulative
+
+    def mean(self, **labels):
+        count, total, _ = self.snapshot(**labels)
+        return total / count if count else None
+
+    def quantile(self, q, **labels):
+        """按分桶线性插值估计分位数（与 Prometheus histogram_quantile 相同的算法）"""
+        count, _, cumulative = self.snapshot(**labels)
+        if count == 0:
+            return None
+        rank = q * count
+        index = bisect.bisect_left(cumulative, rank)
+        if index >= len(self.buckets):
+            return self.buckets[-1]
+        lower = self.buckets[index - 1] if index > 0 else 0.0
+        below = cumulative[index - 1] if index > 0 else 0
+        in_bucket = cumulative[index] - below
+        if in_bucket == 0:
+            return self.buckets[index]
+        return lower + (self.buckets[index] - lower) * (rank - below) / in_bucket
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key in self.label_values():
+            count, total, cumulative = self.snapshot(**dict(zip(self.labelnames, key)))
+            for bound, value in zip(self.buckets + (float("inf"),), cumulative):
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {value}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(float(total))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# ==== 采集 ====
+FRAMES_CAPTURED = REGISTRY.counter("shixun_frames_captured_total", "Frames read from the camera")
+FRAMES_DROPPED = REGISTRY.counter("shixun_frames_dropped_total", "Frames dropped because every buffer slot was held")
+CAPTURE_READ_FAILURES = REGISTRY.counter("shixun_capture_read_failures_total", "Failed camera reads")
+CAPTURE_READ_SECONDS = REGISTRY.histogram("shixun_capture_read_seconds", "Time spent in a single camera read")
+LAST_FRAME_TIMESTAMP = REGISTRY.gauge("shixun_last_frame_timestamp_seconds", "Unix time of the latest frame")
+SOURCE_FPS = REGISTRY.gauge("shixun_source_fps", "Frame rate achieved by the frame source")
+SOURCE_FRAMES_DROPPED = REGISTRY.counter("shixun_source_frames_dropped_total",
+                                         "Frames lost or skipped by the frame source before delivery")
+
+# ==== 识别 ====
+DETECTION_STAGE_SECONDS = REGISTRY.histogram("shixun_detection_stage_seconds",
+                                             "Detection time per frame and stage", ["stage"])
+DETECTION_CONTOURS = REGISTRY.histogram("shixun_detection_contours", "Contours found per frame and colour",
+                                        ["color"], buckets=COUNT_BUCKETS)
+WORKPIECES_DETECTED = REGISTRY.counter("shixun_workpieces_detected_total", "Detected workpieces", ["shape"])
+WORKPIECES_UNSLOTTED = REGISTRY.counter("shixun_workpieces_unslotted_total",
+                                        "Detected workpieces dropped because their shape had no free slot", ["shape"])
+DETECTION_CACHE_HITS = REGISTRY.counter("shixun_detection_cache_hits_total",
+                                        "Detections answered from the cached result of an unchanged scene")
+DETECTIONS_REJECTED = REGISTRY.counter("shixun_detections_rejected_total",
+                                       "Detection requests rejected because the queue was full")
+
+# ==== PLC 通讯 ====
+PLC_CONNECTIONS = REGISTRY.gauge("shixun_plc_connections", "Open PLC connections")
+PLC_REQUESTS = REGISTRY.counter("shixun_plc_requests_total", "OK requests received from the PLC", ["mode"])
+PLC_ROUND_TRIP_SECONDS = REGISTRY.histogram("shixun_plc_round_trip_seconds",
+                                            "Time from a PLC OK to the first workpiece record sent")
+PLC_SEND_SECONDS = REGISTRY.histogram("shixun_plc_send_seconds", "Time to write and drain one message")
+PLC_SEND_ERRORS = REGISTRY.counter("shixun_plc_send_errors_total", "Failed sends to the PLC")
+
+
+class MetricsServer:
+    """在后台线程提供 /metrics 抓取接口（默认只监听本机）"""
+
+    def __init__(self, port=9100, host="127.0.0.1", registry=REGISTRY):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry_ref.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
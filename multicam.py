@@ -0,0 +1,300 @@
+"""
+多相机模式（不依赖 Qt）：每台相机一个子进程，进程内采集线程 + 识别循环，使用各自的标定文件 config/<camera>/；
+PLC 触发时所有相机同时取最新帧识别，各相机的世界坐标结果合并为一个托盘视图，
+重叠区域内不同相机看到的同一工件按世界坐标半径去重，最后统一分配编号并发布到 ResultChannel
+进程之间只传递识别结果（几十个数字），不传图像
+
+    python service.py --camera left=0 --camera right=1 --host 0.0.0.0
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+
+from capture import FrameGrabber
+from communication import TCPServer
+from detect import assign_slots, locate_workpieces, slotted_workpiece_info
+from frame_sources import CameraSource
+from metrics import MetricsServer
+from persistence import ResultSaver
+from result_channel import ResultChannel
+from shared_results import SharedResultBridge
+from utils.pixel2world import DEFAULT_CONFIG_ROOT, camera_config_paths, get_world_lut
+from utils.spatial_index import GridIndex
+
+CameraSpec = namedtuple("CameraSpec", ["name", "cam_id", "width", "height"], defaults=(2592, 1944))
+
+
+def parse_camera_spec(text):
+    """'名称=相机编号[@宽x高]'，如 left=0 或 right=1@2592x1944"""
+    name, _, rest = text.partition("=")
+    if not name or not rest:
+        raise ValueError(f"Camera must be given as NAME=ID[@WxH], got {text!r}")
+    cam_id, _, size = rest.partition("@")
+    if size:
+        width, height = (int(v) for v in size.lower().split("x"))
+        return CameraSpec(name, int(cam_id), width, height)
+    return CameraSpec(name, int(cam_id))
+
+
+def is_clipped(corners, width, height):
+    """多边形碰到图像边界，说明工件只有一部分在画面内，质心不可靠"""
+    x, y, w, h = cv2.boundingRect(corners)
+    return x <= 0 or y <= 0 or x + w >= width or y + h >= height
+
+
+def merge_detections(workpieces, radius=20.0, drop_clipped=True):
+    """
+    合并多台相机的识别结果（locate_workpieces 的结果，附带 camera、clipped、border 字段）
+    不同相机在世界坐标 radius 毫米内的检测视为同一工件（不区分形状），保留离所在图像边界最远的一个；
+    drop_clipped 为 True 时丢弃碰到图像边界的检测（相机视野重叠不少于一个工件宽度时，
+    该工件在另一台相机中是完整的）
+    返回合并后的工件列表，按相机顺序与识别顺序排列
+    """
+    candidates = [(i, w) for i, w in enumerate(workpieces) if not (drop_clipped and w["clipped"])]
+    index = GridIndex(radius)
+    kept = []
+    for i, workpiece in sorted(candidates, key=lambda item: -item[1]["border"]):
+        if any(camera != workpiece["camera"] for _, _, camera in index.neighbours(workpiece["x"], workpiece["y"])):
+            continue
+        index.add(workpiece["x"], workpiece["y"], workpiece["camera"])
+        kept.append((i, workpiece))
+    return [workpiece for _, workpiece in sorted(kept, key=lambda item: item[0])]
+
+
+def camera_worker(spec, config_root, pyramid_level, save_dir, cv_threads, camera_options, requests, results):
+    """
+    相机子进程入口：requests 中为触发编号（None 表示退出），结果与日志写入 results
+    camera_options 为 CameraSource 的附加参数（fourcc、buffer_size、hardware_timestamps）
+    """
+    def log(message):
+        results.put(("log", spec.name, message))
+
+    cv2.setNumThreads(cv_threads)
+    calibration_paths = camera_config_paths(spec.name, config_root)
+    missing = [path for path in calibration_paths if not os.path.exists(path)]
+    if missing:
+        log(f"[错误] 缺少标定文件 {', '.join(missing)}")
+
+    source = CameraSource(spec.cam_id, spec.width, spec.height, **camera_options)
+    grabber = FrameGrabber(cam_id=spec.cam_id, width=spec.width, height=spec.height, source=source,
+                           log_callback=log)
+    capture_thread = threading.Thread(target=grabber.run, daemon=True)
+    capture_thread.start()
+    saver = None
+    if save_dir is not None:
+        saver = ResultSaver(save_dir=os.path.join(save_dir, spec.name), log_callback=log)
+        saver.start()
+
+    try:
+        while True:
+            job_id = requests.get()
+            if job_id is None:
+                break
+            started_at = time.perf_counter()
+            frame_ref = grabber.acquire_current_frame()
+            if frame_ref is None or missing:
+                results.put(("result", spec.name, job_id, None, None))
+                continue
+            try:
+                with frame_ref:
+                    frame = frame_ref.frame
+                    height, width = frame.shape[:2]
+                    world_lut = get_world_lut(width, height, *calibration_paths)
+                    record, workpieces = locate_workpieces(frame, log_callback=log, calibration=world_lut,
+                                                           pyramid_level=pyramid_level)
+                    for obj, workpiece in zip(record, workpieces):
+                        cx, cy = obj.center
+                        workpiece.update(camera=spec.name, clipped=is_clipped(obj.corners, width, height),
+                                         border=min(cx, cy, width - 1 - cx, height - 1 - cy))
+                    if saver is not None:
+                        saver.submit(frame_ref.retain(), record)
+                results.put(("result", spec.name, job_id, workpieces,
+                             {"frame_seq": frame_ref.seq, "detect_time": time.perf_counter() - started_at}))
+            except Exception as e:
+                log(f"[识别错误] {e}")
+                results.put(("result", spec.name, job_id, None, None))
+    finally:
+        grabber.stop()
+        capture_thread.join(timeout=5)
+        if saver is not None:
+            saver.stop()
+
+
+class MultiCameraDetector:
+    """
+    多相机识别协调器：启动各相机子进程，trigger() 向所有相机广播一次识别请求，
+    收集线程等齐所有相机的结果（或超时）后合并、编号并发布到 result_channel
+    只支持实时相机，camera_options 为各相机共用的 CameraSource 附加参数
+    注意：识别相关的运行指标在子进程中累计，不出现在主进程的指标接口中
+    """
+
+    def __init__(self, cameras, result_channel, config_root=DEFAULT_CONFIG_ROOT, pyramid_level=0, save_dir=None,
+                 merge_radius=20.0, drop_clipped=True, slot_layout=None, timeout=5.0, camera_options=None,
+                 log_callback=print):
+        if len({spec.name for spec in cameras}) != len(cameras):
+            raise ValueError("Camera names must be unique")
+        self.cameras = list(cameras)
+        self.result_channel = result_channel
+        self.config_root = config_root
+        self.pyramid_level = pyramid_level
+        self.save_dir = save_dir
+        self.merge_radius = merge_radius
+        self.drop_clipped = drop_clipped
+        self.slot_layout = slot_layout
+        self.timeout = timeout
+        self.camera_options = dict(camera_options or {})
+        self.log_callback = log_callback
+        self.running = False
+        # spawn：子进程不继承主进程的线程与相机句柄（Windows 上也只能用 spawn）
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._requests = {}
+        self._processes = []
+        self._pending = {}  # 触发编号 → dict(timings, results, started_at)
+        self._lock = threading.Lock()
+        self._next_job_id = 0
+        self._collector = None
+
+    def start(self):
+        cv_threads = max(1, (os.cpu_count() or 1) // len(self.cameras))
+        for spec in self.cameras:
+            requests = self._context.Queue()
+            process = self._context.Process(
+                target=camera_worker, name=f"camera-{spec.name}", daemon=True,
+                args=(spec, self.config_root, self.pyramid_level, self.save_dir, cv_threads, self.camera_options,
+                      requests, self._results))
+            process.start()
+            self._requests[spec.name] = requests
+            self._processes.append(process)
+        self.running = True
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        self.log_callback(f"[系统] 多相机模式：{', '.join(f'{s.name}(相机{s.cam_id})' for s in self.cameras)}")
+        return self
+
+    def trigger(self, timings=None):
+        """向所有相机广播一次识别请求，返回触发编号；未启动时返回 None"""
+        if not self.running:
+            return None
+        with self._lock:
+            self._next_job_id += 1
+            job_id = self._next_job_id
+            self._pending[job_id] = {"timings": dict(timings or {}), "results": {},
+                                     "started_at": time.perf_counter()}
+        for requests in self._requests.values():
+            requests.put(job_id)
+        return job_id
+
+    def _collect(self):
+        while self.running:
+            try:
+                message = self._results.get(timeout=0.1)
+            except queue.Empty:
+                message = None
+            if message is not None and message[0] == "log":
+                _, camera, text = message
+                self.log_callback(f"[{camera}] {text}")
+            elif message is not None:
+                _, camera, job_id, workpieces, info = message
+                with self._lock:
+                    job = self._pending.get(job_id)
+                    if job is not None:
+                        job["results"][camera] = (workpieces, info)
+            self._finish_ready()
+
+    def _finish_ready(self):
+        now = time.perf_counter()
+        with self._lock:
+            ready = [(job_id, self._pending.pop(job_id)) for job_id, job in list(self._pending.items())
+                     if len(job["results"]) == len(self.cameras) or now - job["started_at"] > self.timeout]
+        for job_id, job in ready:
+            self._publish(job_id, job)
+
+    def _publish(self, job_id, job):
+        workpieces = []
+        for spec in self.cameras:
+            camera_workpieces, _ = job["results"].get(spec.name, (None, None))
+            if camera_workpieces is None:
+                self.log_callback(f"[{spec.name}] 本次没有得到识别结果")
+                continue
+            workpieces.extend(camera_workpieces)
+        merged = merge_detections(workpieces, self.merge_radius, self.drop_clipped)
+        slotted = assign_slots(merged, self.slot_layout, self.log_callback)
+        timings = dict(job["timings"], detection_done=time.perf_counter())
+        self.result_channel.publish(slotted_workpiece_info(slotted), timings=timings, job_id=job_id,
+                                    workpieces=slotted)
+        self.log_callback(f"[系统] 多相机识别完成，合并后工件 {len(merged)} 个（去重前 {len(workpieces)} 个），"
+                          f"耗时 {(timings['detection_done'] - job['started_at']) * 1000:.0f} ms")
+
+    def stop(self):
+        self.running = False
+        for requests in self._requests.values():
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        if self._collector is not None:
+            self._collector.join()
+
+
+class MultiCameraService:
+    """
+    多相机版本的 DetectionService：PLC 触发时所有相机同时识别，合并后的结果发回 PLC
+    只在 PLC 触发时识别，因此总是开启 PLC 触发拍照
+    """
+
+    def __init__(self, cameras, host='192.168.1.100', port=2000, send_mode="legacy",
+                 pyramid_level=0, config_root=DEFAULT_CONFIG_ROOT, merge_radius=20.0, save_dir="results",
+                 metrics_port=None, shared_results=None, camera_options=None, log_callback=print):
+        self.log_callback = log_callback
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.shared_results_name = shared_results
+        self.shared_results = None
+        self.result_channel = ResultChannel()
+        self.detector = MultiCameraDetector(cameras, self.result_channel, config_root=config_root,
+                                            pyramid_level=pyramid_level, save_dir=save_dir,
+                                            merge_radius=merge_radius, camera_options=camera_options,
+                                            log_callback=log_callback)
+        self.server = TCPServer(result_channel=self.result_channel, host=host, port=port,
+                                capture_callback=self.trigger_capture, plc_trigger=True,
+                                send_mode=send_mode, log_callback=log_callback)
+
+    def trigger_capture(self, timings):
+        """PLC 触发拍照：所有相机各取最新帧识别"""
+        timings["frame_acquired"] = time.perf_counter()
+        return self.detector.trigger(timings) is not None
+
+    def run(self):
+        """启动相机进程并阻塞运行通讯服务，直到 stop() 或 Ctrl+C"""
+        if self.metrics_port is not None:
+            self.metrics_server = MetricsServer(port=self.metrics_port).start()
+            self.log_callback(f"[系统] 指标接口 http://{self.metrics_server.host}:{self.metrics_server.port}/metrics")
+        if self.shared_results_name is not None:
+            self.shared_results = SharedResultBridge(self.result_channel, self.shared_results_name,
+                                                     log_callback=self.log_callback).start()
+        self.detector.start()
+        try:
+            self.server.run()
+        except KeyboardInterrupt:
+            self.log_callback("[系统] 收到中断，正在停止服务...")
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        """可在其他线程调用，通讯服务退出后 run() 负责清理"""
+        self.server.stop()
+
+    def shutdown(self):
+        self.server.stop()
+        self.detector.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.shared_results is not None:
+            self.shared_results.stop()
@@ -0,0 +1,166 @@
+import os
+import queue
+import threading
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from utils.overlay import DetectionRecord
+
+
+# 支持的保存格式及其文件后缀
+ENCODING_EXTENSIONS = {
+    "jpg": ".jpg",
+    "png": ".png",
+    "npy": ".npy",
+}
+
+
+def encode_and_write(path, image, encoding="jpg", jpeg_quality=95, png_compression=3):
+    """按指定格式写入图像"""
+    if encoding == "jpg":
+        cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    elif encoding == "png":
+        cv2.imwrite(path, image, [cv2.IMWRITE_PNG_COMPRESSION, png_compression])
+    elif encoding == "npy":
+        np.save(path, image)
+    else:
+        raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+# 结果保存线程
+class ResultSaver(threading.Thread):
+    """
+    后台保存原图与识别结果图，保存过程不阻塞识别 → PLC 的发送路径
+    每次唤醒后把队列中积压的任务一次写完，再按 max_disk_bytes 从最旧的文件开始清理
+    识别结果可以是标注图，也可以是 DetectionRecord（在保存线程中按 annotated_scale 渲染标注图）
+    """
+
+    def __init__(self, save_dir="results", encoding="jpg", jpeg_quality=95, png_compression=3,
+                 annotated_scale=1.0, max_disk_bytes=None, max_queue=2, log_callback=print):
+        super().__init__(daemon=True)
+        if encoding not in ENCODING_EXTENSIONS:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+        self.save_dir = save_dir
+        self.original_dir = os.path.join(save_dir, "original")
+        self.detect_dir = os.path.join(save_dir, "detect")
+        self.encoding = encoding
+        self.jpeg_quality = jpeg_quality
+        self.png_compression = png_compression
+        self.annotated_scale = annotated_scale
+        self.max_disk_bytes = max_disk_bytes
+        self.log_callback = log_callback
+        self._jobs = queue.Queue(maxsize=max_queue)
+        self._files = {}  # 路径 → 大小，按写入先后排序，用于最旧优先清理
+        self._disk_usage = 0
+
+    def submit(self, frame_ref, annotated, timestamp=None):
+        """
+        提交一次保存任务，frame_ref 由保存线程写完后释放；队列已满时放弃本次保存并返回 False
+        """
+        if timestamp is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        try:
+            self._jobs.put_nowait((timestamp, frame_ref, annotated))
+        except queue.Full:
+            frame_ref.release()
+            self.log_callback("[保存] 保存队列已满，跳过本次图像保存")
+            return False
+        return True
+
+    def run(self):
+        os.makedirs(self.original_dir, exist_ok=True)
+        os.makedirs(self.detect_dir, exist_ok=True)
+        self._scan_existing()
+
+        while True:
+            batch = [self._jobs.get()]
+            # 把积压的任务一次取完
+            while True:
+                try:
+                    batch.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            for job in batch:
+                if job is None:
+                    stop = True
+                    continue
+                self._write_job(*job)
+            self._evict()
+            if stop:
+                break
+
+    def _write_job(self, timestamp, frame_ref, annotated):
+        ext = ENCODING_EXTENSIONS[self.encoding]
+        try:
+            # 保存原图
+            original_path = os.path.join(self.original_dir, f"{timestamp}{ext}")
+            self._write(original_path, frame_ref.frame)
+        except Exception as e:
+            self.log_callback(f"[保存错误] {e}")
+
+        try:
+            # 识别记录在释放原图前按保存分辨率渲染，标注图按比例缩放
+            if isinstance(annotated, DetectionRecord):
+                annotated = annotated.render(frame_ref.frame, scale=self.annotated_scale)
+            elif self.annotated_scale != 1.0:
+                annotated = cv2.resize(annotated, None, fx=self.annotated_scale, fy=self.annotated_scale,
+                                       interpolation=cv2.INTER_AREA)
+        except Exception as e:
+            self.log_callback(f"[保存错误] {e}")
+            return
+        finally:
+            frame_ref.release()
+
+        try:
+            # 保存识别结果图
+            result_path = os.path.join(self.detect_dir, f"{timestamp}{ext}")
+            self._write(result_path, annotated)
+        except Exception as e:
+            self.log_callback(f"[保存错误] {e}")
+
+    def _write(self, path, image):
+        encode_and_write(path, image, self.encoding, self.jpeg_quality, self.png_compression)
+        self._track(path, os.path.getsize(path))
+
+    def _track(self, path, size):
+        # 同名文件被覆盖时先扣除旧的大小，并移到最新的位置
+        self._disk_usage -= self._files.pop(path, 0)
+        self._files[path] = size
+        self._disk_usage += size
+
+    def _scan_existing(self):
+        """统计已存在的结果文件，按修改时间从旧到新登记"""
+        existing = []
+        for directory in (self.original_dir, self.detect_dir):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        existing.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(existing):
+            self._track(path, size)
+
+    def _evict(self):
+        """超过磁盘上限时从最旧的文件开始删除"""
+        if self.max_disk_bytes is None:
+            return
+        while self._disk_usage > self.max_disk_bytes and self._files:
+            path = next(iter(self._files))
+            size = self._files.pop(path)
+            self._disk_usage -= size
+            try:
+                os.remove(path)
+            except OSError as e:
+                self.log_callback(f"[保存错误] 清理 {path} 失败: {e}")
+
+    @property
+    def disk_usage(self):
+        return self._disk_usage
+
+    def stop(self):
+        self._jobs.put(None)
+        self.join()
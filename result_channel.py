@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+from collections import namedtuple
+
+
+# 一次识别结果的不可变快照
+# timings 为各环节时间戳（time.perf_counter()），PLC 触发时包含 trigger_id
+# 流式识别时同一 job_id 会先发布若干 complete=False 的部分结果（列表只增不改），最后发布完整结果
+# workpieces 为与工件信息对应的 [(编号, 形状, x_mm, y_mm, angle)]（世界坐标不取整），发布方没有提供时为 None
+ResultSnapshot = namedtuple("ResultSnapshot", ["version", "workpiece_info_list", "timestamp", "frame_seq",
+                                               "timings", "job_id", "complete", "workpieces"],
+                            defaults=(None, None, True, None))
+
+
+class ResultChannel:
+    """
+    版本化的识别结果通道
+    识别端 publish() 发布新快照后立即唤醒所有等待者（线程用条件变量，asyncio 协程用 Future），
+    读者拿到的始终是完整且不可变的一次识别结果，不会读到新旧混合的列表
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._snapshot = ResultSnapshot(0, (), 0.0, None)
+        self._async_waiters = set()  # (事件循环, Future)
+
+    def latest(self):
+        with self._cond:
+            return self._snapshot
+
+    def publish(self, workpiece_info_list, frame_seq=None, timings=None, job_id=None, complete=True,
+                workpieces=None):
+        """发布新的识别结果，返回对应快照"""
+        with self._cond:
+            snapshot = ResultSnapshot(self._snapshot.version + 1, tuple(workpiece_info_list),
+                                      time.time(), frame_seq, timings, job_id, complete,
+                                      None if workpieces is None else tuple(workpieces))
+            self._snapshot = snapshot
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(self._resolve, future, snapshot)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+        return snapshot
+
+    @staticmethod
+    def _resolve(future, snapshot):
+        if not future.done():
+            future.set_result(snapshot)
+
+    def wait(self, after_version, timeout=None):
+        """阻塞等待版本号大于 after_version 的快照，超时返回 None"""
+        with self._cond:
+            if self._cond.wait_for(lambda: self._snapshot.version > after_version, timeout):
+                return self._snapshot
+        return None
+
+    async def wait_async(self, after_version, timeout=None):
+        """协程版本的 wait()"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        entry = (loop, future)
+        with self._cond:
+            if self._snapshot.version > after_version:
+                return self._snapshot
+            self._async_waiters.add(entry)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._cond:
+                self._async_waiters.discard(entry)
@@ -0,0 +1,188 @@
+"""
+无界面识别服务入口（不依赖 PyQt）：相机采集 + 后台识别 + PLC TCP 通讯
+默认由 PLC 发送 OK 触发拍照识别，结果按 send_mode 发回 PLC
+
+    python service.py --host 0.0.0.0 --port 2000 --send-mode ack
+    python service.py --camera left=0 --camera right=1   # 多相机，标定文件在 config/<名称>/ 下
+"""
+import argparse
+import threading
+import time
+
+from capture import FrameGrabber, ProcessCapture
+from communication import SEND_MODES, TCPServer
+from frame_sources import add_source_arguments, source_from_args
+from metrics import MetricsServer
+from multicam import MultiCameraService, parse_camera_spec
+from persistence import ResultSaver
+from result_channel import ResultChannel
+from shared_results import DEFAULT_SHM_NAME, SharedResultBridge
+from tracking import TrackingLoop, WorkpieceTracker
+from worker import DetectionQueue, ProcessDetectionQueue
+
+
+class DetectionService:
+    """把采集、识别、保存与 PLC 通讯串起来；通讯事件循环在调用 run() 的线程中运行"""
+
+    def __init__(self, cam_id=1, host='192.168.1.100', port=2000, send_mode="legacy", plc_trigger=True,
+                 pyramid_level=0, streaming=False, scene_cache=True, save_dir="results", metrics_port=None,
+                 tracking=False, entry_region=None, shared_results=None, separate_processes=False,
+                 source=None, log_callback=print):
+        self.log_callback = log_callback
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.shared_results_name = shared_results  # 共享内存名称，为 None 时不写共享内存
+        self.shared_results = None
+        self.result_channel = ResultChannel()
+        # separate_processes：采集与识别各在独立进程中运行，帧经共享内存环形缓冲区传递
+        if separate_processes:
+            self.grabber = ProcessCapture(cam_id=cam_id, source=source, log_callback=log_callback)
+        else:
+            self.grabber = FrameGrabber(cam_id=cam_id, source=source, log_callback=log_callback)
+
+        self.saver = None
+        if save_dir is not None:
+            self.saver = ResultSaver(save_dir=save_dir, log_callback=log_callback)
+
+        # 无界面时不需要预览图
+        detector_options = dict(preview_size=None, pyramid_level=pyramid_level, saver=self.saver,
+                                result_channel=self.result_channel, streaming=streaming, scene_cache=scene_cache,
+                                on_result=self.on_detection_done, log_callback=log_callback)
+        if separate_processes:
+            self.detector = ProcessDetectionQueue(self.grabber.frame_buffer, **detector_options)
+        else:
+            self.detector = DetectionQueue(**detector_options)
+        self.server = TCPServer(result_channel=self.result_channel, host=host, port=port,
+                                capture_callback=self.trigger_capture, plc_trigger=plc_trigger,
+                                send_mode=send_mode, log_callback=log_callback)
+
+        self._threads = [threading.Thread(target=self.grabber.run, daemon=True),
+                         threading.Thread(target=self.detector.run, daemon=True)]
+
+        # 跟踪模式：在视频流上连续跟踪并发布结果，PLC 收到 OK 时直接发送最新的跟踪结果
+        self.tracking_loop = None
+        if tracking:
+            self.server.plc_trigger = False
+            self.tracking_loop = TrackingLoop(self.grabber.frame_buffer, self.result_channel,
+                                              WorkpieceTracker(entry_region=entry_region), log_callback=log_callback)
+            self._threads.append(threading.Thread(target=self.tracking_loop.run, daemon=True))
+
+    def trigger_capture(self, timings):
+        """PLC 触发拍照：取最新帧并提交识别"""
+        frame_ref = self.grabber.acquire_current_frame()
+        if frame_ref is None:
+            self.log_callback("[系统] 无法获取当前帧")
+            return False
+        timings["frame_acquired"] = time.perf_counter()
+        return self.detector.submit(frame_ref, timings) is not None
+
+    def on_detection_done(self, result):
+        self.log_callback(f"[系统] {'复用结果' if result['cached'] else '识别完成'}，工件 {len(result['workpiece_info_list'])} 个，"
+                          f"耗时 {result['latency'] * 1000:.0f} ms"
+                          f"（识别 {result['detect_time'] * 1000:.0f} ms，队列剩余 {result['queue_depth']}）")
+
+    def run(self):
+        """启动后台线程并阻塞运行通讯服务，直到 stop() 或 Ctrl+C"""
+        if self.metrics_port is not None:
+            self.metrics_server = MetricsServer(port=self.metrics_port).start()
+            self.log_callback(f"[系统] 指标接口 http://{self.metrics_server.host}:{self.metrics_server.port}/metrics")
+        if self.shared_results_name is not None:
+            self.shared_results = SharedResultBridge(self.result_channel, self.shared_results_name,
+                                                     log_callback=self.log_callback).start()
+        if self.saver is not None:
+            self.saver.start()
+        for thread in self._threads:
+            thread.start()
+        try:
+            self.server.run()
+        except KeyboardInterrupt:
+            self.log_callback("[系统] 收到中断，正在停止服务...")
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        """可在其他线程调用，通讯服务退出后 run() 负责清理"""
+        self.server.stop()
+
+    def shutdown(self):
+        self.server.stop()
+        self.grabber.stop()
+        self.detector.stop()
+        if self.tracking_loop is not None:
+            self.tracking_loop.stop()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        if self.saver is not None:
+            self.saver.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.shared_results is not None:
+            self.shared_results.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="无界面识别服务：相机采集 + 识别 + PLC 通讯")
+    parser.add_argument("--cam-id", type=int, default=1, help="相机编号")
+    parser.add_argument("--camera", type=parse_camera_spec, action="append", default=[], metavar="NAME=ID[@WxH]",
+                        help="多相机模式，每台相机指定一次，标定文件在 config/NAME/ 下（此时忽略 --cam-id）")
+    parser.add_argument("--merge-radius", type=float, default=20.0,
+                        help="多相机模式下不同相机的检测在该距离（毫米）内视为同一工件")
+    parser.add_argument("--host", default='192.168.1.100', help="监听地址")
+    parser.add_argument("--port", type=int, default=2000, help="监听端口")
+    parser.add_argument("--send-mode", choices=SEND_MODES, default="legacy", help="工件信息发送模式")
+    parser.add_argument("--no-plc-trigger", action="store_true", help="收到 OK 时不拍照，只发送最近一次识别结果")
+    parser.add_argument("--pyramid-level", type=int, default=0, help="金字塔粗检测层数，0 表示全分辨率")
+    parser.add_argument("--streaming", action="store_true", help="流式识别，边识别边发送")
+    parser.add_argument("--no-scene-cache", action="store_true", help="每次都完整识别，不复用未变化场景的结果")
+    parser.add_argument("--tracking", action="store_true", help="连续跟踪模式（传送带），PLC 直接取最新跟踪结果")
+    parser.add_argument("--entry-region", type=lambda s: tuple(int(v) for v in s.split(",")), default=None,
+                        metavar="X0,Y0,X1,Y1", help="跟踪模式下新工件进入画面的区域（像素）")
+    parser.add_argument("--save-dir", default="results", help="结果图像保存目录")
+    parser.add_argument("--no-save", action="store_true", help="不保存图像")
+    parser.add_argument("--metrics-port", type=int, default=None, help="在本机该端口提供 Prometheus 指标接口")
+    parser.add_argument("--shared-results", nargs="?", const=DEFAULT_SHM_NAME, default=None, metavar="NAME",
+                        help="识别结果同步写入该名称的共享内存，供本机数字孪生进程读取（默认名称 %(const)s）")
+    parser.add_argument("--separate-processes", action="store_true",
+                        help="采集与识别各在独立进程中运行，帧经共享内存传递")
+    add_source_arguments(parser)
+    args = parser.parse_args()
+    try:
+        source = source_from_args(args, args.cam_id)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.separate_processes and args.streaming:
+        parser.error("--streaming is not supported with --separate-processes")
+    if args.camera:
+        if args.tracking or args.streaming:
+            parser.error("--tracking/--streaming are not supported with --camera")
+        # 多相机模式只在 PLC 触发时识别，且每台相机都是实时相机
+        if args.no_plc_trigger:
+            parser.error("--no-plc-trigger is not supported with --camera")
+        if args.source != "camera":
+            parser.error("--source replay/video is not supported with --camera")
+        if args.separate_processes:
+            parser.error("--separate-processes is implied by --camera")
+        camera_options = dict(fourcc=args.fourcc, buffer_size=args.buffer_size,
+                              hardware_timestamps=args.hardware_timestamps)
+        service = MultiCameraService(args.camera, host=args.host, port=args.port, send_mode=args.send_mode,
+                                     pyramid_level=args.pyramid_level, merge_radius=args.merge_radius,
+                                     save_dir=None if args.no_save else args.save_dir,
+                                     metrics_port=args.metrics_port, shared_results=args.shared_results,
+                                     camera_options=camera_options)
+        service.run()
+        return
+
+    service = DetectionService(cam_id=args.cam_id, host=args.host, port=args.port, send_mode=args.send_mode,
+                               plc_trigger=not args.no_plc_trigger, pyramid_level=args.pyramid_level,
+                               streaming=args.streaming, scene_cache=not args.no_scene_cache,
+                               save_dir=None if args.no_save else args.save_dir,
+                               metrics_port=args.metrics_port, tracking=args.tracking,
+                               entry_region=args.entry_region, shared_results=args.shared_results,
+                               separate_processes=args.separate_processes,
+                               source=source)
+    service.run()
+
+
+if __name__ == "__main__":
+    main()
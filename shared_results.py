@@ -0,0 +1,284 @@
+"""
+共享内存识别结果通道（供本机数字孪生/仿真进程读取）
+识别结果（分配编号后的工件：编号、形状、未取整的世界坐标与角度）写入 multiprocessing.shared_memory 中固定布局的
+NumPy 结构化数组，读端直接映射同一块内存，无需经过 PLC 套接字，可高频读取最新托盘状态
+
+内存布局：64 字节头部（HEADER_DTYPE）+ capacity 条工件记录（RECORD_DTYPE），均为小端
+头部的 version 为 seqlock 计数：写入前加 1（奇数表示正在写），写完再加 1（偶数表示数据完整），
+读端读数据前后各读一次 version，两次相同且为偶数时数据一致，否则重读
+
+    python shared_results.py --name shixun_results   # 打印最新托盘状态
+"""
+import argparse
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from detect import parse_workpiece_info
+from utils.shm import attach_shared_memory
+
+DEFAULT_SHM_NAME = "shixun_results"
+LAYOUT_VERSION = 1
+
+# 形状编号（0 表示未知形状）
+SHAPE_IDS = {"Triangle": 1, "Rhombus": 2, "Hexagon": 3, "Trapezoid": 4}
+SHAPE_NAMES = {shape_id: shape for shape, shape_id in SHAPE_IDS.items()}
+
+HEADER_DTYPE = np.dtype({
+    "names": ["version", "layout", "capacity", "count", "complete", "frame_seq", "timestamp"],
+    "formats": ["<u8", "<u4", "<u4", "<u4", "<u4", "<i8", "<f8"],
+    "offsets": [0, 8, 12, 16, 20, 24, 32],
+    "itemsize": 64,
+})
+RECORD_DTYPE = np.dtype([
+    ("shape_id", "<u1"),
+    ("_pad", "u1", 3),
+    ("slot", "<i4"),        # 固定编号（从 1 开始）
+    ("x", "<f8"),           # 世界坐标（毫米）
+    ("y", "<f8"),
+    ("angle", "<f8"),       # 参考角（度）
+    ("timestamp", "<f8"),   # 发布时间（Unix 时间，秒）
+    ("frame_seq", "<i8"),   # 帧序号，未知时为 -1
+])
+
+# version 为发布次数；records 为 RECORD_DTYPE 数组
+SharedSnapshot = namedtuple("SharedSnapshot", ["version", "records", "frame_seq", "timestamp", "complete"])
+
+
+def _buffer_size(capacity):
+    return HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize
+
+
+def encode_records(workpieces, timestamp, frame_seq):
+    """[(编号, 形状, x_mm, y_mm, angle)] → RECORD_DTYPE 数组"""
+    records = np.zeros(len(workpieces), dtype=RECORD_DTYPE)
+    for record, (slot, shape, x_mm, y_mm, angle) in zip(records, workpieces):
+        record["shape_id"] = SHAPE_IDS.get(shape, 0)
+        record["slot"] = slot
+        record["x"], record["y"], record["angle"] = x_mm, y_mm, angle
+    records["timestamp"] = timestamp
+    records["frame_seq"] = -1 if frame_seq is None else frame_seq
+    return records
+
+
+class _SharedResultBuffer:
+    def __init__(self, shm):
+        self.shm = shm
+        self.header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)
+        capacity = int(self.header["capacity"][0])
+        self.records = np.ndarray((capacity,), dtype=RECORD_DTYPE, buffer=shm.buf, offset=HEADER_DTYPE.itemsize)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def capacity(self):
+        return len(self.records)
+
+    def close(self):
+        # 先释放对共享内存的引用，否则 close() 会因为仍有导出的缓冲区而失败
+        self.header = self.records = None
+        self.shm.close()
+
+
+class SharedResultWriter(_SharedResultBuffer):
+    """
+    写端（只能有一个）：创建共享内存并发布识别结果
+    同名共享内存已存在（如上次异常退出没有清理）且容量足够时直接复用
+    """
+
+    def __init__(self, name=DEFAULT_SHM_NAME, capacity=256, log_callback=print):
+        self.log_callback = log_callback
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=_buffer_size(capacity))
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(name=name, create=False)
+            if shm.size < _buffer_size(capacity):
+                shm.close()
+                raise ValueError(f"Shared memory {name} exists but is too small for {capacity} records")
+            log_callback(f"[共享内存] 复用已存在的 {name}")
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header[0] = (0, LAYOUT_VERSION, capacity, 0, 1, -1, 0.0)
+        del header
+        super().__init__(shm)
+        self._version = 0
+        self._warned_overflow = False
+
+    def publish(self, workpieces, frame_seq=None, timestamp=None, complete=True):
+        """
+        写入一次识别结果，workpieces 为 [(编号, 形状, x_mm, y_mm, angle)]，
+        返回发布次数（读端看到的 version）
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        records = encode_records(workpieces, timestamp, frame_seq)
+        if len(records) > self.capacity:
+            if not self._warned_overflow:
+                self.log_callback(f"[共享内存] 工件数 {len(records)} 超过容量 {self.capacity}，超出部分不写入")
+                self._warned_overflow = True
+            records = records[:self.capacity]
+
+        header = self.header
+        self._version += 1
+        header["version"] = 2 * self._version - 1  # 奇数：正在写
+        self.records[:len(records)] = records
+        header["count"] = len(records)
+        header["complete"] = int(complete)
+        header["frame_seq"] = -1 if frame_seq is None else frame_seq
+        header["timestamp"] = timestamp
+        header["version"] = 2 * self._version      # 偶数：写入完成
+        return self._version
+
+    def publish_snapshot(self, snapshot):
+        """
+        发布 ResultChannel 的快照，世界坐标取自快照中的工件记录；
+        发布方只提供了工件信息字符串时按字符串解析，坐标为取整后的毫米
+        """
+        workpieces = snapshot.workpieces
+        if workpieces is None:
+            workpieces = [(w["slot"], w["shape"], w["x"], w["y"], w["angle"])
+                          for w in map(parse_workpiece_info, snapshot.workpiece_info_list)]
+        return self.publish(workpieces, snapshot.frame_seq, snapshot.timestamp, snapshot.complete)
+
+    def unlink(self):
+        """关闭并删除共享内存（写端退出时调用）"""
+        self.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedResultReader(_SharedResultBuffer):
+    """
+    读端（可以有多个进程）
+    read() 返回一致的拷贝；需要零拷贝时用 read_begin() / read_retry() 包住对 records 视图的访问：
+
+        while True:
+            version = reader.read_begin()
+            xs = reader.records["x"][:reader.count].sum()
+            if not reader.read_retry(version):
+                break
+    """
+
+    def __init__(self, name=DEFAULT_SHM_NAME):
+        shm = attach_shared_memory(name)
+        if int(np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)["layout"][0]) != LAYOUT_VERSION:
+            shm.close()
+            raise ValueError(f"Unsupported shared result layout in {name}")
+        super().__init__(shm)
+
+    @property
+    def version(self):
+        """发布次数，轮询它即可知道是否有新结果（写入中返回上一次的值）"""
+        return int(self.header["version"][0]) // 2
+
+    @property
+    def count(self):
+        return int(self.header["count"][0])
+
+    def read_begin(self):
+        """等待写入完成并返回当前的 seqlock 计数"""
+        while True:
+            seq = int(self.header["version"][0])
+            if not seq & 1:
+                return seq
+            time.sleep(0)
+
+    def read_retry(self, seq):
+        """读取期间有新的写入时返回 True，需要重读"""
+        return int(self.header["version"][0]) != seq
+
+    def read(self, out=None):
+        """
+        返回一致的 SharedSnapshot；out 为预先分配的 RECORD_DTYPE 数组时写入其中，不分配新内存
+        """
+        while True:
+            seq = self.read_begin()
+            header = self.header[0].copy()
+            count = min(int(header["count"]), self.capacity)
+            if out is None:
+                records = self.records[:count].copy()
+            else:
+                records = out[:count]
+                records[...] = self.records[:count]
+            if not self.read_retry(seq):
+                return SharedSnapshot(seq // 2, records, int(header["frame_seq"]), float(header["timestamp"]),
+                                      bool(header["complete"]))
+
+    def wait(self, after_version, timeout=None, poll_interval=0.001):
+        """轮询等待 version 大于 after_version 的结果，超时返回 None"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.version <= after_version:
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+        return self.read()
+
+
+class SharedResultBridge:
+    """
+    把 ResultChannel 中的每次发布同步写入共享内存（不依赖 Qt）
+    run() 为阻塞循环，由后台线程驱动
+    """
+
+    def __init__(self, result_channel, name=DEFAULT_SHM_NAME, capacity=256, log_callback=print):
+        self.result_channel = result_channel
+        self.writer = SharedResultWriter(name, capacity, log_callback)
+        self.log_callback = log_callback
+        self.running = True
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        self.log_callback(f"[系统] 识别结果共享内存 {self.writer.name}")
+        return self
+
+    def run(self):
+        version = 0
+        while self.running:
+            snapshot = self.result_channel.wait(version, timeout=0.5)
+            if snapshot is None:
+                continue
+            version = snapshot.version
+            try:
+                self.writer.publish_snapshot(snapshot)
+            except Exception as e:
+                self.log_callback(f"[共享内存错误] {e}")
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+        self.writer.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="读取共享内存中的最新识别结果")
+    parser.add_argument("--name", default=DEFAULT_SHM_NAME, help="共享内存名称")
+    args = parser.parse_args()
+
+    reader = SharedResultReader(args.name)
+    version = 0
+    try:
+        while True:
+            snapshot = reader.wait(version, timeout=1.0)
+            if snapshot is None:
+                continue
+            version = snapshot.version
+            print(f"version={snapshot.version} frame_seq={snapshot.frame_seq} 工件 {len(snapshot.records)} 个")
+            for record in snapshot.records:
+                print(f"  {record['slot']:>4} {SHAPE_NAMES.get(int(record['shape_id']), '?'):<10}"
+                      f" x={record['x']:.2f} y={record['y']:.2f} r={record['angle']:.2f}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
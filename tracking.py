@@ -0,0 +1,317 @@
+"""
+多帧跟踪模式（传送带场景）：在视频流上连续运行
+上一帧找到的工件按质心与形状跟踪到下一帧，只在各工件预测位置附近的小 ROI 内重新分割；
+只有出现新工件的入口区域、跟丢工件时或定期校验时才做大范围分割，
+每帧开销与变化量成正比而不是与图像尺寸成正比
+角度与世界坐标在多帧间平滑，PLC 无需重新拍照即可得到稳定坐标；
+工件确认后分配的编号在跟踪期间保持不变
+"""
+import time
+
+import cv2
+import numpy as np
+
+from detect import (ANGLE_PERIODS, COLOR_SHAPE_MAP, DEDUP_RADIUS, MORPH_KERNEL_SIZE, classify_contour,
+                    color_classifier, polygon_centroid, segment_contours, select_reference_angle,
+                    slotted_workpiece_info)
+from utils.pixel2world import get_world_lut
+from utils.slot_layout import get_slot_layout
+from utils.spatial_index import GridIndex
+
+
+def wrap_angle(shape, angle):
+    """把角度规范到 select_reference_angle 对应形状的取值范围"""
+    period = ANGLE_PERIODS.get(shape, 360)
+    if shape == "Rhombus":
+        return -((-angle) % period)  # 菱形角度取值范围为 (-180, 0]
+    return angle % period
+
+
+def blend_angle(shape, previous, measured, alpha):
+    """按形状的角度周期做指数平滑，跨越周期边界时取最短方向"""
+    period = ANGLE_PERIODS.get(shape, 360)
+    diff = (measured - previous + period / 2) % period - period / 2
+    return wrap_angle(shape, previous + alpha * diff)
+
+
+def clip_region(region, img_w, img_h):
+    """把区域裁剪到图像范围内，返回整数 (x0, y0, x1, y1)"""
+    x0, y0, x1, y1 = region if region is not None else (0, 0, img_w, img_h)
+    return max(int(x0), 0), max(int(y0), 0), min(int(x1), img_w), min(int(y1), img_h)
+
+
+def detect_polygons(image, region=None, colors=None, expand=True):
+    """
+    在 region=(x0, y0, x1, y1) 内分割并拟合工件多边形，返回 [(颜色, 形状, 原图坐标角点, (cx, cy), 角度)]
+    碰到图像边界的轮廓说明工件还没有完全进入画面，不产出；
+    碰到区域边界的轮廓说明工件只有一部分在区域内，expand 为 True 时在其周围扩大区域重新分割一次
+    """
+    img_h, img_w = image.shape[:2]
+    x0, y0, x1, y1 = clip_region(region, img_w, img_h)
+    if x1 - x0 <= MORPH_KERNEL_SIZE or y1 - y0 <= MORPH_KERNEL_SIZE:
+        return []
+
+    hsv = cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2HSV)
+    label_map = color_classifier.classify(hsv)
+    found = []
+    retry = []
+    for color_name in colors or color_classifier.color_names:
+        expected_shape = COLOR_SHAPE_MAP[color_name]
+        for contour in segment_contours(hsv, color_name, label_map=label_map):
+            bx, by, bw, bh = cv2.boundingRect(contour)
+            left, top, right, bottom = bx == 0, by == 0, bx + bw == x1 - x0, by + bh == y1 - y0
+            if (left and x0 == 0) or (top and y0 == 0) or (right and x1 == img_w) or (bottom and y1 == img_h):
+                continue
+            if left or top or right or bottom:
+                if expand:
+                    pad = max(bw, bh)
+                    retry.append((color_name, (x0 + bx - pad, y0 + by - pad, x0 + bx + bw + pad, y0 + by + bh + pad)))
+                continue
+            shape, approx_corners = classify_contour(contour)
+            if shape != expected_shape:
+                continue
+            corners = approx_corners + np.array([x0, y0], dtype=approx_corners.dtype)
+            center = polygon_centroid(corners)
+            if center is None:
+                continue
+            angle, _ = select_reference_angle(shape, corners.reshape(-1, 2))
+            if angle is None:
+                continue
+            found.append((color_name, shape, corners, center, angle))
+
+    for color_name, sub_region in retry:
+        found.extend(detect_polygons(image, sub_region, [color_name], expand=False))
+    return found
+
+
+class Track:
+    """一个被跟踪的工件，位置与角度为平滑后的值；slot 为确认后分配的编号（从 1 开始），跟踪期间不变"""
+
+    def __init__(self, track_id, color_name, shape, corners, center, angle):
+        self.track_id = track_id
+        self.color_name = color_name
+        self.shape = shape
+        self.corners = corners
+        self.cx, self.cy = center
+        self.angle = angle
+        self.velocity = (0.0, 0.0)  # 每帧位移（像素）
+        self.hits = 1
+        self.misses = 0
+        self.slot = None
+
+    def predicted_region(self, margin):
+        """按速度外推后的搜索区域"""
+        x, y, w, h = cv2.boundingRect(self.corners)
+        dx, dy = self.velocity
+        return (x + dx - margin, y + dy - margin, x + w + dx + margin, y + h + dy + margin)
+
+    def distance_to(self, center):
+        return np.hypot(center[0] - (self.cx + self.velocity[0]), center[1] - (self.cy + self.velocity[1]))
+
+    def update(self, corners, center, angle, alpha):
+        # alpha-beta 滤波：先按速度预测，再用测量残差修正位置与速度，匀速运动时没有滞后
+        beta = alpha ** 2 / (2 - alpha)
+        px, py = self.cx + self.velocity[0], self.cy + self.velocity[1]
+        rx, ry = center[0] - px, center[1] - py
+        self.cx, self.cy = px + alpha * rx, py + alpha * ry
+        self.velocity = (self.velocity[0] + beta * rx, self.velocity[1] + beta * ry)
+        self.angle = blend_angle(self.shape, self.angle, angle, alpha)
+        self.corners = corners
+        self.hits += 1
+        self.misses = 0
+
+    def coast(self):
+        """本帧没有找到，按速度外推"""
+        self.cx += self.velocity[0]
+        self.cy += self.velocity[1]
+        self.corners = self.corners + np.round(self.velocity).astype(self.corners.dtype)
+        self.misses += 1
+
+
+class WorkpieceTracker:
+    """
+    逐帧更新工件跟踪
+    entry_region=(x0, y0, x1, y1) 为新工件进入画面的区域（如传送带上游一侧），每帧都在该区域内找新工件；
+    有工件跟丢或每隔 full_interval 帧做一次全图分割，兜底发现遗漏的工件
+    slot_layout 为编号布局（默认读取配置文件），工件确认时取所属形状区间内空闲的最小编号，
+    之后在跟踪期间（包括短暂跟丢、按速度外推的帧）保持不变，工件删除后编号才释放；布局的抓取路径排序不适用于跟踪模式
+    """
+
+    def __init__(self, calibration=None, entry_region=None, full_interval=30, search_margin=40,
+                 match_radius=40.0, alpha=0.4, min_hits=3, max_misses=3, slot_layout=None):
+        self.calibration = calibration
+        self.slot_layout = slot_layout
+        self.entry_region = entry_region
+        self.full_interval = full_interval
+        self.search_margin = search_margin
+        self.match_radius = match_radius
+        self.alpha = alpha            # 平滑系数，越小越平稳、响应越慢
+        self.min_hits = min_hits      # 连续命中次数达到后才输出
+        self.max_misses = max_misses  # 连续丢失超过该次数后删除
+        self.tracks = []
+        self.frame_index = 0
+        self.last_stats = {}
+        self._next_track_id = 0
+        self._last_full = None
+        self._need_full = True
+
+    def update(self, frame):
+        """处理一帧，返回当前已确认的工件列表（见 workpieces()）"""
+        self.frame_index += 1
+        img_h, img_w = frame.shape[:2]
+        if self.calibration is None:
+            self.calibration = get_world_lut(img_w, img_h)
+        processed = 0
+        updated = set()
+        claimed = GridIndex(DEDUP_RADIUS)  # 本帧已归属某个工件的检测（相邻工件的 ROI 重叠时会找到同一检测）
+
+        # 1. 已有工件只在预测位置附近的 ROI 内重新分割，候选按距离从近到远统一分配，每个检测只归一个工件
+        proposals = []
+        for track in self.tracks:
+            region = track.predicted_region(self.search_margin)
+            processed += self.region_area(region, img_w, img_h)
+            gate = self.match_radius + np.hypot(*track.velocity)
+            for detection in detect_polygons(frame, region, [track.color_name]):
+                distance = track.distance_to(detection[3])
+                if distance <= gate:
+                    proposals.append((distance, track.track_id, track, detection))
+        for _, _, track, (_, _, corners, center, angle) in sorted(proposals, key=lambda p: p[:2]):
+            if track.track_id in updated or claimed.contains_near(*center):
+                continue
+            claimed.add(*center)
+            track.update(corners, center, angle, self.alpha)
+            updated.add(track.track_id)
+        for track in self.tracks:
+            if track.track_id not in updated:
+                track.coast()
+                self._need_full = True
+
+        # 2. 新工件：入口区域每帧检查，跟丢或到期时全图分割
+        full = (self._need_full or self._last_full is None
+                or self.frame_index - self._last_full >= self.full_interval)
+        if full:
+            regions = [None]
+            self._last_full = self.frame_index
+            self._need_full = False
+        else:
+            regions = [self.entry_region] if self.entry_region is not None else []
+        for region in regions:
+            processed += self.region_area(region, img_w, img_h)
+            for color_name, shape, corners, center, angle in detect_polygons(frame, region):
+                self.associate(color_name, shape, corners, center, angle, updated, claimed)
+
+        # 3. 删除长期丢失或离开画面的工件
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses
+                       and -self.search_margin <= t.cx < img_w + self.search_margin
+                       and -self.search_margin <= t.cy < img_h + self.search_margin]
+        self.assign_slots()
+        self.last_stats = {"full": full, "tracks": len(self.tracks),
+                           "processed_ratio": min(1.0, processed / float(img_w * img_h))}
+        return self.workpieces()
+
+    @staticmethod
+    def region_area(region, img_w, img_h):
+        x0, y0, x1, y1 = clip_region(region, img_w, img_h)
+        return max(0, x1 - x0) * max(0, y1 - y0)
+
+    def associate(self, color_name, shape, corners, center, angle, updated, claimed):
+        """大范围分割得到的检测与本帧尚未更新的工件匹配，匹配不上的作为新工件；已归属某个工件的检测跳过"""
+        if claimed.contains_near(*center):
+            return
+        claimed.add(*center)
+        nearest = None
+        for track in self.tracks:
+            if track.shape != shape or track.track_id in updated:
+                continue
+            distance = track.distance_to(center)
+            if distance <= self.match_radius and (nearest is None or distance < nearest[0]):
+                nearest = (distance, track)
+        if nearest is None:
+            self._next_track_id += 1
+            self.tracks.append(Track(self._next_track_id, color_name, shape, corners, center, angle))
+            updated.add(self._next_track_id)
+        else:
+            # ROI 内跟丢但大范围分割找回
+            nearest[1].update(corners, center, angle, self.alpha)
+            updated.add(nearest[1].track_id)
+
+    def assign_slots(self):
+        """为新确认的工件按出现先后分配所属形状区间内空闲的最小编号；布局修改后不在区间内的编号重新分配"""
+        slot_layout = self.slot_layout if self.slot_layout is not None else get_slot_layout()
+        for track in self.tracks:
+            if track.slot is not None:
+                start_idx, end_idx = slot_layout.slots.get(track.shape, (0, 0))
+                if not start_idx < track.slot <= end_idx:
+                    track.slot = None
+        used = {track.slot for track in self.tracks if track.slot is not None}
+        for track in self.tracks:
+            if track.slot is not None or track.hits < self.min_hits or track.shape not in slot_layout.slots:
+                continue
+            start_idx, end_idx = slot_layout.slots[track.shape]
+            track.slot = next((slot for slot in range(start_idx + 1, end_idx + 1) if slot not in used), None)
+            used.add(track.slot)
+
+    def workpieces(self):
+        """
+        已确认且本帧找到的工件（按出现先后排序），坐标为平滑后的机械臂坐标（毫米），
+        slot 为跟踪期间不变的编号，该形状编号已用完时为 None
+        """
+        confirmed = [t for t in self.tracks if t.hits >= self.min_hits and t.misses == 0]
+        centers = np.array([(t.cx, t.cy) for t in confirmed], dtype=np.float32).reshape(-1, 2)
+        world = np.round(self.calibration.to_world(centers), 2) if len(confirmed) else centers
+        return [{"track_id": t.track_id, "shape": t.shape, "x": float(x_mm), "y": float(y_mm), "angle": t.angle,
+                 "slot": t.slot} for t, (x_mm, y_mm) in zip(confirmed, world)]
+
+    def slotted_workpieces(self):
+        """有编号的工件 [(编号, 形状, x_mm, y_mm, angle)]（按编号排序），没有编号的工件不发送"""
+        workpieces = sorted((w for w in self.workpieces() if w["slot"] is not None), key=lambda w: w["slot"])
+        return [(w["slot"], w["shape"], w["x"], w["y"], w["angle"]) for w in workpieces]
+
+    def workpiece_info_list(self):
+        """发给 PLC 的信息列表（按编号排序），没有编号的工件不发送"""
+        return slotted_workpiece_info(self.slotted_workpieces())
+
+
+class TrackingLoop:
+    """
+    连续跟踪循环（不依赖 Qt）：等待环形缓冲区中的新帧，更新跟踪结果并发布到 result_channel
+    run() 为阻塞循环，由后台线程驱动
+    """
+
+    def __init__(self, frame_buffer, result_channel=None, tracker=None, on_update=None, log_callback=print):
+        self.frame_buffer = frame_buffer
+        self.result_channel = result_channel
+        self.tracker = tracker if tracker is not None else WorkpieceTracker()
+        self.on_update = on_update
+        self.log_callback = log_callback
+        self.running = True
+
+    def run(self):
+        seq = 0
+        last_count = None
+        while self.running:
+            frame_ref = self.frame_buffer.wait_latest(seq, timeout=0.5)
+            if frame_ref is None:
+                continue
+            with frame_ref:
+                seq = frame_ref.seq
+                started_at = time.perf_counter()
+                try:
+                    self.tracker.update(frame_ref.frame)
+                except Exception as e:
+                    self.log_callback(f"[跟踪错误] {e}")
+                    continue
+            slotted = self.tracker.slotted_workpieces()
+            workpiece_info_list = slotted_workpiece_info(slotted)
+            if self.result_channel is not None:
+                self.result_channel.publish(workpiece_info_list, frame_seq=seq, workpieces=slotted)
+            if len(workpiece_info_list) != last_count:
+                last_count = len(workpiece_info_list)
+                self.log_callback(f"[跟踪] 当前工件 {last_count} 个")
+            if self.on_update is not None:
+                self.on_update(dict(self.tracker.last_stats, seq=seq, workpiece_info_list=workpiece_info_list,
+                                    elapsed=time.perf_counter() - started_at))
+
+    def stop(self):
+        self.running = False
+
@@ -0,0 +1,315 @@
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils.shm import attach_shared_memory
+
+
+class StaleFrameError(RuntimeError):
+    """槽位引用已失效：槽位没有被持有，或者在交给其他进程期间已被覆盖"""
+
+
+class FrameRef:
+    """
+    环形缓冲区中某一帧的只读引用，持有期间该槽位不会被采集线程覆盖
+    用完后调用 release()，或者用 with 语句自动释放
+    """
+
+    def __init__(self, buffer, index, seq):
+        self._buffer = buffer
+        self.index = index
+        self.seq = seq
+        self.frame = buffer.frame_view(index)
+        self._released = False
+
+    def retain(self):
+        """为同一槽位再取一个引用，交给其他消费者独立释放"""
+        return self._buffer.retain(self.index, self.seq)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._buffer.release(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def __del__(self):
+        self.release()
+
+
+class FrameRingBuffer:
+    """
+    预分配的帧环形缓冲区
+    采集线程直接读入空闲槽位(cap.read(image=slot))，读者通过引用计数持有视图而不是拷贝
+    """
+
+    def __init__(self, num_slots=4):
+        assert num_slots >= 2, "Ring buffer needs at least 2 slots"
+        self.slots = [None] * num_slots
+        self._refcounts = [0] * num_slots
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._latest = -1       # 最新一帧所在槽位
+        self._last_write = -1   # 上一次写入的槽位
+        self.seq = 0            # 已发布的帧序号
+
+    def allocate(self, shape, dtype=np.uint8):
+        """按帧尺寸预分配所有槽位"""
+        with self._lock:
+            for i in range(len(self.slots)):
+                if self._refcounts[i] == 0:
+                    self.slots[i] = np.empty(shape, dtype=dtype)
+
+    def frame_view(self, index):
+        """槽位中已发布帧的只读视图"""
+        view = self.slots[index].view()
+        view.setflags(write=False)
+        return view
+
+    def acquire_write_slot(self):
+        """取一个既不是最新帧、也没有读者持有的槽位用于写入，全部被占用时返回 None"""
+        with self._lock:
+            n = len(self.slots)
+            for offset in range(1, n + 1):
+                index = (self._last_write + offset) % n
+                if self._refcounts[index] == 0 and index != self._latest:
+                    self._last_write = index
+                    return index
+        return None
+
+    def publish(self, index, frame=None):
+        """写入完成后发布为最新帧；frame 不是原槽位数组时（尺寸变化被重新分配）替换该槽位"""
+        with self._lock:
+            if frame is not None and frame is not self.slots[index]:
+                self.slots[index] = frame
+            self._latest = index
+            self.seq += 1
+            self._new_frame.notify_all()
+
+    def acquire_latest(self):
+        """获取最新帧的引用（引用计数 +1），尚无帧时返回 None"""
+        with self._lock:
+            if self._latest < 0:
+                return None
+            self._refcounts[self._latest] += 1
+            return FrameRef(self, self._latest, self.seq)
+
+    def wait_latest(self, after_seq, timeout=None):
+        """等待序号大于 after_seq 的新帧并返回其引用，超时返回 None"""
+        with self._new_frame:
+            if not self._new_frame.wait_for(lambda: self.seq > after_seq and self._latest >= 0, timeout):
+                return None
+            self._refcounts[self._latest] += 1
+            return FrameRef(self, self._latest, self.seq)
+
+    def retain(self, index, seq):
+        """对已被持有的槽位再增加一个引用"""
+        with self._lock:
+            if self._refcounts[index] <= 0:
+                raise StaleFrameError("Can only retain a slot that is already held")
+            self._refcounts[index] += 1
+            return FrameRef(self, index, seq)
+
+    def release(self, index):
+        with self._lock:
+            self._refcounts[index] -= 1
+
+
+class SharedFrameRingBuffer:
+    """
+    共享内存中的帧环形缓冲区，接口与 FrameRingBuffer 相同，作为参数传给 spawn 子进程后各进程看到同一组槽位
+    槽位按 max_shape 预分配，引用计数、最新槽位与各槽位的帧序号、帧尺寸都放在共享内存头部，由跨进程锁保护；
+    帧尺寸随帧数据一起按槽位记录，帧源中途改变尺寸时，读者持有的旧帧仍按各自的尺寸读取；
+    进程之间只需传递 (槽位索引, 帧序号)，帧数据不经过 pickle
+    只支持 uint8 帧；创建者在各进程都已映射后即可 unlink()
+    """
+    # 头部字段（int64）：已发布的帧序号、最新帧所在槽位、采集端写入用的帧尺寸（高、宽、通道，通道为 0 表示单通道）、
+    # 采集端丢帧数，之后依次是各槽位的引用计数、帧序号与已发布帧的尺寸（高、宽、通道）
+    _SEQ, _LATEST, _HEIGHT, _WIDTH, _CHANNELS, _DROPPED = range(6)
+    _FIELDS = 6
+    _PER_SLOT = 5
+
+    def __init__(self, num_slots=4, max_shape=(1944, 2592, 3), name=None, context=None):
+        assert num_slots >= 2, "Ring buffer needs at least 2 slots"
+        context = context or multiprocessing.get_context("spawn")
+        self.num_slots = num_slots
+        self.slot_bytes = int(np.prod(max_shape))
+        self._lock = context.Lock()
+        self._shm = shared_memory.SharedMemory(name=name, create=True,
+                                               size=self._header_bytes() + num_slots * self.slot_bytes)
+        self._owner = True
+        self._map()
+        self._header[:] = 0
+        self._header[self._LATEST] = -1
+
+    def _header_bytes(self):
+        # 按 64 字节对齐，槽位数据从缓存行边界开始
+        return -(-8 * (self._FIELDS + self._PER_SLOT * self.num_slots) // 64) * 64
+
+    def _map(self):
+        n = self.num_slots
+        self._header = np.ndarray((self._FIELDS + self._PER_SLOT * n,), dtype=np.int64, buffer=self._shm.buf)
+        self._refcounts = self._header[self._FIELDS:self._FIELDS + n]
+        self._slot_seqs = self._header[self._FIELDS + n:self._FIELDS + 2 * n]
+        self._slot_shapes = self._header[self._FIELDS + 2 * n:].reshape(n, 3)
+        self._data = np.ndarray((n, self.slot_bytes), dtype=np.uint8, buffer=self._shm.buf,
+                                offset=self._header_bytes())
+        self._views = [None] * n
+        self._view_shape = None
+        self._last_write = -1  # 只有采集端使用
+
+    def __getstate__(self):
+        return {"name": self._shm.name, "num_slots": self.num_slots, "slot_bytes": self.slot_bytes,
+                "lock": self._lock}
+
+    def __setstate__(self, state):
+        self.num_slots = state["num_slots"]
+        self.slot_bytes = state["slot_bytes"]
+        self._lock = state["lock"]
+        self._shm = attach_shared_memory(state["name"])
+        self._owner = False
+        self._map()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def seq(self):
+        """已发布的帧序号"""
+        return int(self._header[self._SEQ])
+
+    @property
+    def dropped_frames(self):
+        """采集端累计丢帧数"""
+        return int(self._header[self._DROPPED])
+
+    @dropped_frames.setter
+    def dropped_frames(self, value):
+        self._header[self._DROPPED] = value
+
+    @staticmethod
+    def _shape(height, width, channels):
+        return (int(height), int(width), int(channels)) if channels else (int(height), int(width))
+
+    def _slot_array(self, index, shape):
+        return self._data[index, :int(np.prod(shape))].reshape(shape)
+
+    @property
+    def slots(self):
+        """采集端写入用的各槽位数组，按 allocate() 设置的帧尺寸映射（读者通过 frame_view() 按槽位自己的尺寸读取）"""
+        shape = self._shape(*self._header[self._HEIGHT:self._CHANNELS + 1])
+        if shape != self._view_shape:
+            size = int(np.prod(shape))
+            self._views = [self._slot_array(i, shape) if size else None for i in range(self.num_slots)]
+            self._view_shape = shape
+        return self._views
+
+    def frame_view(self, index):
+        """槽位中已发布帧的只读视图，尺寸为该帧发布时记录的尺寸（调用方须持有该槽位的引用）"""
+        view = self._slot_array(index, self._shape(*self._slot_shapes[index]))
+        view.setflags(write=False)
+        return view
+
+    def allocate(self, shape, dtype=np.uint8):
+        """设置采集端写入用的帧尺寸（不能超过创建时的 max_shape），不影响已发布的帧"""
+        if np.dtype(dtype) != np.uint8:
+            raise ValueError("Shared frame buffer only holds uint8 frames")
+        if int(np.prod(shape)) > self.slot_bytes:
+            raise ValueError(f"Frame shape {tuple(shape)} does not fit into {self.slot_bytes}-byte shared slots")
+        with self._lock:
+            self._header[self._HEIGHT], self._header[self._WIDTH] = shape[0], shape[1]
+            self._header[self._CHANNELS] = shape[2] if len(shape) > 2 else 0
+
+    def acquire_write_slot(self):
+        """取一个既不是最新帧、也没有读者（任何进程）持有的槽位用于写入，全部被占用时返回 None"""
+        with self._lock:
+            latest = int(self._header[self._LATEST])
+            for offset in range(1, self.num_slots + 1):
+                index = (self._last_write + offset) % self.num_slots
+                if self._refcounts[index] == 0 and index != latest:
+                    self._last_write = index
+                    return index
+        return None
+
+    def publish(self, index, frame=None):
+        """
+        写入完成后发布为最新帧，该槽位的帧尺寸与帧序号随之写入头部；
+        frame 不是槽位数组本身时（尺寸变化被重新分配）先拷贝进槽位，并把写入尺寸改为新尺寸
+        """
+        slot = self.slots[index]
+        if frame is not None and not (frame.shape == slot.shape and np.shares_memory(frame, slot)):
+            if frame.shape != slot.shape:
+                self.allocate(frame.shape, frame.dtype)
+            self.slots[index][...] = frame
+        shape = self.slots[index].shape
+        with self._lock:
+            self._slot_shapes[index] = (shape[0], shape[1], shape[2] if len(shape) > 2 else 0)
+            self._slot_seqs[index] = self._header[self._SEQ] + 1
+            self._header[self._LATEST] = index
+            self._header[self._SEQ] += 1
+
+    def acquire_latest(self):
+        """获取最新帧的引用（引用计数 +1），尚无帧时返回 None"""
+        with self._lock:
+            index = int(self._header[self._LATEST])
+            if index < 0:
+                return None
+            self._refcounts[index] += 1
+            return FrameRef(self, index, int(self._slot_seqs[index]))
+
+    def wait_latest(self, after_seq, timeout=None, poll_interval=0.002):
+        """
+        轮询等待序号大于 after_seq 的新帧并返回其引用，超时返回 None
+        不用跨进程条件变量：它的 notify 要等所有等待者确认，等待方进程退出后写入端会被卡住
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._header[self._SEQ] <= after_seq:
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+        return self.acquire_latest()
+
+    def retain(self, index, seq):
+        """对已被持有的槽位再增加一个引用"""
+        with self._lock:
+            if self._refcounts[index] <= 0:
+                raise StaleFrameError("Can only retain a slot that is already held")
+            self._refcounts[index] += 1
+            return FrameRef(self, index, seq)
+
+    def release(self, index):
+        with self._lock:
+            self._refcounts[index] -= 1
+
+    def hand_off(self, frame_ref):
+        """
+        为另一个进程增加一个引用，返回可放入队列的 (槽位索引, 帧序号)；
+        接收方用 adopt() 取得该引用，并负责释放
+        """
+        with self._lock:
+            if self._refcounts[frame_ref.index] <= 0:
+                raise StaleFrameError("Can only hand off a slot that is already held")
+            self._refcounts[frame_ref.index] += 1
+        return frame_ref.index, frame_ref.seq
+
+    def adopt(self, index, seq):
+        """接收 hand_off() 交来的引用（不再增加引用计数）"""
+        if int(self._slot_seqs[index]) != seq:
+            raise StaleFrameError("Slot was overwritten while handed off")
+        return FrameRef(self, index, seq)
+
+    def unlink(self):
+        """删除共享内存的名称（创建者调用）；已映射的进程不受影响，映射在各进程退出时回收"""
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,413 @@
+"""
+批量多边形几何：一帧内所有近似多边形补齐为 (N, K, 2) 数组后一次性计算
+边长、平行判断、质心、形状分类与参考角，结果与本模块中逐个多边形的函数（analyze_quadrilateral、
+select_reference_angle 等）完全一致
+（保持相同的数据类型与运算顺序，质心与 cv2.moments 的轮廓矩公式相同）
+"""
+import cv2
+import numpy as np
+
+# analyze_quadrilateral / are_parallel 中的容差
+LENGTH_TOLERANCE_RATIO = 0.15
+PARALLEL_SIN_TOLERANCE = np.sin(np.deg2rad(3.0))
+FLT_EPSILON = np.finfo(np.float32).eps
+# 多边形少于该数量时逐个计算更快：NumPy 批量运算每次调用的固定开销超过逐个计算的耗时
+BATCH_MIN_POLYGONS = 16
+
+
+def pad_polygons(polygons, dtype=None):
+    """
+    多边形列表（每个为 (k, 1, 2) 或 (k, 2) 数组）→ (角点 (N, K, 2), 角点数 (N,))
+    补齐部分填 0，不参与计算
+    """
+    polygons = [np.asarray(p).reshape(-1, 2) for p in polygons]
+    if dtype is None:
+        dtype = np.result_type(*polygons) if polygons else np.int32
+    counts = np.array([len(p) for p in polygons], dtype=np.intp)
+    max_count = int(counts.max()) if len(polygons) else 0
+    corners = np.zeros((len(polygons), max_count, 2), dtype=dtype)
+    for i, p in enumerate(polygons):
+        corners[i, :len(p)] = p
+    return corners, counts
+
+
+# 逐个多边形的版本，批量版本对有重复顶点等特殊情况回退到这里
+def calculate_distance(p1, p2):
+    return np.sqrt(((p1[0] - p2[0]) ** 2) + ((p1[1] - p2[1]) ** 2))
+
+
+def calculate_angle(pt1, pt2):
+    # 确保 pt1 在左，pt2 在右
+    if pt1[0] > pt2[0]:  # 强制从左向右
+        pt1, pt2 = pt2, pt1
+    
+    dx = pt2[0] - pt1[0]
+    dy = pt2[1] - pt1[1]
+    
+    angle = np.degrees(np.arctan2(dy, dx)) % 360
+    return angle
+
+
+def are_parallel(p1, p2, p3, p4):
+    v1 = np.array([p2[0] - p1[0], p2[1] - p1[1]], dtype=np.float64)
+    v2 = np.array([p4[0] - p3[0], p4[1] - p3[1]], dtype=np.float64)
+    norm_v1 = np.linalg.norm(v1)
+    norm_v2 = np.linalg.norm(v2)
+    if norm_v1 < 1e-6 or norm_v2 < 1e-6:
+        return False
+    cross_product = v1[0] * v2[1] - v1[1] * v2[0]
+    sin_theta = cross_product / (norm_v1 * norm_v2)
+    return abs(sin_theta) < PARALLEL_SIN_TOLERANCE
+
+
+def analyze_quadrilateral(corners):
+    side_lengths = [calculate_distance(corners[i], corners[(i+1)%4]) for i in range(4)]
+    avg_length = sum(side_lengths) / 4
+    if all(abs(length - avg_length) < avg_length * LENGTH_TOLERANCE_RATIO for length in side_lengths):
+        return "Rhombus"
+    is_parallel_1 = are_parallel(corners[0], corners[1], corners[2], corners[3])
+    is_parallel_2 = are_parallel(corners[1], corners[2], corners[3], corners[0])
+    if is_parallel_1 or is_parallel_2:
+        return "Trapezoid"
+    return "Irregular Quadrilateral"
+
+
+def select_reference_angle(shape, corners):
+    """
+    计算旋转角度
+    """
+    def sort_by_y(c):
+        return sorted(c, key=lambda p: (p[1], p[0]))
+    
+    # 三角形
+    if shape == "Triangle":
+        # 1. 找到最上面的顶点 (y坐标最小)
+        pts = sort_by_y(corners)
+        top_vertex = pts[0]
+
+        # 2. 获取另外两个顶点，形成与顶点的两条边
+        other_vertices = [p for p in pts if not np.array_equal(p, top_vertex)]
+
+        # 3. 计算每个边在x方向上的绝对变化量
+        x_deltas = [abs(p[0] - top_vertex[0]) for p in other_vertices]
+        
+        # 4. 选择x方向变化量更大的那条边作为参考边
+        #    np.argmax会找到最大值对应的索引
+        reference_vertex_index = np.argmax(x_deltas)
+        reference_vertex = other_vertices[reference_vertex_index]
+        
+        # 5. 计算参考边的角度
+        ref_angle = calculate_angle(top_vertex, reference_vertex)
+        base_line = [tuple(top_vertex), tuple(reference_vertex)]
+        angle = (ref_angle - 60) % 120 
+        return angle, base_line
+
+    # 六边形
+    elif shape == "Hexagon":
+        # 1. 找到最上方的顶点（y 最小）
+        pts = sort_by_y(corners)
+        top = pts[0]
+        # 2. 找到 top 顶点在 corners 中的索引
+        top_idx = None
+        for i, pt in enumerate(corners):
+            if np.array_equal(pt, top):
+                top_idx = i
+                break
+        if top_idx is None:
+            return None, None
+        # 3. 获取与该顶点相邻的两条边
+        left_neighbor = corners[(top_idx - 1) % 6]
+        right_neighbor = corners[(top_idx + 1) % 6]
+
+        edge1 = [top, left_neighbor]
+        edge2 = [top, right_neighbor]
+
+        # 4. 计算两个边的 x 方向分量
+        dx1 = left_neighbor[0] - top[0]
+        dx2 = right_neighbor[0] - top[0]
+
+        # 5. 选择更靠右的边（x 分量更大的）作为参考边
+        # 选择更靠右的边作为 baseline
+        base_edge_hex = edge1 if dx1 > dx2 else edge2
+
+        ref_angle = calculate_angle(base_edge_hex[0], base_edge_hex[1])
+        base_line = [tuple(base_edge_hex[0]), tuple(base_edge_hex[1])]
+        angle = ref_angle % 60
+        return angle, base_line
+
+
+    # 菱形
+    elif shape == "Rhombus":
+        max_dist = 0
+        pair = (corners[0], corners[2])
+        for i in range(4):
+            for j in range(i+1, 4):
+                d = calculate_distance(corners[i], corners[j])
+                if d > max_dist:
+                    max_dist = d
+                    pair = (corners[i], corners[j])
+        ref_angle = calculate_angle(pair[0], pair[1])
+        base_line = [tuple(pair[0]), tuple(pair[1])]
+        return -((180 - 30 -  ref_angle) % 180), base_line
+    
+
+    # 梯形
+    elif shape == "Trapezoid":
+        # 找最长边（长边）
+        max_len = 0
+        long_edge = (corners[0], corners[1])
+        long_edge_idx = 0
+
+        for i in range(4):
+            j = (i + 1) % 4
+            d = calculate_distance(corners[i], corners[j])
+            if d > max_len:
+                max_len = d
+                long_edge = (corners[i], corners[j])
+                long_edge_idx = i
+
+        # 找与长边对边的短边
+        short_edge = (corners[(long_edge_idx + 2) % 4], corners[(long_edge_idx + 3) % 4])
+
+        # 判断 y 坐标，确定朝向
+        long_edge_y_avg = (long_edge[0][1] + long_edge[1][1]) / 2
+        short_edge_y_avg = (short_edge[0][1] + short_edge[1][1]) / 2
+
+        ref_angle = calculate_angle(long_edge[0], long_edge[1])
+        # 如果长边在短边下方（y大） angle = ref_angle % 360
+        # 如果长边在短边上方（y小） angle = (ref_angle + 180) % 
+        if long_edge_y_avg > short_edge_y_avg:
+            angle = ref_angle % 360
+        else:
+            angle = (ref_angle + 180) % 360
+
+        base_line = [tuple(long_edge[0]), tuple(long_edge[1])]
+        return angle, base_line
+
+
+    return None, None
+
+
+def _distance(p1, p2):
+    # 与 calculate_distance 相同：按输入类型做差与平方，再开方
+    return np.sqrt(((p1[..., 0] - p2[..., 0]) ** 2) + ((p1[..., 1] - p2[..., 1]) ** 2))
+
+
+def _angle(pt1, pt2):
+    # 与 calculate_angle 相同：保证 pt1 在左，再求 [0, 360) 的方向角
+    swap = pt1[..., 0] > pt2[..., 0]
+    left = np.where(swap[..., None], pt2, pt1)
+    right = np.where(swap[..., None], pt1, pt2)
+    dx = right[..., 0] - left[..., 0]
+    dy = right[..., 1] - left[..., 1]
+    return np.degrees(np.arctan2(dy, dx)) % 360
+
+
+def _take(corners, index):
+    """按每行的索引取角点，index 形状为 (N,)"""
+    return corners[np.arange(len(corners)), index]
+
+
+def side_lengths(corners, counts):
+    """各边长度 (N, K)，第 i 条边连接角点 i 与 i+1（首尾相接），补齐部分为 NaN"""
+    n, k = corners.shape[:2]
+    next_index = (np.arange(k)[None, :] + 1) % np.maximum(counts, 1)[:, None]
+    following = np.take_along_axis(corners, next_index[..., None], axis=1)
+    lengths = _distance(corners, following).astype(np.float64)
+    lengths[np.arange(k)[None, :] >= counts[:, None]] = np.nan
+    return lengths
+
+
+def are_parallel_batch(p1, p2, p3, p4):
+    """are_parallel 的批量版本，参数为 (N, 2) 数组"""
+    v1 = (p2 - p1).astype(np.float64)
+    v2 = (p4 - p3).astype(np.float64)
+    norm_v1 = np.sqrt(v1[:, 0] * v1[:, 0] + v1[:, 1] * v1[:, 1])
+    norm_v2 = np.sqrt(v2[:, 0] * v2[:, 0] + v2[:, 1] * v2[:, 1])
+    degenerate = (norm_v1 < 1e-6) | (norm_v2 < 1e-6)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cross_product = v1[:, 0] * v2[:, 1] - v1[:, 1] * v2[:, 0]
+        sin_theta = cross_product / (norm_v1 * norm_v2)
+    return ~degenerate & (np.abs(sin_theta) < PARALLEL_SIN_TOLERANCE)
+
+
+def analyze_quadrilaterals(quads):
+    """analyze_quadrilateral 的批量版本，quads 为 (N, 4, 2)，返回形状名数组"""
+    lengths = [_distance(quads[:, i], quads[:, (i + 1) % 4]) for i in range(4)]
+    avg_length = (((lengths[0] + lengths[1]) + lengths[2]) + lengths[3]) / 4
+    rhombus = np.ones(len(quads), dtype=bool)
+    for length in lengths:
+        rhombus &= np.abs(length - avg_length) < avg_length * LENGTH_TOLERANCE_RATIO
+    parallel = (are_parallel_batch(quads[:, 0], quads[:, 1], quads[:, 2], quads[:, 3])
+                | are_parallel_batch(quads[:, 1], quads[:, 2], quads[:, 3], quads[:, 0]))
+    return np.where(rhombus, "Rhombus", np.where(parallel, "Trapezoid", "Irregular Quadrilateral")).astype(object)
+
+
+def classify_polygons(corners, counts):
+    """按角点数分类：3 → 三角形，4 → 菱形/梯形/不规则四边形，6 → 六边形，其余为 unknow"""
+    shapes = np.full(len(corners), "unknow", dtype=object)
+    shapes[counts == 3] = "Triangle"
+    shapes[counts == 6] = "Hexagon"
+    quad = counts == 4
+    if quad.any():
+        shapes[quad] = analyze_quadrilaterals(corners[quad, :4])
+    return shapes
+
+
+def polygon_centroids(corners, counts):
+    """
+    质心 (N, 2)，与 polygon_centroid（cv2.moments）一致：按相同顺序累加轮廓矩，
+    面积为 0 的退化多边形为 NaN
+    """
+    n, k = corners.shape[:2]
+    if n == 0:
+        return np.zeros((0, 2))
+    pts = corners.astype(np.float64)
+    rows = np.arange(n)
+    last = _take(pts, np.maximum(counts - 1, 0))
+    xi_1, yi_1 = last[:, 0], last[:, 1]
+    a00 = np.zeros(n)
+    a10 = np.zeros(n)
+    a01 = np.zeros(n)
+    for i in range(k):
+        valid = i < counts
+        xi, yi = pts[rows, i, 0], pts[rows, i, 1]
+        dxy = xi_1 * yi - xi * yi_1
+        a00 = np.where(valid, a00 + dxy, a00)
+        a10 = np.where(valid, a10 + dxy * (xi_1 + xi), a10)
+        a01 = np.where(valid, a01 + dxy * (yi_1 + yi), a01)
+        xi_1 = np.where(valid, xi, xi_1)
+        yi_1 = np.where(valid, yi, yi_1)
+
+    db1_2 = np.where(a00 > 0, 0.5, -0.5)
+    db1_6 = np.where(a00 > 0, 0.16666666666666666666666666666667, -0.16666666666666666666666666666667)
+    m00 = a00 * db1_2
+    nonzero = (np.abs(a00) > FLT_EPSILON) & (m00 != 0)
+    centers = np.full((n, 2), np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        centers[:, 0] = np.where(nonzero, (a10 * db1_6) / m00, np.nan)
+        centers[:, 1] = np.where(nonzero, (a01 * db1_6) / m00, np.nan)
+    return centers
+
+
+def _sort_by_y(corners):
+    """每行按 (y, x) 稳定排序"""
+    order = np.lexsort((corners[..., 0], corners[..., 1]), axis=-1)
+    return np.take_along_axis(corners, order[..., None], axis=1)
+
+
+def _triangle_angles(tri):
+    pts = _sort_by_y(tri)
+    top = pts[:, 0]
+    others = pts[:, 1:]
+    x_deltas = np.abs(others[..., 0] - top[:, None, 0])
+    reference = _take(others, np.argmax(x_deltas, axis=1))
+    angles = (_angle(top, reference) - 60) % 120
+    # 有重复顶点时原函数会去掉所有与顶点相同的点，交给逐个计算
+    duplicate = (others == top[:, None, :]).all(axis=-1).any(axis=1)
+    return angles, np.stack([top, reference], axis=1), duplicate
+
+
+def _hexagon_angles(hexes):
+    top = _sort_by_y(hexes)[:, 0]
+    top_idx = np.argmax((hexes == top[:, None, :]).all(axis=-1), axis=1)
+    left = _take(hexes, (top_idx - 1) % 6)
+    right = _take(hexes, (top_idx + 1) % 6)
+    use_left = (left[:, 0] - top[:, 0]) > (right[:, 0] - top[:, 0])
+    other = np.where(use_left[:, None], left, right)
+    angles = _angle(top, other) % 60
+    return angles, np.stack([top, other], axis=1)
+
+
+def _rhombus_angles(quads):
+    pairs = [(i, j) for i in range(4) for j in range(i + 1, 4)]
+    distances = np.stack([_distance(quads[:, i], quads[:, j]) for i, j in pairs], axis=1)
+    best = np.argmax(distances, axis=1)
+    first = np.array([i for i, _ in pairs])[best]
+    second = np.array([j for _, j in pairs])[best]
+    # 所有距离都为 0 时保持初始的 (0, 2)
+    zero = ~(distances > 0).any(axis=1)
+    first = np.where(zero, 0, first)
+    second = np.where(zero, 2, second)
+    p1, p2 = _take(quads, first), _take(quads, second)
+    angles = -((180 - 30 - _angle(p1, p2)) % 180)
+    return angles, np.stack([p1, p2], axis=1)
+
+
+def _trapezoid_angles(quads):
+    lengths = np.stack([_distance(quads[:, i], quads[:, (i + 1) % 4]) for i in range(4)], axis=1)
+    idx = np.argmax(lengths, axis=1)
+    long0, long1 = _take(quads, idx), _take(quads, (idx + 1) % 4)
+    short0, short1 = _take(quads, (idx + 2) % 4), _take(quads, (idx + 3) % 4)
+    long_edge_y_avg = (long0[:, 1] + long1[:, 1]) / 2
+    short_edge_y_avg = (short0[:, 1] + short1[:, 1]) / 2
+    ref_angle = _angle(long0, long1)
+    angles = np.where(long_edge_y_avg > short_edge_y_avg, ref_angle % 360, (ref_angle + 180) % 360)
+    return angles, np.stack([long0, long1], axis=1)
+
+
+def reference_angles(shapes, corners, counts):
+    """
+    select_reference_angle 的批量版本，返回 (角度 (N,), 基准边 (N, 2, 2))
+    无法计算的行角度为 NaN；角点数与形状不符的行同样为 NaN
+    """
+    n = len(corners)
+    angles = np.full(n, np.nan)
+    base_lines = np.zeros((n, 2, 2), dtype=corners.dtype)
+    groups = (("Triangle", 3, _triangle_angles), ("Hexagon", 6, _hexagon_angles),
+              ("Rhombus", 4, _rhombus_angles), ("Trapezoid", 4, _trapezoid_angles))
+    for shape, k, func in groups:
+        rows = np.flatnonzero((shapes == shape) & (counts == k))
+        if len(rows) == 0:
+            continue
+        result = func(corners[rows, :k])
+        group_angles, group_lines = result[0], result[1]
+        angles[rows] = group_angles
+        base_lines[rows] = group_lines
+        if len(result) > 2:
+            for row in rows[result[2]]:
+                angle, base_line = select_reference_angle(shape, corners[row, :k])
+                angles[row] = np.nan if angle is None else angle
+                if base_line is not None:
+                    base_lines[row] = np.array(base_line, dtype=corners.dtype)
+    return angles, base_lines
+
+
+def _analyze_one_by_one(corners, counts):
+    """analyze_polygons 的逐个计算版本，返回值与批量版本相同"""
+    n = len(corners)
+    shapes = np.full(n, "unknow", dtype=object)
+    centers = np.full((n, 2), np.nan)
+    angles = np.full(n, np.nan)
+    base_lines = np.zeros((n, 2, 2), dtype=corners.dtype)
+    for row in range(n):
+        polygon = corners[row, :counts[row]]
+        if len(polygon) == 3:
+            shapes[row] = "Triangle"
+        elif len(polygon) == 4:
+            shapes[row] = analyze_quadrilateral(polygon)
+        elif len(polygon) == 6:
+            shapes[row] = "Hexagon"
+        M = cv2.moments(polygon)
+        if M["m00"] != 0:
+            centers[row] = M["m10"] / M["m00"], M["m01"] / M["m00"]
+        angle, base_line = select_reference_angle(shapes[row], polygon)
+        if angle is not None:
+            angles[row] = angle
+        if base_line is not None:
+            base_lines[row] = np.array(base_line, dtype=corners.dtype)
+    return shapes, centers, angles, base_lines
+
+
+def analyze_polygons(polygons):
+    """
+    一次分析一帧内的所有多边形，返回 (形状数组, 质心 (N, 2), 角度 (N,), 基准边 (N, 2, 2), 角点数 (N,))
+    多边形少于 BATCH_MIN_POLYGONS 个时逐个计算，结果相同
+    """
+    corners, counts = pad_polygons(polygons)
+    if len(polygons) < BATCH_MIN_POLYGONS:
+        return (*_analyze_one_by_one(corners, counts), counts)
+    shapes = classify_polygons(corners, counts)
+    centers = polygon_centroids(corners, counts)
+    angles, base_lines = reference_angles(shapes, corners, counts)
+    return shapes, centers, angles, base_lines, counts
@@ -1,3 +1,4 @@
+import argparse
 import sys
 import cv2
 import numpy as np
@@ -90,13 +91,12 @@ class HSVFilterApp(QWidget):
         event.accept()
 
 
-def auto_capture_and_run():
-    save_dir = "assets/debug_for_angel"
+def auto_capture_and_run(cam_id=1, width=2592, height=1944, save_dir="assets/debug_for_angel"):
     os.makedirs(save_dir, exist_ok=True)
 
-    cap = cv2.VideoCapture(1)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 2592)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1944)
+    cap = cv2.VideoCapture(cam_id)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
     cap.set(cv2.CAP_PROP_FPS, 10)
 
     if not cap.isOpened():
@@ -133,8 +133,13 @@ def auto_capture_and_run():
 
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    image_path = auto_capture_and_run()
+    parser = argparse.ArgumentParser(description="拍照并调节 HSV 阈值")
+    parser.add_argument("--cam-id", type=int, default=1, help="相机编号（多相机时逐台调节）")
+    parser.add_argument("--width", type=int, default=2592)
+    parser.add_argument("--height", type=int, default=1944)
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    image_path = auto_capture_and_run(args.cam_id, args.width, args.height)
     if image_path:
         window = HSVFilterApp(image_path)
         window.show()
@@ -0,0 +1,89 @@
+"""
+识别结果的紧凑记录与按需标注
+识别只记录每个工件的多边形、质心、基准边与角度（原图像素坐标），不复制也不在原图上绘制；
+需要显示或归档时再按目标分辨率渲染标注图
+"""
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# 原图分辨率下的标注样式
+CONTOUR_COLOR, CONTOUR_THICKNESS = (0, 255, 0), 3
+TEXT_COLOR, TEXT_SCALE, TEXT_THICKNESS, TEXT_OFFSET = (0, 0, 255), 1.8, 3, (-40, 20)
+BASE_LINE_COLOR, BASE_LINE_THICKNESS = (255, 0, 0), 2
+
+# corners 为 (k, 1, 2) 的多边形角点，center 为整数质心 (cx, cy)，base_line 为 ((x1, y1), (x2, y2)) 或 None
+DetectedObject = namedtuple("DetectedObject", ["color_name", "shape", "corners", "center", "angle", "base_line"])
+
+
+def draw_object(image, obj, sx=1.0, sy=1.0):
+    """在 image 上绘制一个工件的标注，sx、sy 为 image 相对原图的缩放比例"""
+    cx, cy = obj.center
+    if sx == 1.0 and sy == 1.0:
+        cv2.drawContours(image, [obj.corners], -1, CONTOUR_COLOR, CONTOUR_THICKNESS)
+        cv2.putText(image, f"{obj.shape},{obj.angle:.1f}", (cx + TEXT_OFFSET[0], cy + TEXT_OFFSET[1]),
+                    cv2.FONT_HERSHEY_SIMPLEX, TEXT_SCALE, TEXT_COLOR, TEXT_THICKNESS)
+        if obj.base_line is not None:
+            p1, p2 = obj.base_line
+            cv2.line(image, p1, p2, BASE_LINE_COLOR, BASE_LINE_THICKNESS)
+        return
+
+    # 缩小显示：坐标按像素中心对齐缩放，线宽与字号按比例缩小（线宽至少 1 像素）
+    def to_display(x, y):
+        return int(round((x + 0.5) * sx - 0.5)), int(round((y + 0.5) * sy - 0.5))
+
+    scale = min(sx, sy)
+    corners = obj.corners.reshape(-1, 2).astype(np.float32)
+    corners = np.round((corners + 0.5) * (sx, sy) - 0.5).astype(np.int32).reshape(-1, 1, 2)
+    cv2.drawContours(image, [corners], -1, CONTOUR_COLOR, max(1, round(CONTOUR_THICKNESS * scale)), cv2.LINE_AA)
+    cv2.putText(image, f"{obj.shape},{obj.angle:.1f}", to_display(cx + TEXT_OFFSET[0], cy + TEXT_OFFSET[1]),
+                cv2.FONT_HERSHEY_SIMPLEX, TEXT_SCALE * scale, TEXT_COLOR,
+                max(1, round(TEXT_THICKNESS * scale)), cv2.LINE_AA)
+    if obj.base_line is not None:
+        p1, p2 = obj.base_line
+        cv2.line(image, to_display(*p1), to_display(*p2), BASE_LINE_COLOR,
+                 max(1, round(BASE_LINE_THICKNESS * scale)), cv2.LINE_AA)
+
+
+class DetectionRecord:
+    """一帧的识别记录，按识别顺序保存工件（原图像素坐标）"""
+
+    def __init__(self, image_shape):
+        self.height, self.width = image_shape[:2]
+        self.objects = []
+        # 分配编号后的工件 [(编号, 形状, x_mm, y_mm, angle)]，世界坐标未取整，与发给 PLC 的工件信息一一对应
+        self.workpieces = []
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def add(self, color_name, shape, corners, center, angle, base_line):
+        if base_line is not None:
+            base_line = tuple((int(p[0]), int(p[1])) for p in base_line)
+        obj = DetectedObject(color_name, shape, corners, (int(center[0]), int(center[1])), angle, base_line)
+        self.objects.append(obj)
+        return obj
+
+    def render(self, image, size=None, scale=None):
+        """
+        在原图 image 的副本上绘制标注并返回，image 本身不被修改
+        size=(宽, 高) 或 scale 指定输出分辨率时先缩小原图再按该分辨率绘制（界面显示）；
+        都不指定时按原图分辨率绘制（归档），与识别时直接在原图上绘制的结果相同
+        """
+        if size is None and scale is not None and scale != 1.0:
+            size = (max(1, round(self.width * scale)), max(1, round(self.height * scale)))
+        if size is None or tuple(size) == (self.width, self.height):
+            output = image.copy()
+            sx = sy = 1.0
+        else:
+            # 缩小倍数较大时先隔行隔列取样再做区域平均，显示效果相近而缩放耗时只有几分之一
+            step = max(1, min(self.width // size[0], self.height // size[1]) // 2)
+            output = cv2.resize(image[::step, ::step], tuple(size), interpolation=cv2.INTER_AREA)
+            sx, sy = size[0] / self.width, size[1] / self.height
+        for obj in self.objects:
+            draw_object(output, obj, sx, sy)
+        return output
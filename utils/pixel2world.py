@@ -1,7 +1,24 @@
+import hashlib
+import os
+import tempfile
+
 import numpy as np
 import cv2
 
 
+DEFAULT_H_PATH = 'config/waican.txt'
+DEFAULT_K_PATH = 'config/neican.txt'
+DEFAULT_D_PATH = 'config/jibian.txt'
+DEFAULT_CONFIG_ROOT = 'config'
+
+
+def camera_config_paths(camera, config_root=DEFAULT_CONFIG_ROOT):
+    """多相机时每台相机的标定文件放在 config/<camera>/ 下，返回 (外参, 内参, 畸变) 文件路径"""
+    directory = os.path.join(config_root, camera)
+    return (os.path.join(directory, 'waican.txt'), os.path.join(directory, 'neican.txt'),
+            os.path.join(directory, 'jibian.txt'))
+
+
 def read_homography_matrix(txt_path):
     """从 txt 文件读取 3x3 外参矩阵 H"""
     with open(txt_path, 'r') as f:
@@ -36,24 +53,186 @@ def read_dist_coeffs(txt_path):
     return np.array(coeffs)
 
 
+class CalibrationModel:
+    """
+    相机标定模型：内参、畸变与外参只加载一次，配置文件修改(mtime 变化)后自动重新加载
+    digest 为三个配置文件内容的 SHA-1，用于判断由标定派生的缓存（查找表、识别结果缓存）是否过期
+    """
+
+    def __init__(self, H_txt_path=DEFAULT_H_PATH, K_txt_path=DEFAULT_K_PATH, D_txt_path=DEFAULT_D_PATH):
+        self.H_txt_path = H_txt_path
+        self.K_txt_path = K_txt_path
+        self.D_txt_path = D_txt_path
+        self.H = None
+        self.K = None
+        self.D = None
+        self.mtimes = None
+        self.digest = None
+        self.reload_if_changed()
+
+    @property
+    def paths(self):
+        return (self.H_txt_path, self.K_txt_path, self.D_txt_path)
+
+    def reload_if_changed(self):
+        """配置文件有改动时重新读取，返回是否发生了重新加载"""
+        mtimes = tuple(os.path.getmtime(p) for p in self.paths)
+        if mtimes == self.mtimes:
+            return False
+        self.H = read_homography_matrix(self.H_txt_path)
+        self.K = read_camera_matrix(self.K_txt_path)
+        self.D = read_dist_coeffs(self.D_txt_path)
+        digest = hashlib.sha1()
+        for path in self.paths:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        self.mtimes = mtimes
+        self.digest = digest.hexdigest()
+        return True
+
+    def undistort(self, points):
+        """批量畸变矫正，points 为 Nx2 像素坐标"""
+        src = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        if len(src) == 0:
+            return np.empty((0, 2), dtype=np.float64)
+        undistorted = cv2.undistortPoints(src, self.K, self.D, P=self.K)
+        return undistorted.reshape(-1, 2).astype(np.float64)
+
+    def to_world(self, points):
+        """
+        批量像素坐标 → 世界坐标：points 为 Nx2 数组，返回 Nx2 的 (X, Y)
+        """
+        self.reload_if_changed()
+        corrected = self.undistort(points)
+        # 单应变换（齐次坐标）
+        pixels = np.hstack([corrected, np.ones((len(corrected), 1))])
+        world = pixels @ self.H.T
+        return world[:, :2] / world[:, 2:3]
+
+
+_calibration_models = {}
+
+
+def get_calibration_model(H_txt_path=DEFAULT_H_PATH, K_txt_path=DEFAULT_K_PATH, D_txt_path=DEFAULT_D_PATH):
+    """按配置文件路径缓存标定模型，同一组配置只加载一次"""
+    key = (H_txt_path, K_txt_path, D_txt_path)
+    model = _calibration_models.get(key)
+    if model is None:
+        model = CalibrationModel(H_txt_path, K_txt_path, D_txt_path)
+        _calibration_models[key] = model
+    return model
+
+
+class WorldLookupTable:
+    """
+    整幅图像的像素 → 世界坐标查找表 (H x W x 2, float32)
+    以 .npy 形式保存在配置文件旁并内存映射加载，生成时所用标定文件的摘要记录在旁边的 .sha1 文件中，
+    摘要不一致（标定文件内容有任何变化，包括恢复旧版本）时自动重建；
+    亚像素坐标使用双线性插值，超出图像范围的点回退到标定模型精确计算
+    """
+
+    def __init__(self, width=2592, height=1944, model=None, lut_path=None, rows_per_chunk=128):
+        self.width = width
+        self.height = height
+        self.model = model if model is not None else get_calibration_model()
+        if lut_path is None:
+            config_dir = os.path.dirname(self.model.H_txt_path)
+            lut_path = os.path.join(config_dir, f"world_lut_{width}x{height}.npy")
+        self.lut_path = lut_path
+        self.digest_path = lut_path + ".sha1"
+        self.rows_per_chunk = rows_per_chunk
+        self.table = None
+        self._built_for = None
+        self.ensure_table()
+
+    def _is_stale(self):
+        if not os.path.exists(self.lut_path) or not os.path.exists(self.digest_path):
+            return True
+        with open(self.digest_path, 'r') as f:
+            return f.read().strip() != self.model.digest
+
+    def ensure_table(self):
+        """查找表不存在、尺寸不符或不是由当前标定文件生成时重建，否则内存映射加载"""
+        self.model.reload_if_changed()
+        if self.table is not None and self._built_for == self.model.digest:
+            return
+        self.table = None  # 释放旧的映射，Windows 下才能覆盖文件
+        if not self._is_stale():
+            table = np.load(self.lut_path, mmap_mode='r')
+            if table.shape == (self.height, self.width, 2) and table.dtype == np.float32:
+                self.table = table
+        if self.table is None:
+            self.table = self.build()
+        self._built_for = self.model.digest
+
+    def build(self):
+        """
+        逐块计算每个像素的世界坐标并写入 .npy，返回只读内存映射
+        先写到同目录下的唯一临时文件再替换，多个进程同时重建时互不覆盖写到一半的文件
+        """
+        directory = os.path.dirname(self.lut_path) or '.'
+        fd, tmp_path = tempfile.mkstemp(suffix=".npy.tmp", dir=directory)
+        os.close(fd)
+        table = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                          shape=(self.height, self.width, 2))
+        xs = np.arange(self.width, dtype=np.float32)
+        for y0 in range(0, self.height, self.rows_per_chunk):
+            y1 = min(y0 + self.rows_per_chunk, self.height)
+            grid_x, grid_y = np.meshgrid(xs, np.arange(y0, y1, dtype=np.float32))
+            pts = np.stack([grid_x.ravel(), grid_y.ravel()], axis=1)
+            table[y0:y1] = self.model.to_world(pts).reshape(y1 - y0, self.width, 2)
+        table.flush()
+        del table
+        os.replace(tmp_path, self.lut_path)
+        # 摘要在查找表就位之后写入：中途退出时只会多重建一次，不会把旧表当成新表
+        fd, tmp_path = tempfile.mkstemp(suffix=".sha1.tmp", dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.model.digest)
+        os.replace(tmp_path, self.digest_path)
+        return np.load(self.lut_path, mmap_mode='r')
+
+    def to_world(self, points):
+        """
+        批量像素坐标 → 世界坐标（双线性插值），接口与 CalibrationModel.to_world 一致
+        """
+        self.ensure_table()
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x, y = pts[:, 0], pts[:, 1]
+        inside = (x >= 0) & (y >= 0) & (x <= self.width - 1) & (y <= self.height - 1)
+
+        x0 = np.clip(np.floor(x).astype(np.intp), 0, self.width - 2)
+        y0 = np.clip(np.floor(y).astype(np.intp), 0, self.height - 2)
+        fx = (x - x0)[:, None]
+        fy = (y - y0)[:, None]
+        t = self.table
+        world = (t[y0, x0] * (1 - fx) * (1 - fy) + t[y0, x0 + 1] * fx * (1 - fy)
+                 + t[y0 + 1, x0] * (1 - fx) * fy + t[y0 + 1, x0 + 1] * fx * fy)
+
+        if not inside.all():
+            world[~inside] = self.model.to_world(pts[~inside])
+        return world
+
+
+_world_luts = {}
+
+
+def get_world_lut(width=2592, height=1944, H_txt_path=DEFAULT_H_PATH, K_txt_path=DEFAULT_K_PATH, D_txt_path=DEFAULT_D_PATH):
+    """按分辨率与配置文件缓存查找表，同一进程内只映射一次"""
+    key = (width, height, H_txt_path, K_txt_path, D_txt_path)
+    lut = _world_luts.get(key)
+    if lut is None:
+        model = get_calibration_model(H_txt_path, K_txt_path, D_txt_path)
+        lut = WorldLookupTable(width, height, model=model)
+        _world_luts[key] = lut
+    return lut
+
+
 def pixel_to_world_coords(u, v, H_txt_path, K_txt_path, D_txt_path):
     """
     从像素坐标(u,v) → 世界坐标(X,Y)，包含矫正与单应变换
     """
-    # 加载矩阵
-    H = read_homography_matrix(H_txt_path)
-    K = read_camera_matrix(K_txt_path)
-    D = read_dist_coeffs(D_txt_path)
-
-    # 畸变矫正
-    src = np.array([[[u, v]]], dtype=np.float32)
-    undistorted = cv2.undistortPoints(src, K, D, P=K)
-    u_corr, v_corr = undistorted[0][0]
-
-    # 单应变换
-    pixel = np.array([u_corr, v_corr, 1.0])
-    world = H @ pixel
-    world /= world[2]
+    model = get_calibration_model(H_txt_path, K_txt_path, D_txt_path)
+    world = model.to_world([[u, v]])[0]
     return round(world[0], 2), round(world[1], 2)
 
 
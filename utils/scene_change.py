@@ -0,0 +1,60 @@
+import cv2
+import numpy as np
+
+
+class SceneChangeDetector:
+    """
+    轻量场景变化检测：把帧缩小并模糊后作为签名，与上次完整识别时的签名逐像素比较
+    保留彩色通道（识别按颜色分割，亮度相同但颜色不同的工件移动也要能发现），
+    任一通道差值超过 pixel_threshold 的像素数不超过 max_changed_pixels 时认为场景未变化，
+    可直接复用缓存的识别结果；
+    key 为识别所依赖的配置（标定、编号布局、颜色阈值）的标识，与缓存时的 key 不同时同样视为未命中
+    """
+
+    def __init__(self, downscale=8, blur_ksize=5, pixel_threshold=20, max_changed_pixels=4):
+        self.downscale = downscale
+        self.blur_ksize = blur_ksize
+        self.pixel_threshold = pixel_threshold
+        self.max_changed_pixels = max_changed_pixels
+        self._reference = None
+        self._cached = None
+        self._key = None
+
+    def signature(self, frame):
+        """缩小 → 高斯模糊，抑制传感器噪声与压缩噪声"""
+        h, w = frame.shape[:2]
+        # 先按 downscale/2 间隔取样再做 2x2 区域平均，比直接对整帧做 INTER_AREA 快一倍以上
+        step = max(1, self.downscale // 2)
+        small = cv2.resize(frame[::step, ::step], (max(1, w // self.downscale), max(1, h // self.downscale)),
+                           interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (self.blur_ksize, self.blur_ksize), 0)
+
+    def changed_pixels(self, signature):
+        """与参考签名相比变化的像素数，没有参考或尺寸不同时返回 None"""
+        if self._reference is None or self._reference.shape != signature.shape:
+            return None
+        diff = cv2.absdiff(signature, self._reference)
+        if diff.ndim == 3:
+            diff = diff.max(axis=2)
+        return int(np.count_nonzero(diff > self.pixel_threshold))
+
+    def lookup(self, signature, key=None):
+        """场景与配置均未变化时返回缓存的结果，否则返回 None"""
+        if key != self._key:
+            return None
+        changed = self.changed_pixels(signature)
+        if changed is None or changed > self.max_changed_pixels:
+            return None
+        return self._cached
+
+    def update(self, signature, result, key=None):
+        """完整识别后记录新的参考签名、结果与配置标识"""
+        self._reference = signature
+        self._cached = result
+        self._key = key
+
+    def invalidate(self):
+        """HSV 阈值或标定变化后清空缓存，下一次强制完整识别"""
+        self._reference = None
+        self._cached = None
+        self._key = None
@@ -0,0 +1,17 @@
+from multiprocessing import resource_tracker, shared_memory
+
+
+def attach_shared_memory(name):
+    """只读端打开已有的共享内存，不登记到 resource_tracker（否则读端退出时会删除写端的共享内存）"""
+    try:
+        return shared_memory.SharedMemory(name=name, create=False, track=False)  # Python 3.13+
+    except TypeError:
+        pass
+    # 旧版本打开时总会登记，打开期间临时跳过登记；
+    # 不能打开后再注销：同一 resource_tracker（如 fork 出的子进程）中会把写端的登记一并删除
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name, create=False)
+    finally:
+        resource_tracker.register = register
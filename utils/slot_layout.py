@@ -0,0 +1,105 @@
+"""
+工件编号布局：每种形状占用一段连续编号，编号区间按配置文件中的顺序依次排列
+同一形状内的工件按抓取路径排序后依次分配编号
+
+config/slot_layout.json 示例：
+    {
+        "order": "serpentine",
+        "row_pitch": 40,
+        "slots": [["Triangle", 5], ["Rhombus", 4], ["Hexagon", 1], ["Trapezoid", 1]]
+    }
+"""
+import json
+import os
+
+DEFAULT_SLOT_LAYOUT_PATH = 'config/slot_layout.json'
+# 默认布局：三角形 1-5，菱形 6-9，六边形 10，梯形 11
+DEFAULT_SLOTS = [("Triangle", 5), ("Rhombus", 4), ("Hexagon", 1), ("Trapezoid", 1)]
+# detection：按识别顺序；raster：按行（世界坐标 y）从小到大、行内 x 从小到大；
+# serpentine：按行往返（奇数行 x 从大到小），相邻工件之间的移动距离最短
+PICK_ORDERS = ("detection", "raster", "serpentine")
+
+
+class SlotLayout:
+    def __init__(self, slots=DEFAULT_SLOTS, order="detection", row_pitch=40.0):
+        if order not in PICK_ORDERS:
+            raise ValueError(f"Unknown pick order: {order}")
+        if row_pitch <= 0:
+            raise ValueError("row_pitch must be positive")
+        self.order = order
+        self.row_pitch = float(row_pitch)  # 抓取路径的行间距（毫米）
+        # 形状 → 编号索引区间 [start_idx, end_idx)，编号 = 索引 + 1
+        self.slots = {}
+        start_idx = 0
+        for shape, capacity in slots:
+            if shape in self.slots:
+                raise ValueError(f"Duplicate shape in slot layout: {shape}")
+            if capacity < 0:
+                raise ValueError(f"Negative capacity for {shape}")
+            self.slots[shape] = (start_idx, start_idx + int(capacity))
+            start_idx += int(capacity)
+
+    @classmethod
+    def from_dict(cls, config):
+        return cls(slots=[(shape, capacity) for shape, capacity in config.get("slots", DEFAULT_SLOTS)],
+                   order=config.get("order", "detection"), row_pitch=config.get("row_pitch", 40.0))
+
+    @classmethod
+    def load(cls, path=DEFAULT_SLOT_LAYOUT_PATH):
+        """读取配置文件，文件不存在时使用默认布局"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def shape_of(self, slot):
+        """编号（从 1 开始）→ 形状，不在任何区间内时返回 None"""
+        return next((shape for shape, (start_idx, end_idx) in self.slots.items()
+                     if start_idx < slot <= end_idx), None)
+
+    def sort_by_pick_path(self, workpieces):
+        """workpieces 为 [(x_mm, y_mm, angle)]，按抓取路径排序"""
+        if self.order == "detection" or len(workpieces) < 2:
+            return list(workpieces)
+        y_min = min(y for _, y, _ in workpieces)
+
+        def key(workpiece):
+            x, y, _ = workpiece
+            row = int((y - y_min) // self.row_pitch)
+            if self.order == "serpentine" and row % 2:
+                return row, -x
+            return row, x
+
+        return sorted(workpieces, key=key)
+
+    def assign(self, workpiece_info_dict):
+        """
+        按布局为各形状的工件分配编号
+        返回 ([(编号, 形状, x_mm, y_mm, angle)], {形状: 超出编号范围未分配的数量})
+        """
+        assigned = []
+        overflow = {}
+        for shape, (start_idx, end_idx) in self.slots.items():
+            workpieces = self.sort_by_pick_path(workpiece_info_dict.get(shape, []))
+            capacity = end_idx - start_idx
+            for j, (x_mm, y_mm, angle) in enumerate(workpieces[:capacity]):
+                assigned.append((start_idx + j + 1, shape, x_mm, y_mm, angle))
+            if len(workpieces) > capacity:
+                overflow[shape] = len(workpieces) - capacity
+        for shape, workpieces in workpiece_info_dict.items():
+            if shape not in self.slots and workpieces:
+                overflow[shape] = len(workpieces)
+        return assigned, overflow
+
+
+_slot_layouts = {}
+
+
+def get_slot_layout(path=DEFAULT_SLOT_LAYOUT_PATH):
+    """按配置文件路径缓存编号布局，配置文件修改后自动重新加载"""
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    cached = _slot_layouts.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, SlotLayout.load(path))
+        _slot_layouts[path] = cached
+    return cached[1]
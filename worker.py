@@ -0,0 +1,336 @@
+import multiprocessing
+import queue
+import threading
+import time
+
+import cv2
+
+try:
+    from PyQt5.QtCore import QThread, pyqtSignal
+except ImportError:  # 无界面服务模式下不需要 Qt
+    QThread = None
+
+from detect import detect_objects, iter_workpieces
+from metrics import DETECTION_CACHE_HITS, DETECTION_STAGE_SECONDS, DETECTIONS_REJECTED, WORKPIECES_DETECTED
+from utils.frame_buffer import StaleFrameError
+from utils.overlay import DetectionRecord
+from utils.pixel2world import get_calibration_model, get_world_lut
+from utils.scene_change import SceneChangeDetector
+from utils.slot_layout import get_slot_layout
+
+
+# 识别任务队列（不依赖 Qt）
+class DetectionQueue:
+    """
+    识别核心：接收帧引用，执行识别，结果直接发布到 result_channel（不经过 GUI 线程），
+    再通过 on_result 回调返回结果、识别记录与预览图，原图与识别记录交给 saver 异步保存
+    识别时不复制、不标注原图，预览图在 preview_size 分辨率下绘制，原图分辨率的标注图由 saver 在保存线程中渲染
+    同时在队列中（含正在执行的任务）的请求数超过 max_pending 时拒绝新的请求
+    run() 为阻塞循环，由 QThread（界面）或 threading.Thread（无界面服务）驱动
+    preview_size 为 None 时不生成预览图
+    scene_cache 为 True 时先做轻量场景变化检测，画面与上次完整识别时相比没有变化、
+    且标定文件与编号布局也没有变化（见 scene_cache_key）时直接复用上次结果
+    """
+
+    def __init__(self, max_pending=2, preview_size=(640, 512), pyramid_level=0, saver=None, result_channel=None,
+                 streaming=False, scene_cache=True, on_result=None, log_callback=print):
+        self.max_pending = max_pending
+        self.preview_size = preview_size
+        self.pyramid_level = pyramid_level
+        self.saver = saver  # ResultSaver，为 None 时不保存图像
+        self.result_channel = result_channel  # ResultChannel，为 None 时只通过信号返回结果
+        self.streaming = streaming
+        self.scene_detector = SceneChangeDetector() if scene_cache else None
+        self.on_result = on_result
+        self.log_callback = log_callback
+        self.running = True
+        self._jobs = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._next_job_id = 0
+
+    @property
+    def pending(self):
+        """排队中与正在执行的任务数"""
+        return self._pending
+
+    def submit(self, frame_ref, timings=None):
+        """
+        提交一帧（FrameRef）进行识别，返回任务编号；队列已满时释放该帧并返回 None
+        timings 为调用方记录的时间戳（如 PLC 触发时刻），识别完成后随结果一起返回
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                rejected = self._pending
+            else:
+                rejected = None
+                self._next_job_id += 1
+                self._pending += 1
+                job_id = self._next_job_id
+        if rejected is not None:
+            frame_ref.release()
+            DETECTIONS_REJECTED.inc()
+            self.log_callback(f"[系统] 识别队列已满({rejected})，忽略本次请求")
+            return None
+        self._jobs.put((job_id, frame_ref, time.perf_counter(), timings))
+        return job_id
+
+    def run(self):
+        while self.running:
+            job = self._jobs.get()
+            if job is None:
+                break
+            job_id, frame_ref, submitted_at, timings = job
+            try:
+                self.process(job_id, frame_ref, submitted_at, timings)
+            except Exception as e:
+                self.log_callback(f"[识别错误] {e}")
+            finally:
+                frame_ref.release()
+                with self._lock:
+                    self._pending -= 1
+
+    def invalidate_scene_cache(self):
+        """在进程内修改 HSV 阈值后调用，下一次强制完整识别（标定与编号布局的变化由 scene_cache_key 自动发现）"""
+        if self.scene_detector is not None:
+            self.scene_detector.invalidate()
+
+    @staticmethod
+    def scene_cache_key():
+        """
+        缓存结果所依赖配置的标识：标定文件内容摘要（世界坐标查找表由其派生）与编号布局（配置文件修改后为新对象），
+        标定或布局重新加载后与缓存时的标识不同，不再复用旧的世界坐标与编号
+        """
+        calibration = get_calibration_model()
+        calibration.reload_if_changed()
+        return calibration.digest, get_slot_layout()
+
+    def process(self, job_id, frame_ref, submitted_at, timings=None):
+        frame = frame_ref.frame
+        started_at = time.perf_counter()
+        timings = dict(timings or {})
+
+        signature = cached = cache_key = None
+        if self.scene_detector is not None:
+            signature = self.scene_detector.signature(frame)
+            cache_key = self.scene_cache_key()
+            cached = self.scene_detector.lookup(signature, cache_key)
+
+        if cached is not None:
+            record, workpiece_info_list, preview = cached
+            DETECTION_CACHE_HITS.inc()
+            self.log_callback("[系统] 场景未变化，复用上次识别结果")
+        else:
+            self.log_callback("[系统] 开始识别拍摄图像...")
+            record, workpiece_info_list = self.detect(job_id, frame_ref, timings)
+            preview = None
+        detected_at = time.perf_counter()
+        timings["detection_done"] = detected_at
+
+        # 先发布结果，PLC 发送端立即被唤醒
+        if self.result_channel is not None:
+            self.result_channel.publish(workpiece_info_list, frame_seq=frame_ref.seq, timings=timings,
+                                        job_id=job_id, workpieces=record.workpieces)
+
+        if preview is None and self.preview_size is not None:
+            preview = cv2.cvtColor(record.render(frame, self.preview_size), cv2.COLOR_BGR2RGB)
+        if cached is None and self.scene_detector is not None:
+            self.scene_detector.update(signature, (record, workpiece_info_list, preview), cache_key)
+        finished_at = time.perf_counter()
+        if self.on_result is not None:
+            self.on_result({
+                "job_id": job_id,
+                "frame_seq": frame_ref.seq,
+                "workpiece_info_list": workpiece_info_list,
+                "record": record,                            # DetectionRecord，可按需渲染其他分辨率的标注图
+                "preview": preview,
+                "queue_wait": started_at - submitted_at,     # 排队等待时间（秒）
+                "detect_time": detected_at - started_at,     # 识别耗时（秒）
+                "latency": finished_at - submitted_at,       # 提交到完成的总耗时（秒）
+                "queue_depth": self._jobs.qsize(),
+                "timings": timings,
+                "cached": cached is not None,                # 是否复用了上次的识别结果
+            })
+
+        # ====保存图像====（异步，保存线程持有帧引用直到写完；复用结果时画面没有变化，不重复保存）
+        if self.saver is not None and cached is None:
+            self.saver.submit(frame_ref.retain(), record)
+
+    def detect(self, job_id, frame_ref, timings):
+        """完整识别一帧，返回 (识别记录, 工件信息列表)"""
+        frame = frame_ref.frame
+        # 固定分辨率下使用预计算的像素→世界坐标查找表
+        world_lut = get_world_lut(frame.shape[1], frame.shape[0])
+        if self.streaming:
+            return self.detect_streaming(job_id, frame_ref, world_lut, timings)
+        return detect_objects(frame, log_callback=self.log_callback, calibration=world_lut,
+                              pyramid_level=self.pyramid_level)
+
+    def detect_streaming(self, job_id, frame_ref, world_lut, timings):
+        """流式识别：每得到一个工件就发布一次部分结果，返回 (识别记录, 按识别顺序的工件信息列表)"""
+        record = DetectionRecord(frame_ref.frame.shape)
+        workpiece_info_list = []
+        for workpiece in iter_workpieces(frame_ref.frame, log_callback=self.log_callback, calibration=world_lut,
+                                         pyramid_level=self.pyramid_level, record=record):
+            workpiece_info_list.append(workpiece["info"])
+            if "first_workpiece" not in timings:
+                timings["first_workpiece"] = time.perf_counter()
+            if self.result_channel is not None:
+                self.result_channel.publish(workpiece_info_list, frame_seq=frame_ref.seq, timings=dict(timings),
+                                            job_id=job_id, complete=False, workpieces=record.workpieces)
+        return record, workpiece_info_list
+
+    def stop(self):
+        self.running = False
+        self._jobs.put(None)
+
+
+def detection_process_main(frame_buffer, pyramid_level, requests, results):
+    """
+    识别子进程入口：requests 中为 (任务编号, 槽位索引, 帧序号)，None 表示退出
+    帧直接从共享帧缓冲区读取，结果写入 results：("result", 任务编号, (识别记录, 工件信息列表, 识别耗时))、
+    ("error", 任务编号, 错误信息) 或 ("log", None, 日志)；
+    交来的帧引用在写入该任务的结果或错误之前释放
+    """
+    def log(message):
+        results.put(("log", None, message))
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        job_id, index, seq = request
+        started_at = time.perf_counter()
+        try:
+            frame_ref = frame_buffer.adopt(index, seq)
+        except StaleFrameError as e:
+            frame_buffer.release(index)
+            results.put(("error", job_id, str(e)))
+            continue
+        try:
+            with frame_ref:
+                frame = frame_ref.frame
+                world_lut = get_world_lut(frame.shape[1], frame.shape[0])
+                record, workpiece_info_list = detect_objects(frame, log_callback=log, calibration=world_lut,
+                                                             pyramid_level=pyramid_level)
+            results.put(("result", job_id, (record, workpiece_info_list, time.perf_counter() - started_at)))
+        except Exception as e:
+            results.put(("error", job_id, str(e)))
+
+
+class ProcessDetectionQueue(DetectionQueue):
+    """
+    在独立进程中识别的 DetectionQueue：frame_buffer 为 SharedFrameRingBuffer（采集进程写入），
+    队列中只传递 (任务编号, 槽位索引, 帧序号)，识别进程直接读取共享内存中的帧，不拷贝也不 pickle；
+    识别记录与工件信息返回本进程后，发布结果、预览、场景缓存与保存仍在本进程完成
+    识别可以占满一个核而不与采集、界面争用 GIL；不支持流式识别
+    识别进程中的指标不可见，本进程按返回结果累计识别总耗时与工件数
+    识别进程意外退出时收回交给它、尚未释放的帧引用，下一次识别前重新启动识别进程
+    """
+
+    def __init__(self, frame_buffer, **kwargs):
+        if kwargs.get("streaming"):
+            raise ValueError("Streaming detection is not supported in a separate process")
+        super().__init__(**kwargs)
+        self.frame_buffer = frame_buffer
+        self._context = multiprocessing.get_context("spawn")
+        self._requests = None
+        self._results = None
+        self._process = None
+        self._handed_off = {}  # 任务编号 → 交给识别进程、尚未由其释放的槽位索引
+
+    def _start_process(self):
+        # 每个识别进程使用新的队列，已退出进程队列中残留的请求不会被新进程重复处理
+        self._requests = self._context.Queue()
+        self._results = self._context.Queue()
+        self._process = self._context.Process(
+            target=detection_process_main, name="detection", daemon=True,
+            args=(self.frame_buffer, self.pyramid_level, self._requests, self._results))
+        self._process.start()
+
+    def _reclaim(self):
+        """识别进程退出后，代它释放尚未释放的帧引用"""
+        for index in self._handed_off.values():
+            self.frame_buffer.release(index)
+        self._handed_off.clear()
+
+    def run(self):
+        self._start_process()
+        try:
+            super().run()
+        finally:
+            self._requests.put(None)
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+                self._reclaim()
+
+    def detect(self, job_id, frame_ref, timings):
+        if not self._process.is_alive():
+            self.log_callback("[系统] 识别进程已退出，重新启动")
+            self._reclaim()
+            self._start_process()
+        # 识别进程持有自己的引用，识别完成后释放；本进程的引用留给预览与保存
+        index, seq = self.frame_buffer.hand_off(frame_ref)
+        self._handed_off[job_id] = index
+        self._requests.put((job_id, index, seq))
+        while True:
+            try:
+                kind, result_job_id, payload = self._results.get(timeout=0.5)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    self._reclaim()
+                    raise RuntimeError("Detection process exited")
+                continue
+            if kind == "log":
+                self.log_callback(payload)
+                continue
+            # 识别进程写入结果或错误之前已释放该任务的帧引用
+            self._handed_off.pop(result_job_id, None)
+            if result_job_id != job_id:
+                continue
+            if kind == "error":
+                raise RuntimeError(payload)
+            record, workpiece_info_list, detect_time = payload
+            DETECTION_STAGE_SECONDS.observe(detect_time, stage="total")
+            for obj in record:
+                WORKPIECES_DETECTED.inc(shape=obj.shape)
+            return record, workpiece_info_list
+
+
+if QThread is not None:
+    # 识别工作线程
+    class DetectionWorker(QThread):
+        """DetectionQueue 的 Qt 包装：结果与日志通过信号返回 GUI 线程"""
+        result_ready = pyqtSignal(dict)
+        log_signal = pyqtSignal(str)
+
+        def __init__(self, max_pending=2, preview_size=(640, 512), pyramid_level=0, saver=None,
+                     result_channel=None, streaming=False, scene_cache=True, shared_frames=None):
+            """shared_frames 为 SharedFrameRingBuffer 时在独立进程中识别"""
+            super().__init__()
+            options = dict(max_pending=max_pending, preview_size=preview_size, pyramid_level=pyramid_level,
+                           saver=saver, result_channel=result_channel, streaming=streaming, scene_cache=scene_cache,
+                           on_result=self.result_ready.emit, log_callback=self.log_signal.emit)
+            if shared_frames is not None:
+                self.queue = ProcessDetectionQueue(shared_frames, **options)
+            else:
+                self.queue = DetectionQueue(**options)
+
+        @property
+        def pending(self):
+            return self.queue.pending
+
+        def submit(self, frame_ref, timings=None):
+            return self.queue.submit(frame_ref, timings)
+
+        def invalidate_scene_cache(self):
+            self.queue.invalidate_scene_cache()
+
+        def run(self):
+            self.queue.run()
+
+        def stop(self):
+            self.queue.stop()
+            self.wait()